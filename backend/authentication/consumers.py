@@ -1,9 +1,13 @@
+import asyncio
 import json
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from urllib.parse import parse_qs
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import AccessToken
 
+from .outbox import notification_dispatcher
+
 User = get_user_model()
 
 
@@ -16,21 +20,35 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             token = AccessToken(token)
             user_id = token.payload['user_id']
         except Exception:
-            user_id = ''
+            self.group_name = None
             await self.close()
+            return
 
+        notification_dispatcher.register_loop(asyncio.get_running_loop())
         self.group_name = f'room_{user_id}'
         await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
         )
         await self.accept()
+        await self.send_unread_count({'count': await self.get_unread_count(user_id)})
 
     async def disconnect(self, close_code):
+        if self.group_name is None:
+            return
         await self.channel_layer.group_discard(
             self.group_name,
             self.channel_name
         )
 
+    @database_sync_to_async
+    def get_unread_count(self, user_id):
+        return User.objects.filter(pk=user_id).values_list('unread_notifications', flat=True).first() or 0
+
     async def send_notification(self, event):
         await self.send(text_data=json.dumps(event['notification']))
+        if 'unread_count' in event:
+            await self.send_unread_count({'count': event['unread_count']})
+
+    async def send_unread_count(self, event):
+        await self.send(text_data=json.dumps({'type': 'unread_count', 'count': event['count']}))
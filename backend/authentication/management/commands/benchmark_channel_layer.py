@@ -0,0 +1,75 @@
+import asyncio
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from core.layers import PostgresChannelLayer
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure group_send throughput and delivery latency of the in-memory and the PostgreSQL channel layer. '
+        'The PostgreSQL layer sends from one layer instance to another, as between two processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000, help='Messages sent to the group.')
+        parser.add_argument('--members', type=int, default=10, help='Channels in the group.')
+        parser.add_argument('--layers', nargs='+', choices=['memory', 'postgres'], default=['memory', 'postgres'])
+        parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for the deliveries.')
+
+    def handle(self, *args, **options):
+        for name in options['layers']:
+            result = async_to_sync(self.run)(name, options['messages'], options['members'], options['timeout'])
+            self.stdout.write(
+                f'{name}: {result["delivered"]}/{result["expected"]} messages delivered in {result["elapsed"]:.2f}s, '
+                f'{result["delivered"] / result["elapsed"]:.0f} deliveries/s, '
+                f'latency p50 {result["p50"]:.2f}ms p99 {result["p99"]:.2f}ms'
+            )
+
+    async def run(self, name, messages, members, timeout):
+        # the receivers must hold every message, the benchmark measures throughput and not dropping
+        if name == 'memory':
+            sender = receiver = InMemoryChannelLayer(capacity=messages)
+        else:
+            sender, receiver = PostgresChannelLayer(capacity=messages), PostgresChannelLayer(capacity=messages)
+            await receiver.start_listener()
+
+        channels = [await receiver.new_channel() for _ in range(members)]
+        for channel in channels:
+            await receiver.group_add('benchmark', channel)
+
+        latencies = []
+
+        async def consume(channel):
+            for _ in range(messages):
+                message = await receiver.receive(channel)
+                latencies.append(time.perf_counter() - message['sent'])
+
+        consumers = [asyncio.create_task(consume(channel)) for channel in channels]
+        start = time.perf_counter()
+        for number in range(messages):
+            await sender.group_send('benchmark', {'type': 'benchmark', 'number': number, 'sent': time.perf_counter()})
+        try:
+            await asyncio.wait_for(asyncio.gather(*consumers), timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - start
+
+        # the group table is shared with the running deployment, flush() would drop its members too
+        for channel in channels:
+            await receiver.group_discard('benchmark', channel)
+        for layer in {sender, receiver}:
+            await layer.close()
+
+        latencies.sort()
+        return {
+            'expected': messages * members,
+            'delivered': len(latencies),
+            'elapsed': elapsed,
+            'p50': statistics.median(latencies) * 1000 if latencies else 0,
+            'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0,
+        }
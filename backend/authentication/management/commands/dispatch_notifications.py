@@ -0,0 +1,33 @@
+import time
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.outbox import notification_dispatcher
+
+
+class Command(BaseCommand):
+    help = 'Send queued notifications to the websockets, for deployments that run the outbox in its own process.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Send the due notifications and exit.')
+        parser.add_argument('--interval', type=float, default=1,
+                            help='Seconds between polls of the outbox.')
+
+    def handle(self, *args, **options):
+        # the in-memory layer of this process cannot reach the websockets held by the daphne processes
+        if isinstance(get_channel_layer(), InMemoryChannelLayer):
+            raise CommandError(
+                'The in-memory channel layer only reaches websockets of its own process, '
+                'run the command with CHANNEL_LAYER=postgres.'
+            )
+
+        if options['once']:
+            sent = notification_dispatcher.dispatch_all()
+            self.stdout.write(f'Notifications dispatched: {sent}')
+            return
+
+        while True:
+            if notification_dispatcher.dispatch() < settings.NOTIFICATION_DISPATCH_BATCH_SIZE:
+                time.sleep(options['interval'])
@@ -0,0 +1,124 @@
+import asyncio
+import secrets
+import time
+import tracemalloc
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import UserAccount, Notification
+from authentication.outbox import notification_dispatcher
+from core.asgi import application
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return '-'
+    pick = lambda share: values[min(int(len(values) * share), len(values) - 1)] * 1000
+    return f'p50 {pick(0.5):.1f}ms p95 {pick(0.95):.1f}ms p99 {pick(0.99):.1f}ms max {values[-1] * 1000:.1f}ms'
+
+
+class Command(BaseCommand):
+    help = (
+        'Open JWT-authenticated notification websockets against the in-process ASGI application, create '
+        'notifications at a fixed rate and report connect time, delivery latency and memory per connection. '
+        'Temporary users are created for the run and deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=100, help='Websockets to open.')
+        parser.add_argument('--users', type=int, default=10,
+                            help='Users the connections are spread over, each user is a group of connections.')
+        parser.add_argument('--notifications', type=int, default=100, help='Notifications to create.')
+        parser.add_argument('--rate', type=float, default=50, help='Notifications created per second.')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for the deliveries.')
+
+    def handle(self, *args, **options):
+        run = secrets.token_hex(4)
+        users = UserAccount.objects.bulk_create([
+            UserAccount(username=f'loadtest-{run}-{number}', email=f'loadtest-{run}-{number}@example.com')
+            for number in range(options['users'])
+        ])
+        try:
+            report = async_to_sync(self.run)(users, options)
+        finally:
+            UserAccount.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        self.stdout.write(
+            f'Connections: {options["connections"]} over {options["users"]} users, '
+            f'{report["memory"] / 1024:.1f} KiB traced memory per connection'
+        )
+        self.stdout.write(f'Connect: {percentiles(report["connect"])}')
+        self.stdout.write(
+            f'Deliveries: {len(report["latencies"])}/{report["expected"]} '
+            f'for {options["notifications"]} notifications at {options["rate"]:g}/s'
+        )
+        self.stdout.write(f'Delivery latency: {percentiles(report["latencies"])}')
+
+    async def run(self, users, options):
+        tracemalloc.start()
+        traced = tracemalloc.get_traced_memory()[0]
+        sockets, connect = [], []
+        for number in range(options['connections']):
+            user = users[number % len(users)]
+            socket = WebsocketCommunicator(application, f'/ws/notify/?token={AccessToken.for_user(user)}')
+            start = time.perf_counter()
+            connected, _ = await socket.connect()
+            if not connected:
+                raise RuntimeError('Websocket connection was refused.')
+            # the connection is ready once the unread count arrived
+            await socket.receive_json_from()
+            connect.append(time.perf_counter() - start)
+            sockets.append((user, socket))
+        memory = (tracemalloc.get_traced_memory()[0] - traced) / len(sockets)
+        tracemalloc.stop()
+
+        received = []
+
+        async def listen(socket):
+            while True:
+                event = await socket.receive_json_from(timeout=options['timeout'])
+                if 'id' in event:
+                    received.append((event['id'], time.perf_counter()))
+
+        listeners = [asyncio.create_task(listen(socket)) for _, socket in sockets]
+        connections_per_user = {}
+        for user, _ in sockets:
+            connections_per_user[user.pk] = connections_per_user.get(user.pk, 0) + 1
+
+        create = database_sync_to_async(Notification.objects.create)
+        dispatch = database_sync_to_async(notification_dispatcher.dispatch_all)
+        created, expected = {}, 0
+        start = time.perf_counter()
+        for number in range(options['notifications']):
+            await asyncio.sleep(max(start + number / options['rate'] - time.perf_counter(), 0))
+            user = users[number % len(users)]
+            sent = time.perf_counter()
+            notification = await create(recipient=user, sender=None, message=f'Load test notification {number}')
+            created[notification.pk] = sent
+            expected += connections_per_user.get(user.pk, 0)
+            if not settings.NOTIFICATION_DISPATCH_INTERVAL:
+                # without the background dispatcher the pushes are sent from here
+                await dispatch()
+
+        deadline = time.perf_counter() + options['timeout']
+        while len(received) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+        for listener in listeners:
+            listener.cancel()
+        await asyncio.gather(*listeners, return_exceptions=True)
+        for _, socket in sockets:
+            await socket.disconnect()
+
+        return {
+            'memory': memory,
+            'connect': connect,
+            'expected': expected,
+            'latencies': [at - created[pk] for pk, at in received if pk in created],
+        }
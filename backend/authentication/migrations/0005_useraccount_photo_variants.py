@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0004_alter_notification_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useraccount',
+            name='photo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:43
+
+import stories.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0005_useraccount_photo_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='useraccount',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, storage=stories.storage.media_storage, upload_to='profile_photos/'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:53
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_unread_notifications(apps, schema_editor):
+    UserAccount = apps.get_model('authentication', 'UserAccount')
+    Notification = apps.get_model('authentication', 'Notification')
+
+    unread = Notification.objects.filter(recipient=OuterRef('pk'), is_read=False).order_by().values('recipient')
+    UserAccount.objects.update(
+        unread_notifications=Coalesce(Subquery(unread.annotate(count=Count('pk')).values('count')), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0008_notification_coalescing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useraccount',
+            name='notifications_read_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='useraccount',
+            name='unread_notifications',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_unread_notifications, migrations.RunPython.noop),
+    ]
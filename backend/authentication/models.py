@@ -1,7 +1,13 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.utils import timezone
 
+from stories.storage import media_storage
+
 
 class UserAccountManager(BaseUserManager):
     def create_user(self, email, username=None, password=None, **extra_fields):
@@ -30,7 +36,11 @@ class UserAccount(AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(max_length=255, unique=True)
     first_name = models.CharField(max_length=255, blank=True, null=True)
     last_name = models.CharField(max_length=255, blank=True, null=True)
-    photo = models.ImageField(upload_to='profile_photos/', blank=True, null=True)
+    photo = models.ImageField(upload_to='profile_photos/', storage=media_storage, blank=True, null=True)
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # notifications created up to this moment are read, unread_notifications counts the newer ones
+    notifications_read_until = models.DateTimeField(null=True, blank=True, editable=False)
+    unread_notifications = models.PositiveIntegerField(default=0, editable=False)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     date_joined = models.DateTimeField(default=timezone.now)
@@ -41,21 +51,92 @@ class UserAccount(AbstractBaseUser, PermissionsMixin):
     REQUIRED_FIELDS = ['username']
 
     def get_count_unread_notifications(self):
-        return self.notifications.filter(is_read=False).count()
+        return self.unread_notifications
+
+    def mark_notifications_read(self):
+        self.notifications_read_until = timezone.now()
+        self.unread_notifications = 0
+        UserAccount.objects.filter(pk=self.pk).update(
+            notifications_read_until=self.notifications_read_until, unread_notifications=0
+        )
 
     def __str__(self):
         return self.username
 
 
+class NotificationQuerySet(models.QuerySet):
+    def unread(self):
+        return self.filter(is_read=False).exclude(created_at__lte=F('recipient__notifications_read_until'))
+
+
 class Notification(models.Model):
     recipient = models.ForeignKey(UserAccount, related_name='notifications', on_delete=models.CASCADE)
     sender = models.ForeignKey(UserAccount, null=True, blank=True, on_delete=models.SET_NULL)
     message = models.TextField(max_length=5000)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # notifications with the same key are merged into one row, count is the number of merged events
+    group_key = models.CharField(max_length=255, blank=True, default='')
+    count = models.PositiveIntegerField(default=1)
+
+    objects = NotificationQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', 'group_key', '-created_at'], name='notification_group_idx'),
+        ]
 
     def __str__(self):
         return f'{self.sender if self.sender else "Application"} to {self.recipient.username}'
+
+    @property
+    def read(self):
+        read_until = self.recipient.notifications_read_until
+        return self.is_read or (read_until is not None and self.created_at <= read_until)
+
+    @classmethod
+    def coalesce(cls, recipient, sender, group_key, message, group_message):
+        """
+        Creates a notification, or merges it into the unread one with the same group key
+        that was created within NOTIFICATION_COALESCE_WINDOW seconds.
+
+        group_message is called with the number of merged events and returns the text of the merged row.
+        The merged row keeps its place in the list and its pending push is only sent once.
+        """
+        if not group_key:
+            return cls.objects.create(recipient=recipient, sender=sender, message=message)
+
+        since = timezone.now() - timedelta(seconds=settings.NOTIFICATION_COALESCE_WINDOW)
+        with transaction.atomic():
+            notification = (
+                cls.objects.select_for_update(of=('self',))
+                .filter(recipient=recipient, group_key=group_key, created_at__gte=since).unread()
+                .order_by('-created_at').first()
+            )
+            if notification is None:
+                return cls.objects.create(recipient=recipient, sender=sender, group_key=group_key, message=message)
+
+            notification.count += 1
+            notification.sender = sender
+            notification.message = group_message(notification.count)
+            notification.save(update_fields=['count', 'sender', 'message'])
+            return notification
+
+
+class NotificationDelivery(models.Model):
+    # outbox row, written in the transaction of its notification and removed once the push was sent
+    notification = models.OneToOneField(Notification, related_name='delivery', on_delete=models.CASCADE)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'Delivery of {self.notification_id} ({self.attempts} attempts)'
+
+    @classmethod
+    def enqueue(cls, notification):
+        # a delivery that is pending or being sent is due again, the dispatcher sends the current row
+        cls.objects.update_or_create(
+            notification=notification, defaults={'available_at': timezone.now(), 'attempts': 0, 'last_error': ''}
+        )
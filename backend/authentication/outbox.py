@@ -0,0 +1,194 @@
+import asyncio
+import atexit
+import logging
+import threading
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import NotificationDelivery
+from .serializers import NotificationSerializer
+
+logger = logging.getLogger(__name__)
+
+# seconds a claimed delivery stays hidden from other dispatchers, after that it is sent again
+LEASE_SECONDS = 60
+
+
+def notification_group(user_id):
+    return f'room_{user_id}'
+
+
+class NotificationDispatcher:
+    """
+    Sends the notifications queued in NotificationDelivery to the channel layer.
+
+    Deliveries are claimed in batches with SKIP LOCKED, so several processes can dispatch at once,
+    and the pushes of a batch are sent concurrently. Failed pushes are retried with an exponential
+    backoff, a crashed dispatcher leaves its deliveries to be sent again when their lease runs out.
+    A background thread dispatches every interval and right after a notification is committed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+        self._stopped = False
+        # user id: unread count to push, kept in memory as clients also receive the count on connect
+        self._unread_counts = {}
+        self.loop = None
+
+    @property
+    def interval(self):
+        return settings.NOTIFICATION_DISPATCH_INTERVAL
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def register_loop(self, loop):
+        # the event loop of the websocket consumers, the in-memory channel layer is not thread safe
+        self.loop = loop
+
+    def send_all(self, messages):
+        loop = self.loop
+        if loop is not None and loop.is_running():
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is not loop:
+                return asyncio.run_coroutine_threadsafe(self.send(messages), loop).result()
+        return async_to_sync(self.send)(messages)
+
+    def push_unread_count(self, user):
+        """
+        Sends the unread count of the user with the next dispatch, after the transaction commits.
+
+        The counts are kept in this process, so only its background thread sends them. Without it,
+        when the outbox runs in the dispatch_notifications process, the count is not pushed and
+        clients get it with the next notification or when they connect.
+        """
+        if not self.interval:
+            # sending here would make the request that read the notifications wait for the fan-out
+            return
+
+        def queue():
+            with self._lock:
+                self._unread_counts[user.pk] = user.unread_notifications
+            self.wake()
+
+        transaction.on_commit(queue)
+
+    def start(self):
+        if self._thread is not None or not self.interval:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.dispatch_all()
+            except Exception:
+                logger.exception('Failed to dispatch notifications')
+            finally:
+                connection.close()
+
+    def dispatch_all(self):
+        sent = self.dispatch_unread_counts()
+        while True:
+            count = self.dispatch()
+            sent += count
+            if count < settings.NOTIFICATION_DISPATCH_BATCH_SIZE:
+                return sent
+
+    def dispatch(self):
+        """
+        Sends one batch of due deliveries and returns the number of deliveries that were claimed.
+        """
+        lease_until = timezone.now() + timedelta(seconds=LEASE_SECONDS)
+        deliveries = self.claim(lease_until)
+        if not deliveries:
+            return 0
+
+        messages = [
+            (notification_group(delivery.notification.recipient_id), {
+                'type': 'send_notification',
+                'notification': NotificationSerializer(delivery.notification).data,
+                'unread_count': delivery.notification.recipient.unread_notifications,
+            })
+            for delivery in deliveries
+        ]
+        results = self.send_all(messages)
+
+        delivered = [delivery.pk for delivery, error in zip(deliveries, results) if error is None]
+        # a notification updated while it was sent was queued again, its new available_at keeps it
+        NotificationDelivery.objects.filter(pk__in=delivered, available_at=lease_until).delete()
+
+        for delivery, error in zip(deliveries, results):
+            if error is not None:
+                self.retry(delivery, error, lease_until)
+        return len(deliveries)
+
+    def dispatch_unread_counts(self):
+        with self._lock:
+            counts, self._unread_counts = self._unread_counts, {}
+        if counts:
+            # a count that cannot be sent is not retried, it is outdated by the next one anyway
+            self.send_all([
+                (notification_group(user_id), {'type': 'send_unread_count', 'count': count})
+                for user_id, count in counts.items()
+            ])
+        return len(counts)
+
+    def claim(self, lease_until):
+        with transaction.atomic():
+            deliveries = list(
+                NotificationDelivery.objects
+                .select_for_update(skip_locked=True, of=('self',))
+                .filter(available_at__lte=timezone.now())
+                .select_related('notification__sender', 'notification__recipient')
+                .order_by('available_at', 'pk')[:settings.NOTIFICATION_DISPATCH_BATCH_SIZE]
+            )
+            NotificationDelivery.objects.filter(pk__in=[delivery.pk for delivery in deliveries]).update(
+                available_at=lease_until
+            )
+        return deliveries
+
+    async def send(self, messages):
+        channel_layer = get_channel_layer()
+        return await asyncio.gather(
+            *(channel_layer.group_send(group, message) for group, message in messages), return_exceptions=True
+        )
+
+    def retry(self, delivery, error, lease_until):
+        attempts = delivery.attempts + 1
+        pending = NotificationDelivery.objects.filter(pk=delivery.pk, available_at=lease_until)
+        if attempts >= settings.NOTIFICATION_DELIVERY_MAX_ATTEMPTS:
+            logger.warning('Dropping notification %s after %s attempts: %r', delivery.notification_id, attempts, error)
+            pending.delete()
+            return
+        delay = settings.NOTIFICATION_DELIVERY_RETRY_DELAY * 2 ** (attempts - 1)
+        pending.update(
+            attempts=attempts, last_error=repr(error), available_at=timezone.now() + timedelta(seconds=delay)
+        )
+
+
+notification_dispatcher = NotificationDispatcher()
@@ -1,6 +1,7 @@
 from djoser.serializers import UserSerializer
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
+from stories.thumbnails import variant_url
 
 from .models import Notification
 
@@ -9,15 +10,25 @@ User = get_user_model()
 
 class UserAccountSerializer(UserSerializer):
     photo = serializers.SerializerMethodField(read_only=True)
+    photo_original = serializers.SerializerMethodField(read_only=True)
 
     class Meta(UserSerializer.Meta):
         model = User
         fields = [
             'id', 'email', 'username',
-            'first_name', 'last_name', 'photo'
+            'first_name', 'last_name', 'photo', 'photo_original'
         ]
 
     def get_photo(self, obj):
+        if obj.photo:
+            url = variant_url(obj.photo, obj.photo_variants, 'avatar')
+            request = self.context.get('request')
+            if request:
+                return request.build_absolute_uri(url)
+            return url
+        return None
+
+    def get_photo_original(self, obj):
         if obj.photo:
             request = self.context.get('request')
             if request:
@@ -36,10 +47,11 @@ class UserAccountCreateSerializer(UserSerializer):
 
 class NotificationSerializer(serializers.ModelSerializer):
     sender = UserAccountSerializer(read_only=True)
+    is_read = serializers.BooleanField(source='read', read_only=True)
 
     class Meta:
         model = Notification
         fields = [
-            'id', 'recipient', 'sender', 'message', 'is_read', 'created_at'
+            'id', 'recipient', 'sender', 'message', 'count', 'is_read', 'created_at'
         ]
 
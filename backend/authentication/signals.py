@@ -1,20 +1,31 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 
-from .models import Notification
-from .serializers import NotificationSerializer
+from .models import UserAccount, Notification, NotificationDelivery
+from .outbox import notification_dispatcher
 
 
 @receiver(post_save, sender=Notification)
-def notification_created(sender, instance, created, **kwargs):
-    if created:
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'room_{instance.recipient.pk}',
-            {
-                'type': 'send_notification',
-                'notification': NotificationSerializer(instance).data
-            }
-        )
+def notification_saved(sender, instance, created, **kwargs):
+    if created and not instance.is_read:
+        # a notification at or before the read watermark is already read, as in notification_deleted
+        UserAccount.objects.filter(pk=instance.recipient_id).exclude(
+            notifications_read_until__gte=instance.created_at
+        ).update(unread_notifications=F('unread_notifications') + 1)
+
+    # the push is sent by the dispatcher, the request that created the notification never waits for it,
+    # merged notifications refresh their pending delivery instead of queueing another push
+    NotificationDelivery.enqueue(instance)
+    transaction.on_commit(notification_dispatcher.wake)
+
+
+@receiver(post_delete, sender=Notification)
+def notification_deleted(sender, instance, **kwargs):
+    if instance.is_read:
+        return
+    # only notifications newer than the read watermark are counted as unread
+    UserAccount.objects.filter(pk=instance.recipient_id, unread_notifications__gt=0).exclude(
+        notifications_read_until__gte=instance.created_at
+    ).update(unread_notifications=F('unread_notifications') - 1)
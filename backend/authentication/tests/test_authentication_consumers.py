@@ -0,0 +1,58 @@
+import io
+
+import pytest
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ..consumers import NotificationConsumer
+from ..models import UserAccount
+from ..outbox import notification_dispatcher
+
+# the consumer reads the database from its own thread, which does not see a test transaction
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+def communicator(token):
+    return WebsocketCommunicator(NotificationConsumer.as_asgi(), f'/ws/notify/?token={token}')
+
+
+class TestNotificationConsumer:
+    def test_unread_count_on_connect_and_notification(self, user_factory, notification_factory):
+        user = user_factory(photo=None)
+        notification_factory(recipient=user, sender=None)
+        notification_dispatcher.dispatch()
+
+        @async_to_sync
+        async def receive():
+            socket = communicator(AccessToken.for_user(user))
+            assert (await socket.connect())[0]
+            events = [await socket.receive_json_from()]
+            await database_sync_to_async(notification_factory)(recipient=user, sender=None)
+            await database_sync_to_async(notification_dispatcher.dispatch)()
+            events += [await socket.receive_json_from(), await socket.receive_json_from()]
+            await socket.disconnect()
+            return events
+
+        events = receive()
+        assert events[0] == {'type': 'unread_count', 'count': 1}
+        assert 'message' in events[1] and 'type' not in events[1]
+        assert events[2] == {'type': 'unread_count', 'count': 2}
+
+    def test_invalid_token_is_rejected(self):
+        @async_to_sync
+        async def connect():
+            return (await communicator('invalid').connect())[0]
+
+        assert not connect()
+
+
+class TestLoadtestNotifications:
+    def test_reports_deliveries(self):
+        output = io.StringIO()
+        call_command('loadtest_notifications', connections=4, users=2, notifications=4, rate=100, stdout=output)
+
+        assert 'Deliveries: 8/8 for 4 notifications' in output.getvalue()
+        assert not UserAccount.objects.filter(username__startswith='loadtest-').exists()
@@ -2,6 +2,8 @@ import json
 import pytest
 from django.shortcuts import reverse
 
+from ..models import Notification
+
 pytestmark = pytest.mark.django_db
 
 
@@ -17,3 +19,24 @@ class TestNotificationEndpoints:
         response = api_client.get(url, format='json')
         assert response.status_code == 200
         assert len(json.loads(response.content).get('results')) == 1
+
+    def test_read_watermark(self, notification_factory, user_factory, get_jwt_token, api_client,
+                            django_assert_num_queries):
+        recipient = user_factory(photo=None)
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=recipient)}')
+        notification_factory.create_batch(3, recipient=recipient, sender=None)
+        deleted = notification_factory(recipient=recipient, sender=None)
+        deleted.delete()
+
+        # the count is read from the user that authentication loads anyway
+        with django_assert_num_queries(1):
+            response = api_client.get(reverse('count-unread-notifications'))
+        assert response.data['count'] == 3
+
+        response = api_client.get(reverse('notifications'))
+        assert [notification['is_read'] for notification in response.data['results']] == [True] * 3
+        assert api_client.get(reverse('count-unread-notifications')).data['count'] == 0
+        assert Notification.objects.filter(recipient=recipient).unread().count() == 0
+
+        notification_factory(recipient=recipient, sender=None)
+        assert api_client.get(reverse('count-unread-notifications')).data['count'] == 1
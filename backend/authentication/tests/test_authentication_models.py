@@ -1,7 +1,10 @@
+from datetime import timedelta
+
 import pytest
+from django.utils import timezone
 
 from ..models import (
-    Notification
+    Notification, NotificationDelivery
 )
 
 pytestmark = pytest.mark.django_db
@@ -13,3 +16,46 @@ class TestNotificationModel:
 
         assert Notification.objects.count() == 1
         assert Notification.objects.first().message == 'hello'
+
+    def test_notification_behind_watermark_is_not_counted(self, notification_factory, user_factory):
+        recipient = user_factory(photo=None)
+        notification_factory(recipient=recipient, sender=None)
+        # e.g. a notification whose transaction started before the list was read
+        recipient.notifications_read_until = timezone.now() + timedelta(minutes=1)
+        recipient.save(update_fields=['notifications_read_until'])
+        notification_factory(recipient=recipient, sender=None)
+
+        recipient.refresh_from_db()
+        assert recipient.unread_notifications == 1
+
+
+class TestNotificationCoalescing:
+    def coalesce(self, recipient, sender, key='comment:story:1'):
+        return Notification.coalesce(
+            recipient=recipient, sender=sender, group_key=key, message=f'{sender} commented',
+            group_message=lambda count: f'{count} new comments'
+        )
+
+    def test_merges_unread_notifications(self, user_factory):
+        recipient, first, second = user_factory.create_batch(3, photo=None)
+        self.coalesce(recipient, first)
+        notification = self.coalesce(recipient, second)
+
+        assert Notification.objects.get() == notification
+        assert notification.count == 2
+        assert notification.sender == second
+        assert notification.message == '2 new comments'
+        assert NotificationDelivery.objects.get().notification == notification
+
+        self.coalesce(recipient, first, key='comment:story:2')
+        assert Notification.objects.count() == 2
+
+    def test_read_or_old_notifications_start_a_group(self, user_factory):
+        recipient, sender = user_factory.create_batch(2, photo=None)
+        self.coalesce(recipient, sender)
+        Notification.objects.update(is_read=True)
+        self.coalesce(recipient, sender)
+        Notification.objects.update(created_at=timezone.now() - timedelta(days=1))
+        self.coalesce(recipient, sender)
+
+        assert list(Notification.objects.values_list('count', flat=True)) == [1, 1, 1]
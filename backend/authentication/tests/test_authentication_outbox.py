@@ -0,0 +1,103 @@
+import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.core.management import CommandError, call_command
+from django.shortcuts import reverse
+from django.utils import timezone
+
+from ..models import NotificationDelivery
+from ..outbox import notification_dispatcher, notification_group
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def channel_layer():
+    layer = get_channel_layer()
+    yield layer
+    async_to_sync(layer.flush)()
+
+
+def listen(channel_layer, user):
+    channel = async_to_sync(channel_layer.new_channel)()
+    async_to_sync(channel_layer.group_add)(notification_group(user.pk), channel)
+    return channel
+
+
+class TestNotificationOutbox:
+    def test_comment_queues_delivery(self, story_factory, user_factory, get_jwt_token, api_client, channel_layer):
+        story = story_factory(author__photo=None)
+        channel = listen(channel_layer, story.author)
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(user_factory(photo=None))}')
+
+        response = api_client.post(reverse('comments-list'), {'story': story.pk, 'text': 'hello'}, format='json')
+        assert response.status_code == 201
+        delivery = NotificationDelivery.objects.get()
+        assert delivery.notification.recipient == story.author
+
+        assert notification_dispatcher.dispatch() == 1
+        event = async_to_sync(channel_layer.receive)(channel)
+        assert event['type'] == 'send_notification'
+        assert event['notification']['id'] == delivery.notification_id
+        assert event['unread_count'] == 1
+        assert not NotificationDelivery.objects.exists()
+
+    def test_reading_pushes_unread_count(self, notification_factory, get_jwt_token, api_client, channel_layer,
+                                         django_capture_on_commit_callbacks, settings, monkeypatch):
+        settings.NOTIFICATION_DISPATCH_INTERVAL = 60
+        # the background thread is not started, the test dispatches in its place
+        monkeypatch.setattr(notification_dispatcher, 'start', lambda: None)
+        notification = notification_factory(sender=None, recipient__photo=None)
+        channel = listen(channel_layer, notification.recipient)
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=notification.recipient)}')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert api_client.get(reverse('notifications')).status_code == 200
+        # queued for the dispatcher, the request itself sent nothing
+        assert notification_dispatcher.dispatch_unread_counts() == 1
+        assert async_to_sync(channel_layer.receive)(channel) == {'type': 'send_unread_count', 'count': 0}
+
+    def test_reading_without_dispatcher_sends_nothing(self, notification_factory, get_jwt_token, api_client,
+                                                      django_capture_on_commit_callbacks):
+        notification = notification_factory(sender=None, recipient__photo=None)
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=notification.recipient)}')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert api_client.get(reverse('notifications')).status_code == 200
+        assert notification_dispatcher.dispatch_unread_counts() == 0
+
+    def test_failed_push_is_retried(self, notification_factory, channel_layer, monkeypatch, settings):
+        settings.NOTIFICATION_DELIVERY_MAX_ATTEMPTS = 2
+
+        async def group_send(group, message):
+            raise ConnectionError('layer is down')
+
+        monkeypatch.setattr(channel_layer, 'group_send', group_send)
+        notification = notification_factory(sender=None)
+
+        assert notification_dispatcher.dispatch() == 1
+        delivery = NotificationDelivery.objects.get()
+        assert delivery.attempts == 1
+        assert 'layer is down' in delivery.last_error
+        assert delivery.available_at > timezone.now()
+        assert notification_dispatcher.dispatch() == 0
+
+        NotificationDelivery.objects.update(available_at=timezone.now())
+        assert notification_dispatcher.dispatch() == 1
+        assert not NotificationDelivery.objects.filter(notification=notification).exists()
+
+    def test_update_during_send_is_sent_again(self, notification_factory, channel_layer, monkeypatch):
+        notification = notification_factory(sender=None)
+
+        async def group_send(group, message):
+            # the notification changes while its push is in flight
+            await sync_to_async(NotificationDelivery.enqueue)(notification)
+
+        monkeypatch.setattr(channel_layer, 'group_send', group_send)
+
+        notification_dispatcher.dispatch()
+        assert NotificationDelivery.objects.filter(notification=notification).exists()
+
+    def test_command_refuses_in_memory_layer(self):
+        with pytest.raises(CommandError):
+            call_command('dispatch_notifications', once=True)
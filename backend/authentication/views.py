@@ -3,7 +3,6 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
-from django.db import transaction
 
 from .models import (
     Notification
@@ -11,29 +10,26 @@ from .models import (
 from .serializers import (
     NotificationSerializer
 )
-from stories.pagination import MyPagePagination
+from .outbox import notification_dispatcher
+from stories.pagination import KeysetPagination
 
 
 class NotificationListAPIView(ListAPIView):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = MyPagePagination
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         queryset = super().get_queryset()
         user = self.request.user
-        queryset = queryset.filter(recipient=user)
-        unread_queryset = queryset.filter(is_read=False)
-
-        with transaction.atomic():
-            unread_queryset.update(is_read=True)
-
-        return queryset
+        # moving the read watermark marks every notification read with a single row update
+        user.mark_notifications_read()
+        notification_dispatcher.push_unread_count(user)
+        return queryset.filter(recipient=user).select_related('recipient', 'sender')
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def count_unread_notifications(request):
-    count_unread = Notification.objects.filter(recipient=request.user, is_read=False).count()
-    return Response({'count': count_unread}, status=status.HTTP_200_OK)
+    return Response({'count': request.user.get_count_unread_notifications()}, status=status.HTTP_200_OK)
@@ -2,7 +2,9 @@ import pytest
 from pytest_factoryboy import register
 from rest_framework.test import APIClient
 from django.shortcuts import reverse
+from django.core.cache import cache
 
+from stories.buffers import view_buffer, progress_buffer
 from factories import (
     CategoryFactory, StoryFactory, UserFactory,
     IpAddressFactory, CommentFactory, CharacterFactory,
@@ -22,6 +24,22 @@ register(EpisodeFactory)
 register(MessageFactory)
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def write_behind_buffers(settings):
+    # tests flush the buffers explicitly instead of relying on background threads
+    settings.STORY_VIEWS_FLUSH_INTERVAL = None
+    settings.STORY_PROGRESS_FLUSH_INTERVAL = None
+    settings.NOTIFICATION_DISPATCH_INTERVAL = None
+    yield
+    view_buffer.take()
+    progress_buffer.take()
+
+
 @pytest.fixture
 def api_client():
     return APIClient()
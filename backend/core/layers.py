@@ -0,0 +1,340 @@
+import asyncio
+import hashlib
+import json
+import logging
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+
+import psycopg2
+from psycopg2 import errors
+from channels.layers import BaseChannelLayer
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL refuses NOTIFY payloads from 8000 bytes on, leave room for the channel names
+MAX_PAYLOAD_SIZE = 7900
+
+
+class PostgresChannelLayer(BaseChannelLayer):
+    """
+    Channel layer that connects several processes through PostgreSQL LISTEN/NOTIFY.
+
+    Each layer instance listens on a notification channel of its own and names the channels it creates
+    after it, so a message is only sent to the process that holds the receiving consumer. Messages to
+    channels of the same process skip the database. Group membership is kept in an unlogged table with
+    an expiry, group_send fans a message out with one NOTIFY per process, all sent in one statement.
+
+    Messages are encoded as JSON. One that does not fit into a NOTIFY payload is stored in a second
+    unlogged table until it expires, and the NOTIFY only carries its id. Like NOTIFY itself, delivery is
+    at most once: messages sent while a process is disconnected from the database are lost.
+    """
+    extensions = ['groups', 'flush']
+
+    def __init__(self, database='default', table='channel_layer_groups', message_table='channel_layer_messages',
+                 expiry=60, group_expiry=86400, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.database = database
+        self.table = table
+        self.message_table = message_table
+        self.group_expiry = group_expiry
+        self.process_name = secrets.token_hex(16)
+        self.queues = {}
+        # plain channel names this process receives from, they are listened to by name
+        self.listening = set()
+        self.connection = None
+        self.listener = None
+        self.listener_loop = None
+        self.listener_lock = None
+        # database calls block, they run one at a time on this thread, whatever event loop sends
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='channel-layer')
+
+    # Channel names
+
+    async def new_channel(self, prefix='specific.'):
+        return f'{prefix}.{self.process_name}!{secrets.token_hex(6)}'
+
+    def notify_channel(self, channel):
+        if '!' in channel:
+            process_name = channel[:channel.index('!')].rsplit('.', 1)[-1]
+            return f'channel_layer_{process_name}'
+        return f'channel_layer_{hashlib.md5(channel.encode()).hexdigest()}'
+
+    def is_local(self, channel):
+        return self.notify_channel(channel) == f'channel_layer_{self.process_name}'
+
+    # Database
+
+    def connect(self):
+        connection = psycopg2.connect(**connections[self.database].get_connection_params())
+        connection.autocommit = True
+        return connection
+
+    def create_table(self, connection):
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(
+                    f'CREATE UNLOGGED TABLE IF NOT EXISTS {self.table} ('
+                    f'group_name varchar(100) NOT NULL, channel varchar(100) NOT NULL, '
+                    f'expires_at timestamptz NOT NULL, PRIMARY KEY (group_name, channel))'
+                )
+                cursor.execute(
+                    f'CREATE UNLOGGED TABLE IF NOT EXISTS {self.message_table} ('
+                    f'id bigserial PRIMARY KEY, message text NOT NULL, expires_at timestamptz NOT NULL)'
+                )
+            except errors.UniqueViolation:
+                # another process created the table at the same moment
+                pass
+
+    def execute(self, sql, params=(), fetch=False):
+        for attempt in range(2):
+            try:
+                if self.connection is None or self.connection.closed:
+                    self.connection = self.connect()
+                    self.create_table(self.connection)
+                with self.connection.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    return cursor.fetchall() if fetch else None
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # the server closed the connection, reconnect once
+                self.connection = None
+                if attempt:
+                    raise
+
+    async def run(self, function, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, lambda: function(*args, **kwargs)
+        )
+
+    # Sending
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        assert '__asgi_channel__' not in message
+        await self.send_many([channel], message)
+
+    async def send_many(self, channels, message):
+        remote = {}
+        for channel in channels:
+            if self.is_local(channel):
+                self.deliver_threadsafe(channel, message)
+            else:
+                remote.setdefault(self.notify_channel(channel), []).append(channel)
+        if not remote:
+            return
+
+        encoded = json.dumps(message, cls=DjangoJSONEncoder, separators=(',', ':'))
+        if len(encoded) + 16 + self.MAX_NAME_LENGTH > MAX_PAYLOAD_SIZE:
+            body = f'"r":{await self.run(self.store, encoded)}'
+        else:
+            body = f'"m":{encoded}'
+
+        notify_channels, payloads = [], []
+        for notify_channel, targets in remote.items():
+            for payload in self.payloads(targets, body):
+                notify_channels.append(notify_channel)
+                payloads.append(payload)
+        await self.run(
+            self.execute,
+            'SELECT pg_notify(c, p) FROM unnest(%s::text[], %s::text[]) AS n(c, p)',
+            (notify_channels, payloads), fetch=True
+        )
+
+    def store(self, encoded):
+        # every process the message goes to reads the row, it is left to expire instead of being deleted
+        rows = self.execute(
+            f'WITH expired AS (DELETE FROM {self.message_table} WHERE expires_at < now()) '
+            f'INSERT INTO {self.message_table} (message, expires_at) '
+            f'VALUES (%s, now() + make_interval(secs => %s)) RETURNING id',
+            (encoded, self.expiry), fetch=True
+        )
+        return rows[0][0]
+
+    def payloads(self, channels, body):
+        """
+        Splits the channels over as few payloads as fit into a NOTIFY, body is the message or its stored id.
+        """
+        batch, size = [], len(body) + 12
+        for channel in channels:
+            if batch and size + len(channel) + 3 > MAX_PAYLOAD_SIZE:
+                yield self.payload(batch, body)
+                batch, size = [], len(body) + 12
+            batch.append(channel)
+            size += len(channel) + 3
+        yield self.payload(batch, body)
+
+    def payload(self, channels, body):
+        return f'{{"c":{json.dumps(channels, separators=(",", ":"))},{body}}}'
+
+    # Receiving
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        self.clean_expired()
+        await self.start_listener()
+        if not self.is_local(channel) and channel not in self.listening:
+            self.listening.add(channel)
+            self.listen(self.notify_channel(channel))
+
+        queue = self.queues.setdefault(channel, asyncio.Queue())
+        try:
+            while True:
+                expires, message = await queue.get()
+                if expires >= time.time():
+                    return message
+        finally:
+            if queue.empty() and self.queues.get(channel) is queue:
+                del self.queues[channel]
+
+    def clean_expired(self):
+        # channels of closed consumers keep the messages sent to them until they expire
+        now = time.time()
+        for channel, queue in list(self.queues.items()):
+            expired = False
+            while not queue.empty() and queue._queue[0][0] < now:
+                queue.get_nowait()
+                expired = True
+            # an empty queue without expired messages may have a receiver waiting on it
+            if expired and queue.empty():
+                del self.queues[channel]
+
+    def deliver_threadsafe(self, channel, message):
+        message = deepcopy(message)
+        loop = self.listener_loop
+        if loop is None or loop.is_closed():
+            self.deliver(channel, message)
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self.deliver(channel, message)
+        else:
+            loop.call_soon_threadsafe(self.deliver, channel, message)
+
+    def deliver(self, channel, message):
+        queue = self.queues.setdefault(channel, asyncio.Queue())
+        # like the in-memory layer, a full channel drops what a group sends to it
+        if queue.qsize() >= self.get_capacity(channel):
+            return
+        queue.put_nowait((time.time() + self.expiry, message))
+
+    async def start_listener(self):
+        if self.listener is not None:
+            return
+        if self.listener_lock is None:
+            self.listener_lock = asyncio.Lock()
+        async with self.listener_lock:
+            if self.listener is None:
+                self.listener_loop = asyncio.get_running_loop()
+                listener = await self.run(self.connect)
+                self.listener = listener
+                self.listen(f'channel_layer_{self.process_name}')
+                for channel in self.listening:
+                    self.listen(self.notify_channel(channel))
+                self.listener_loop.add_reader(listener.fileno(), self.read_notifications)
+
+    def listen(self, notify_channel):
+        with self.listener.cursor() as cursor:
+            cursor.execute(f'LISTEN {notify_channel}')
+
+    def read_notifications(self):
+        try:
+            self.listener.poll()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            logger.exception('Channel layer lost its listening connection')
+            self.stop_listener()
+            self.listener_loop.create_task(self.restart_listener())
+            return
+
+        while self.listener.notifies:
+            notify = self.listener.notifies.pop(0)
+            data = json.loads(notify.payload)
+            message = data['m'] if 'm' in data else self.load(data['r'])
+            if message is None:
+                continue
+            # every consumer gets a copy of its own, like with deliver_threadsafe
+            for channel in data['c']:
+                self.deliver(channel, deepcopy(message))
+
+    def load(self, pk):
+        # read right away on the listening connection, so stored messages keep their place in the order
+        try:
+            with self.listener.cursor() as cursor:
+                cursor.execute(f'SELECT message FROM {self.message_table} WHERE id = %s', (pk,))
+                row = cursor.fetchone()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # the next poll notices the closed connection and restarts the listener
+            logger.exception('Channel layer could not read stored message %s', pk)
+            return None
+        if row is None:
+            logger.warning('Channel layer message %s expired before it was read', pk)
+            return None
+        return json.loads(row[0])
+
+    def stop_listener(self):
+        if self.listener is None:
+            return
+        if not self.listener_loop.is_closed():
+            self.listener_loop.remove_reader(self.listener.fileno())
+        self.listener.close()
+        self.listener = None
+
+    async def restart_listener(self):
+        delay = 0.5
+        while self.listener is None:
+            try:
+                await self.start_listener()
+            except psycopg2.OperationalError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    # Groups
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await self.run(
+            self.execute,
+            f'WITH expired AS (DELETE FROM {self.table} WHERE group_name = %s AND expires_at < now()) '
+            f'INSERT INTO {self.table} (group_name, channel, expires_at) '
+            f'VALUES (%s, %s, now() + make_interval(secs => %s)) '
+            f'ON CONFLICT (group_name, channel) DO UPDATE SET expires_at = EXCLUDED.expires_at',
+            (group, group, channel, self.group_expiry)
+        )
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), 'Invalid channel name'
+        assert self.valid_group_name(group), 'Invalid group name'
+        await self.run(
+            self.execute, f'DELETE FROM {self.table} WHERE group_name = %s AND channel = %s', (group, channel)
+        )
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Invalid group name'
+        rows = await self.run(
+            self.execute,
+            f'SELECT channel FROM {self.table} WHERE group_name = %s AND expires_at >= now()',
+            (group,), fetch=True
+        )
+        if rows:
+            await self.send_many([channel for channel, in rows], message)
+
+    # Flush extension
+
+    async def flush(self):
+        self.queues = {}
+        await self.run(self.execute, f'DELETE FROM {self.table}')
+        await self.run(self.execute, f'DELETE FROM {self.message_table}')
+
+    async def close(self):
+        self.stop_listener()
+        if self.connection is not None:
+            await self.run(self.connection.close)
+            self.connection = None
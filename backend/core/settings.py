@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'djoser',
@@ -93,6 +94,65 @@ CHANNEL_LAYERS = {
     }
 }
 
+# The in-memory layer only reaches websockets of its own process,
+# CHANNEL_LAYER=postgres connects several daphne processes through LISTEN/NOTIFY
+if env('CHANNEL_LAYER', default='memory') == 'postgres':
+    CHANNEL_LAYERS['default'] = {
+        'BACKEND': 'core.layers.PostgresChannelLayer',
+        'CONFIG': {
+            'database': 'default',
+            'group_expiry': 24 * 60 * 60,
+        }
+    }
+
+# Story views are kept in memory and written in batches by a background thread,
+# set the interval to None to only write them on explicit flushes
+STORY_VIEWS_FLUSH_INTERVAL = 5
+STORY_VIEWS_BATCH_SIZE = 500
+# 'exact' stores a row per story and ip, 'sketch' keeps fixed-size HyperLogLog
+# sketches per story and day, run backfill_view_sketches before switching
+STORY_VIEWS_MODE = 'exact'
+
+# Reading positions are kept per user and story in memory and upserted in batches,
+# readers of the same process see a pending position before it is written
+STORY_PROGRESS_FLUSH_INTERVAL = 2
+STORY_PROGRESS_BATCH_SIZE = 500
+
+# Cached responses are invalidated through version keys, every process must share the cache for that:
+# the memory cache only fits a single process, set CACHE_URL to e.g. dbcache://cache_table
+# (after createcachetable) or rediscache://127.0.0.1:6379/1 (needs the redis package)
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Seconds an anonymous story, episode or category response stays cached,
+# model changes invalidate it earlier through version bumps
+RESPONSE_CACHE_TIMEOUT = 60
+
+# Threads that render the resized image variants after uploads,
+# 0 renders them in the request right after the transaction commits
+THUMBNAIL_WORKERS = 2
+
+# Chunked video and audio uploads are assembled here before they move to the media storage,
+# keep it out of MEDIA_ROOT so that unfinished files are never served
+MEDIA_UPLOAD_TEMP_DIR = BASE_DIR / 'upload_parts'
+MEDIA_UPLOAD_MAX_SIZE = 1024 * 1024 * 1024
+MEDIA_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# unreferenced media blobs saved within this many hours are kept, an upload
+# or a save of the same content may not have counted its reference yet
+MEDIA_BLOB_GRACE_HOURS = 24
+
+# Notifications are pushed to the websockets from an outbox after their transaction commits,
+# set the interval to None to leave the outbox to the dispatch_notifications command,
+# which runs in its own process and needs CHANNEL_LAYER=postgres
+NOTIFICATION_DISPATCH_INTERVAL = 5
+NOTIFICATION_DISPATCH_BATCH_SIZE = 500
+NOTIFICATION_DELIVERY_MAX_ATTEMPTS = 5
+# seconds before the first retry, doubled after every failed attempt
+NOTIFICATION_DELIVERY_RETRY_DELAY = 2
+# seconds in which notifications with the same group key, like comments on a story, are merged
+NOTIFICATION_COALESCE_WINDOW = 60 * 60
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
@@ -196,6 +256,28 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'mediafiles'
 
+# uploaded story, message and profile media is stored once per content digest by the 'media' storage,
+# generated files such as image variants use the plain default storage
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'media': {
+        'BACKEND': 'stories.storage.DeduplicatedFileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+# 'python' streams media from Django with HTTP Range support, 'x-accel-redirect' (nginx)
+# and 'x-sendfile' (apache, lighttpd) hand the transfer to the web server after the checks.
+# 'python' holds a worker per download and is meant for development and small deployments
+MEDIA_SERVE_MODE = env('MEDIA_SERVE_MODE', default='python')
+# most bytes sent for an open ended range such as 'bytes=0-'
+MEDIA_RANGE_CHUNK_SIZE = 8 * 1024 * 1024
+# internal nginx location that maps to MEDIA_ROOT for 'x-accel-redirect'
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
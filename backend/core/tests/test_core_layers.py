@@ -0,0 +1,90 @@
+import json
+
+import pytest
+from asgiref.sync import async_to_sync
+
+from ..layers import PostgresChannelLayer
+
+pytestmark = pytest.mark.django_db
+
+
+def run_with_layers(test, count=2, **config):
+    @async_to_sync
+    async def run():
+        layers = [PostgresChannelLayer(**config) for _ in range(count)]
+        try:
+            await layers[0].flush()
+            return await test(*layers)
+        finally:
+            for layer in layers:
+                await layer.close()
+    return run()
+
+
+class TestPostgresChannelLayer:
+    def test_send_between_processes(self):
+        async def test(sender, receiver):
+            channel = await receiver.new_channel()
+            await receiver.start_listener()
+            await sender.send(channel, {'type': 'hello', 'text': 'from another process'})
+            assert await receiver.receive(channel) == {'type': 'hello', 'text': 'from another process'}
+
+            # channels of the same process do not go through the database
+            local = await sender.new_channel()
+            await sender.send(local, {'type': 'local'})
+            assert await sender.receive(local) == {'type': 'local'}
+
+        run_with_layers(test)
+
+    def test_group_send_reaches_members_of_every_process(self):
+        async def test(first, second):
+            channels = [await first.new_channel(), await second.new_channel(), await second.new_channel()]
+            await first.start_listener()
+            await second.start_listener()
+            for channel in channels:
+                await first.group_add('room_1', channel)
+            await second.group_discard('room_1', channels[2])
+
+            await second.group_send('room_1', {'type': 'send_notification', 'id': 1})
+            assert await first.receive(channels[0]) == {'type': 'send_notification', 'id': 1}
+            assert await second.receive(channels[1]) == {'type': 'send_notification', 'id': 1}
+            assert channels[2] not in second.queues
+
+            # members in the same process receive copies, a consumer may change its message
+            channels.append(await second.new_channel())
+            await first.group_add('room_2', channels[1])
+            await first.group_add('room_2', channels[3])
+            await first.group_send('room_2', {'type': 'send_notification', 'ids': [1]})
+            received = await second.receive(channels[1])
+            received['ids'].append(2)
+            assert await second.receive(channels[3]) == {'type': 'send_notification', 'ids': [1]}
+
+        run_with_layers(test)
+
+    def test_group_membership_expires(self):
+        async def test(layer):
+            channel = await layer.new_channel()
+            await layer.group_add('room_1', channel)
+            await layer.group_send('room_1', {'type': 'expired'})
+            assert channel not in layer.queues
+
+        run_with_layers(test, count=1, group_expiry=-1)
+
+    def test_large_group_is_split_over_payloads(self):
+        layer = PostgresChannelLayer()
+        channels = [f'specific..{"a" * 32}!{index:012d}' for index in range(400)]
+        body = '"m":' + json.dumps({'type': 'send_notification', 'text': 'x' * 1000})
+        payloads = list(layer.payloads(channels, body))
+        assert len(payloads) > 1
+        assert all(len(payload) <= 8000 for payload in payloads)
+
+    def test_large_message_is_stored(self):
+        async def test(sender, receiver):
+            channel = await receiver.new_channel()
+            await receiver.start_listener()
+            # escaped to \uXXXX, 2000 characters of such text are far over a NOTIFY payload
+            message = {'type': 'send_notification', 'text': 'Привіт 👋 ' * 250}
+            await sender.send(channel, message)
+            assert await receiver.receive(channel) == message
+
+        run_with_layers(test)
@@ -1,9 +1,10 @@
 from django.contrib import admin
 from django.urls import path, include
-from django.conf.urls.static import static
 from django.conf import settings
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
+from stories.media import serve_media
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('auth/', include('djoser.urls')),
@@ -11,8 +12,6 @@ urlpatterns = [
     path('api/', include('stories.urls')),
     path('api/users/', include('authentication.urls')),
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
-    path('api/schema/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='api-docs')
+    path('api/schema/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='api-docs'),
+    path(f'{settings.MEDIA_URL.strip("/")}/<path:path>', serve_media, name='media')
 ]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -25,6 +25,7 @@ class CategoryFactory(factory.django.DjangoModelFactory):
 class IpAddressFactory(factory.django.DjangoModelFactory):
     class Meta:
         model = IpAddress
+        django_get_or_create = ('ip',)
 
     ip = factory.Faker('ipv4')
 
@@ -65,7 +66,7 @@ class StoryFactory(factory.django.DjangoModelFactory):
 
         if extracted:
             for view in extracted:
-                self.views.add(view)
+                self.add_view(view)
 
     @factory.post_generation
     def likes(self, create, extracted, **kwargs):
@@ -74,7 +75,7 @@ class StoryFactory(factory.django.DjangoModelFactory):
 
         if extracted:
             for like in extracted:
-                self.likes.add(like)
+                self.like(like)
 
 
 class CommentFactory(factory.django.DjangoModelFactory):
@@ -93,7 +94,7 @@ class CommentFactory(factory.django.DjangoModelFactory):
 
         if extracted:
             for like in extracted:
-                self.likes.add(like)
+                self.like(like)
 
 
 class CharacterFactory(factory.django.DjangoModelFactory):
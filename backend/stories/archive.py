@@ -0,0 +1,293 @@
+import json
+import os
+import tarfile
+import tempfile
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import models, transaction
+
+from .models import Category, Story, Character, Episode, Message, MediaBlob
+from .storage import media_storage
+from .thumbnails import schedule_variants
+
+ARCHIVE_VERSION = 1
+ARCHIVE_DATA_NAME = 'story.ndjson'
+ARCHIVE_MEDIA_DIR = 'media/'
+
+MESSAGE_FIELDS = (
+    'episode_id', 'character_id', 'order', 'message_type',
+    'text_content', 'image_content', 'video_content', 'audio_content', 'status_content'
+)
+MEDIA_FIELDS = ('image_content', 'video_content', 'audio_content')
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def validate(instance, fields, record_type):
+    """
+    Runs the field validation of the model on the fields read from the archive. bulk_create skips it,
+    a malformed archive would otherwise only fail in the database.
+    """
+    for name in fields:
+        field = instance._meta.get_field(name)
+        value = getattr(instance, field.attname)
+        if value is None and not field.null:
+            raise ArchiveError(f'Invalid {record_type}: {name} is required.')
+        # CharField.to_python would turn any value into its string
+        text = isinstance(field, (models.CharField, models.TextField))
+        if text and value is not None and not isinstance(value, str):
+            raise ArchiveError(f'Invalid {record_type}: {name} must be a string.')
+    try:
+        instance.clean_fields(exclude=[field.name for field in instance._meta.fields if field.name not in fields])
+    except ValidationError as err:
+        name, messages = next(iter(err.message_dict.items()))
+        raise ArchiveError(f'Invalid {record_type}: {name}: {messages[0]}')
+
+
+def dump_line(record_type, data):
+    return json.dumps({'type': record_type, **data}, default=str) + '\n'
+
+
+def export_story(story, chunk_size=1000):
+    """
+    Yields the story as newline-delimited JSON: a story header, then its characters, episodes and messages.
+    Rows are read with server-side cursors, so memory use does not depend on the size of the story.
+    """
+    yield dump_line('story', {
+        'version': ARCHIVE_VERSION,
+        'title': story.title,
+        'description': story.description,
+        'category': story.category.name if story.category_id else None,
+        'image': story.image.name or None,
+        'published': story.published,
+        'publish_date': story.publish_date,
+    })
+
+    characters = story.characters.order_by('id').values('id', 'name', 'color')
+    for character in characters.iterator(chunk_size=chunk_size):
+        yield dump_line('character', character)
+
+    episodes = story.episodes.order_by('created_at', 'id').values('id', 'title')
+    for episode in episodes.iterator(chunk_size=chunk_size):
+        yield dump_line('episode', episode)
+
+    messages = Message.objects.filter(episode__story=story).order_by('episode_id', 'order').values(*MESSAGE_FIELDS)
+    for message in messages.iterator(chunk_size=chunk_size):
+        yield dump_line('message', message)
+
+
+async def aexport_story(story, chunk_size=1000):
+    """
+    export_story for ASGI responses. Lines are read in batches through sync_to_async, so the cursor stays
+    on the thread of the database connection and the event loop is not blocked while rows are fetched.
+    """
+    lines = export_story(story, chunk_size)
+    read = sync_to_async(lambda: list(islice(lines, 100)))
+    try:
+        while batch := await read():
+            yield ''.join(batch)
+    finally:
+        await sync_to_async(lines.close)()
+
+
+def story_media(story, chunk_size=1000):
+    if story.image:
+        yield story.image.name
+
+    messages = Message.objects.filter(episode__story=story).values_list(*MEDIA_FIELDS)
+    for names in messages.iterator(chunk_size=chunk_size):
+        yield from (name for name in names if name)
+
+
+def write_archive(story, fileobj, chunk_size=1000):
+    """
+    Writes a gzipped tarball with the media files of the story followed by its NDJSON data.
+    Media goes first, so an importer reading the stream knows the stored names before the messages arrive.
+    """
+    storage = media_storage()
+    written = set()
+    with tarfile.open(fileobj=fileobj, mode='w|gz') as tar:
+        for name in story_media(story, chunk_size):
+            # deduplicated media is shared between messages, each blob goes into the archive once
+            if name in written or not storage.exists(name):
+                continue
+            written.add(name)
+            info = tarfile.TarInfo(ARCHIVE_MEDIA_DIR + name)
+            info.size = storage.size(name)
+            with storage.open(name) as media:
+                tar.addfile(info, media)
+
+        # the member size must be known before its data, spool the lines to disk rather than memory
+        with tempfile.TemporaryFile() as data:
+            for line in export_story(story, chunk_size):
+                data.write(line.encode())
+            info = tarfile.TarInfo(ARCHIVE_DATA_NAME)
+            info.size = data.tell()
+            data.seek(0)
+            tar.addfile(info, data)
+
+
+class StoryImporter:
+    """
+    Recreates a story from archive lines for the given author.
+
+    Rows are inserted with bulk_create in chunks, character and episode ids of the archive are remapped
+    to the ids of the new rows. Media names are kept unless the media map stores them under a new name.
+    """
+
+    def __init__(self, author, media=None, chunk_size=1000):
+        self.author = author
+        self.media = media or {}
+        self.chunk_size = chunk_size
+        self.story = None
+        self.characters = {}
+        self.episodes = {}
+        # orders taken per archive episode, the database would reject a duplicate with an IntegrityError
+        self.orders = {}
+        self.pending = {Character: [], Episode: [], Message: []}
+        self.counts = {'characters': 0, 'episodes': 0, 'messages': 0}
+
+    def run(self, lines):
+        with transaction.atomic():
+            for line in lines:
+                if isinstance(line, bytes):
+                    line = line.decode()
+                if line.strip():
+                    self.add(json.loads(line))
+            if self.story is None:
+                raise ArchiveError('Archive does not contain a story.')
+            for model in self.pending:
+                self.flush(model)
+        return self.story
+
+    def add(self, record):
+        if not isinstance(record, dict):
+            raise ArchiveError('Archive lines must be JSON objects.')
+        record_type = record.pop('type', None)
+
+        if record_type == 'story':
+            if record.get('version') != ARCHIVE_VERSION:
+                raise ArchiveError(f'Unsupported archive version: {record.get("version")}.')
+            category = None
+            if record['category'] is not None:
+                category = Category(name=record['category'])
+                validate(category, ['name'], 'category')
+                category = Category.objects.get_or_create(name=category.name)[0]
+            story = Story(
+                author=self.author,
+                title=record['title'],
+                description=record['description'],
+                category=category,
+                image=self.media_name(record['image']),
+                published=record['published'],
+                publish_date=record['publish_date'],
+            )
+            validate(story, ['title', 'description', 'image', 'published', 'publish_date'], 'story')
+            story.save()
+            self.story = story
+        elif self.story is None:
+            raise ArchiveError('Archive must start with a story.')
+        elif record_type == 'character':
+            character = Character(story=self.story, name=record['name'], color=record['color'])
+            validate(character, ['name', 'color'], 'character')
+            character.color = character.color.upper()
+            self.queue(Character, self.archive_id(record['id'], record_type), character)
+        elif record_type == 'episode':
+            episode = Episode(story=self.story, title=record['title'])
+            validate(episode, ['title'], 'episode')
+            self.queue(Episode, self.archive_id(record['id'], record_type), episode)
+        elif record_type == 'message':
+            # messages reference characters and episodes, which must have ids by now
+            self.flush(Character)
+            self.flush(Episode)
+            archive_episode_id = record['episode_id']
+            if not isinstance(archive_episode_id, int) or archive_episode_id not in self.episodes:
+                raise ArchiveError(f'Message references unknown episode {archive_episode_id}.')
+            character_id = record['character_id']
+            if character_id is not None and not isinstance(character_id, int):
+                raise ArchiveError(f'Message references invalid character {character_id}.')
+            message = Message(
+                episode_id=self.episodes[archive_episode_id],
+                character_id=self.characters.get(character_id),
+                order=record['order'],
+                message_type=record['message_type'],
+                text_content=record['text_content'],
+                status_content=record['status_content'],
+                **{field: self.media_name(record[field]) for field in MEDIA_FIELDS},
+            )
+            validate(message, ['order', 'message_type', 'text_content', 'status_content', *MEDIA_FIELDS], 'message')
+            # rebalancing moves messages through negative orders, like the API only positive ones are accepted
+            if message.order <= 0:
+                raise ArchiveError(f'Invalid message: order must be greater than zero, got {message.order}.')
+            orders = self.orders.setdefault(archive_episode_id, set())
+            if message.order in orders:
+                raise ArchiveError(f'Episode {archive_episode_id} has two messages with order {message.order}.')
+            orders.add(message.order)
+            self.queue(Message, None, message)
+        else:
+            raise ArchiveError(f'Unknown record type: {record_type}.')
+
+    def archive_id(self, value, record_type):
+        if not isinstance(value, int):
+            raise ArchiveError(f'Invalid {record_type}: id must be an integer.')
+        return value
+
+    def media_name(self, name):
+        if name is not None and not isinstance(name, str):
+            raise ArchiveError(f'Invalid media name: {name}.')
+        return self.media.get(name, name) if name else None
+
+    def queue(self, model, archive_id, instance):
+        self.pending[model].append((archive_id, instance))
+        if len(self.pending[model]) >= self.chunk_size:
+            self.flush(model)
+
+    def flush(self, model):
+        pending = self.pending[model]
+        if not pending:
+            return
+        self.pending[model] = []
+
+        created = model.objects.bulk_create([instance for _, instance in pending])
+        if model is Message:
+            # bulk inserts skip the signals that count media references and create image variants
+            MediaBlob.acquire(getattr(message, field).name for message in created for field in MEDIA_FIELDS)
+            for message in created:
+                if message.image_content:
+                    schedule_variants(message)
+        ids = {Character: self.characters, Episode: self.episodes}.get(model)
+        if ids is not None:
+            ids.update((archive_id, instance.pk) for (archive_id, _), instance in zip(pending, created))
+        self.counts[model._meta.verbose_name_plural.lower()] += len(created)
+
+
+def import_archive(fileobj, author, chunk_size=1000):
+    """
+    Imports a tarball written by write_archive, media files are saved to the default storage
+    while the archive is read and the story data is streamed from the last member.
+    """
+    media = {}
+    try:
+        # r|* also reads tarballs that are not gzipped
+        with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                if member.name.startswith(ARCHIVE_MEDIA_DIR):
+                    name = member.name[len(ARCHIVE_MEDIA_DIR):]
+                    if '..' in name.split('/') or os.path.isabs(name):
+                        raise ArchiveError(f'Invalid media path: {member.name}.')
+                    media[name] = media_storage().save(name, File(tar.extractfile(member), name=name))
+                elif member.name == ARCHIVE_DATA_NAME:
+                    importer = StoryImporter(author, media=media, chunk_size=chunk_size)
+                    importer.run(tar.extractfile(member))
+                    return importer
+    except tarfile.TarError as err:
+        raise ArchiveError(f'Unreadable tarball: {err}.')
+    raise ArchiveError(f'Archive does not contain {ARCHIVE_DATA_NAME}.')
@@ -0,0 +1,233 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DataError, IntegrityError, connection, transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from .models import Story, IpAddress, StoryViewSketch, Message, UserStoryStatus
+from .hyperloglog import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Collects writes in memory and applies them in batches from a background thread.
+
+    Subclasses define how pending items are kept (`empty`, `add`, `items`) and written (`write`).
+    Items of a batch that fails to write are put back and retried with the next flush, unless the
+    database rejected the data itself, such a batch is logged and dropped.
+    The flush interval and batch size are read from settings, an interval of None
+    disables the thread so that the buffer is only written by explicit `flush()` calls.
+    """
+    interval_setting = None
+    batch_size_setting = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = self.empty()
+        self._thread = None
+        self._wake = threading.Event()
+        self._stopped = False
+
+    @property
+    def interval(self):
+        return getattr(settings, self.interval_setting)
+
+    @property
+    def batch_size(self):
+        return getattr(settings, self.batch_size_setting)
+
+    def empty(self):
+        raise NotImplementedError
+
+    def add(self, pending, item):
+        raise NotImplementedError
+
+    def items(self, pending):
+        return list(pending)
+
+    def write(self, items):
+        raise NotImplementedError
+
+    def put(self, item):
+        with self._lock:
+            self.add(self._pending, item)
+            full = len(self._pending) >= self.batch_size
+        self.start()
+        if full:
+            self._wake.set()
+
+    def take(self):
+        with self._lock:
+            pending, self._pending = self._pending, self.empty()
+        return self.items(pending)
+
+    def restore(self, items):
+        # items recorded since the failed ones were taken are newer and are added last
+        with self._lock:
+            pending = self.empty()
+            for item in [*items, *self.items(self._pending)]:
+                self.add(pending, item)
+            self._pending = pending
+
+    def flush(self):
+        items = self.take()
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            try:
+                # rolls a rejected batch back on its own, a caller's transaction stays usable
+                with transaction.atomic():
+                    self.write(batch)
+            except (DataError, IntegrityError):
+                # it would fail the same way on every retry and hold up everything recorded after it
+                logger.exception('Dropped %d items that %s could not write', len(batch), type(self).__name__)
+            except Exception:
+                # e.g. a lost connection, the writes are idempotent so the whole rest is tried again
+                self.restore(items[start:])
+                raise
+        return len(items)
+
+    def start(self):
+        if self._thread is not None or not self.interval:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush %s', type(self).__name__)
+            finally:
+                connection.close()
+
+
+class StoryViewBuffer(WriteBehindBuffer):
+    interval_setting = 'STORY_VIEWS_FLUSH_INTERVAL'
+    batch_size_setting = 'STORY_VIEWS_BATCH_SIZE'
+
+    def empty(self):
+        return set()
+
+    def add(self, pending, item):
+        pending.add(item)
+
+    def record(self, story_id, ip):
+        self.put((story_id, ip))
+
+    def write(self, items):
+        if settings.STORY_VIEWS_MODE == 'sketch':
+            self.write_sketches(items)
+        else:
+            self.write_views(items)
+
+    def write_sketches(self, items):
+        story_ids = set(Story.objects.filter(pk__in={story_id for story_id, _ in items}).values_list('pk', flat=True))
+        sketches = {story_id: HyperLogLog() for story_id in story_ids}
+        for story_id, ip in items:
+            if story_id in sketches:
+                sketches[story_id].add(ip)
+        StoryViewSketch.merge_views(sketches, timezone.localdate())
+
+    def write_views(self, items):
+        ips = {ip for _, ip in items}
+        ip_ids = dict(IpAddress.objects.filter(ip__in=ips).values_list('ip', 'id'))
+        if ips - ip_ids.keys():
+            # another writer may create the same addresses, their ids are read back afterwards
+            IpAddress.objects.bulk_create([IpAddress(ip=ip) for ip in ips - ip_ids.keys()], ignore_conflicts=True)
+            ip_ids = dict(IpAddress.objects.filter(ip__in=ips).values_list('ip', 'id'))
+
+        story_ids = set(Story.objects.filter(pk__in={story_id for story_id, _ in items}).values_list('pk', flat=True))
+        views = {(story_id, ip_ids[ip]) for story_id, ip in items if story_id in story_ids}
+        if not views:
+            return
+
+        View = Story.views.through
+        with transaction.atomic():
+            # existing rows are skipped by the insert, only the returned rows are new views
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {View._meta.db_table} ({View._meta.get_field("story").column}, '
+                    f'{View._meta.get_field("ipaddress").column}) '
+                    f'SELECT * FROM unnest(%s::bigint[], %s::bigint[]) ON CONFLICT DO NOTHING '
+                    f'RETURNING {View._meta.get_field("story").column}',
+                    [[story_id for story_id, _ in views], [ip_id for _, ip_id in views]]
+                )
+                new_views = Counter(story_id for story_id, in cursor.fetchall())
+            if new_views:
+                Story.objects.filter(pk__in=new_views).update(views_count=Case(
+                    *[When(pk=story_id, then=F('views_count') + count) for story_id, count in new_views.items()]
+                ))
+
+
+view_buffer = StoryViewBuffer()
+
+
+class ProgressBuffer(WriteBehindBuffer):
+    """
+    Keeps the latest reading position per user and story and upserts them in batches.
+
+    Pending positions are only visible to the process that received them, readers of that
+    process look them up with `position` so that a user always resumes where they stopped.
+    """
+    interval_setting = 'STORY_PROGRESS_FLUSH_INTERVAL'
+    batch_size_setting = 'STORY_PROGRESS_BATCH_SIZE'
+
+    def empty(self):
+        return {}
+
+    def add(self, pending, item):
+        user_id, story_id, episode_id, message_id = item
+        pending[user_id, story_id] = (episode_id, message_id)
+
+    def items(self, pending):
+        return [(*key, *position) for key, position in pending.items()]
+
+    def record(self, user_id, story_id, episode_id, message_id):
+        self.put((user_id, story_id, episode_id, message_id))
+
+    def position(self, user_id, story_id):
+        """
+        The (episode id, message id) recorded for the user and story and not written yet, or None.
+        """
+        with self._lock:
+            return self._pending.get((user_id, story_id))
+
+    def write(self, items):
+        # positions were accepted without lookups, drop those whose rows do not exist or do not belong together
+        valid = set(Message.objects.filter(pk__in={item[3] for item in items}).values_list(
+            'episode__story_id', 'episode_id', 'pk'
+        ))
+        users = set(get_user_model().objects.filter(pk__in={item[0] for item in items}).values_list('pk', flat=True))
+        statuses = [
+            UserStoryStatus(user_id=user_id, story_id=story_id, episode_id=episode_id, message_id=message_id)
+            for user_id, story_id, episode_id, message_id in items
+            if user_id in users and (story_id, episode_id, message_id) in valid
+        ]
+        UserStoryStatus.objects.bulk_create(
+            statuses, update_conflicts=True, unique_fields=['user', 'story'],
+            update_fields=['episode', 'message', 'last_updated']
+        )
+
+
+progress_buffer = ProgressBuffer()
@@ -0,0 +1,90 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+def version_key(scope):
+    if isinstance(scope, tuple):
+        return 'version:' + ':'.join(str(part) for part in scope)
+    return f'version:{scope}'
+
+
+def new_version():
+    # never restart from 1, otherwise an evicted version could match responses cached before the eviction
+    return time.time_ns()
+
+
+def get_versions(scopes):
+    keys = [version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, new_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(scope):
+    key = version_key(scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, new_version(), timeout=None)
+
+
+def cached_response(request, scopes, build):
+    """
+    Serves anonymous GET responses from the cache.
+
+    The key is made of the full request url and the current versions of the scopes the
+    response depends on, e.g. ('story', pk) or 'categories'. Model signals bump those
+    versions, which makes every response built from the old data unreachable at once.
+    Authenticated requests carry per-user fields and always build a fresh response.
+    """
+    if request.user.is_authenticated:
+        return build()
+
+    versions = get_versions(scopes)
+    url = request.build_absolute_uri()
+    key = 'response:v2:' + hashlib.md5(f'{url}|{versions}'.encode()).hexdigest()
+
+    cached = cache.get(key)
+    if cached is not None:
+        data, headers = cached
+        # validators stored with the response answer conditional requests without touching the database
+        response = get_conditional_response(request, etag=headers.get('ETag')) or Response(data)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    response = build()
+    if response.status_code == 200:
+        headers = {header: response[header] for header in ('ETag', 'Last-Modified') if response.has_header(header)}
+        cache.set(key, (response.data, headers), settings.RESPONSE_CACHE_TIMEOUT)
+    return response
+
+
+def conditional_response(request, validators, build, last_modified=None):
+    """
+    Answers conditional GET requests with 304 before the response is built or serialized.
+
+    The ETag is a hash of the request path and the validators, cheap values that change with the
+    representation, e.g. versions, row counts and the max updated_at. Last-Modified is only sent as
+    information, deletions and counter updates do not move updated_at, so only the ETag is trusted.
+    """
+    etag = quote_etag(hashlib.md5(repr([request.get_full_path(), *validators]).encode()).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    response = build()
+    if response.status_code == 200:
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
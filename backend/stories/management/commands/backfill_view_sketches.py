@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from stories.models import Story, StoryViewSketch
+from stories.hyperloglog import HyperLogLog
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the lifetime view sketches from the story/ip join table. '
+        'Run it before switching STORY_VIEWS_MODE to "sketch".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Stories per chunk.')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        View = Story.views.through
+
+        stories = 0
+        last_pk = 0
+        while True:
+            pks = list(Story.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                break
+            last_pk = pks[-1]
+
+            sketches = {pk: HyperLogLog() for pk in pks}
+            views = View.objects.filter(story_id__in=pks).values_list('story_id', 'ipaddress__ip')
+            for story_id, ip in views.iterator(chunk_size=5000):
+                sketches[story_id].add(ip)
+
+            StoryViewSketch.merge_views(sketches)
+            stories += len(pks)
+            self.stdout.write(f'Stories processed: {stories}')
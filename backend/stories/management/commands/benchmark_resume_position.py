@@ -0,0 +1,52 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from stories.models import Story, Episode, Message
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the resume-position lookup of episodes/{id}/messages for episodes of growing size. '
+        'The data is created in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--compare', action='store_true', help='Also time the old list().index() lookup.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            author = User.objects.create_user(email='benchmark@example.com', username='benchmark')
+            story = Story.objects.create(title='Benchmark', description='', author=author)
+
+            for size in options['sizes']:
+                episode = Episode.objects.create(title=f'{size} messages', story=story)
+                Message.objects.bulk_create(
+                    [Message(episode=episode, order=1024 * (i + 1), text_content=f'{i}') for i in range(size)],
+                    batch_size=2000
+                )
+                bookmark = episode.messages.last()
+
+                timing = self.measure(lambda: episode.get_message_index(bookmark), options['repeat'])
+                line = f'{size:>8} messages  indexed count: {timing * 1000:8.2f} ms'
+                if options['compare']:
+                    queryset = episode.messages.all().order_by('order').select_related('character')
+                    timing = self.measure(lambda: list(queryset.all()).index(bookmark), options['repeat'])
+                    line += f'  list().index(): {timing * 1000:8.2f} ms'
+                self.stdout.write(line)
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def measure(function, repeat):
+        function()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        return (time.perf_counter() - start) / repeat
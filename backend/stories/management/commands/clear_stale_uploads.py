@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from stories.models import MediaUpload
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked uploads that were abandoned or completed but never attached to a message.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Age of the last activity on an upload.')
+
+    def handle(self, *args, **options):
+        stale = MediaUpload.objects.filter(updated_at__lt=timezone.now() - timedelta(hours=options['hours']))
+
+        deleted = 0
+        for upload in stale.iterator():
+            # attached uploads are deleted when claimed, a stored file here belongs to no message
+            if upload.file:
+                upload.file.delete(save=False)
+            upload.delete()
+            deleted += 1
+        self.stdout.write(f'Uploads deleted: {deleted}')
@@ -0,0 +1,51 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stories.archive import export_story, write_archive
+from stories.models import Story
+
+
+class Command(BaseCommand):
+    help = 'Stream a story with its characters, episodes and messages to an NDJSON archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('story_id', type=int)
+        parser.add_argument('--output', default='-', help='Archive path, "-" writes to stdout.')
+        parser.add_argument('--media', action='store_true',
+                            help='Write a gzipped tarball that bundles the media files with the data.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            story = Story.objects.select_related('category').get(pk=options['story_id'])
+        except Story.DoesNotExist:
+            raise CommandError(f'Story {options["story_id"]} does not exist.')
+
+        to_stdout = options['output'] == '-'
+        output = sys.stdout.buffer if to_stdout else open(options['output'], 'wb')
+        started = time.monotonic()
+        try:
+            if options['media']:
+                write_archive(story, output, options['chunk_size'])
+                lines = None
+            else:
+                lines = 0
+                for line in export_story(story, options['chunk_size']):
+                    output.write(line.encode())
+                    lines += 1
+            output.flush()
+            written = output.tell() if not to_stdout else None
+        finally:
+            if not to_stdout:
+                output.close()
+
+        elapsed = time.monotonic() - started
+        report = [f'Exported story {story.pk} in {elapsed:.2f}s']
+        if lines is not None:
+            report.append(f'{lines} records, {lines / max(elapsed, 1e-6):.0f} records/s')
+        if written is not None:
+            report.append(f'{written / 1024 / 1024:.2f} MiB')
+        # keep stdout clean when the archive itself goes there
+        (self.stderr if to_stdout else self.stdout).write(', '.join(report))
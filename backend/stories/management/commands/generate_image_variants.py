@@ -0,0 +1,23 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from stories.thumbnails import IMAGE_VARIANTS, generate_variants
+
+
+class Command(BaseCommand):
+    help = 'Render the resized variants of images uploaded before the thumbnail workers ran, or whose variants are stale.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        for label, (field_name, variants_field, _) in IMAGE_VARIANTS.items():
+            model = apps.get_model(label)
+            rows = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            rows = rows.values_list('pk', field_name, variants_field)
+
+            generated = 0
+            for pk, source, variants in rows.iterator(chunk_size=options['chunk_size']):
+                if (variants or {}).get('source') != source and generate_variants(model, pk):
+                    generated += 1
+            self.stdout.write(f'{label}: {generated} images processed')
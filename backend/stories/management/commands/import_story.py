@@ -0,0 +1,52 @@
+import sys
+import tarfile
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from stories.archive import ArchiveError, StoryImporter, import_archive
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Import a story archive written by export_story as a new story of the given author. '
+        'Plain NDJSON archives keep their media names, so the media must already be in the storage.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Archive path, "-" reads NDJSON from stdin.')
+        parser.add_argument('--author', required=True, help='Email or username of the new author.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows per bulk insert.')
+
+    def handle(self, *args, **options):
+        author = User.objects.filter(Q(email=options['author']) | Q(username=options['author'])).first()
+        if author is None:
+            raise CommandError(f'User {options["author"]} does not exist.')
+
+        path = options['path']
+        started = time.monotonic()
+        try:
+            if path != '-' and tarfile.is_tarfile(path):
+                with open(path, 'rb') as archive:
+                    importer = import_archive(archive, author, options['chunk_size'])
+            else:
+                importer = StoryImporter(author, chunk_size=options['chunk_size'])
+                if path == '-':
+                    importer.run(sys.stdin.buffer)
+                else:
+                    with open(path, 'rb') as archive:
+                        importer.run(archive)
+        except (ArchiveError, ValueError, KeyError) as err:
+            raise CommandError(f'Invalid archive: {err}')
+
+        elapsed = time.monotonic() - started
+        rows = sum(importer.counts.values())
+        counts = ', '.join(f'{count} {name}' for name, count in importer.counts.items())
+        self.stdout.write(
+            f'Imported story {importer.story.pk} ({counts}) in {elapsed:.2f}s, '
+            f'{rows / max(elapsed, 1e-6):.0f} rows/s'
+        )
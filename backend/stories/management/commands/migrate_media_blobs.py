@@ -0,0 +1,89 @@
+from django.apps import apps
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from stories.storage import MEDIA_REFERENCE_FIELDS, media_storage
+from stories.thumbnails import IMAGE_VARIANTS
+
+
+class Command(BaseCommand):
+    help = (
+        'Move media saved before the deduplicated storage into blobs and point the model fields to them. '
+        'Files with the same content become one blob, the old files are deleted once nothing refers to them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rows per chunk.')
+
+    def handle(self, *args, **options):
+        storage = media_storage()
+        # old name: blob name, None for files that are missing from the storage
+        blobs = {}
+
+        for label, fields in MEDIA_REFERENCE_FIELDS.items():
+            model = apps.get_model(label)
+            for field in fields:
+                legacy = model.objects.exclude(**{f'{field}__startswith': f'{storage.BLOB_DIR}/'}).exclude(
+                    Q(**{field: ''}) | Q(**{f'{field}__isnull': True})
+                ).order_by('pk')
+                rows = 0
+                last_pk = None
+                while True:
+                    chunk = legacy if last_pk is None else legacy.filter(pk__gt=last_pk)
+                    instances = list(chunk[:options['chunk_size']])
+                    if not instances:
+                        break
+                    last_pk = instances[-1].pk
+
+                    for instance in instances:
+                        name = getattr(instance, field).name
+                        if name not in blobs:
+                            blobs[name] = self.store(storage, name)
+                        if blobs[name] is not None:
+                            self.point_to_blob(instance, field, name, blobs[name])
+                            rows += 1
+                self.stdout.write(f'{label}.{field}: {rows} rows moved to blobs')
+
+        deleted = 0
+        for name, blob in blobs.items():
+            if blob is not None and not self.referenced(name):
+                storage.delete(name)
+                deleted += 1
+        self.stdout.write(f'Old files deleted: {deleted}')
+
+    def store(self, storage, name):
+        try:
+            exists = storage.exists(name)
+        except SuspiciousFileOperation:
+            exists = False
+        if not exists:
+            self.stderr.write(f'Missing file, left as it is: {name}')
+            return None
+        with storage.open(name) as file:
+            return storage.save(name, file)
+
+    def point_to_blob(self, instance, field, name, blob):
+        # a plain save, its signals count the blob reference, invalidate bundles and bump cached versions
+        setattr(instance, field, blob)
+        update_fields = [field]
+        image_field, variants_field, _ = IMAGE_VARIANTS.get(instance._meta.label, (None, None, None))
+        variants = getattr(instance, variants_field) if image_field == field else None
+        if variants and variants.get('source') == name:
+            # the variants were made from the same content, they stay valid for the blob
+            variants['source'] = blob
+            update_fields.append(variants_field)
+        if any(model_field.name == 'updated_at' for model_field in instance._meta.fields):
+            update_fields.append('updated_at')
+        with transaction.atomic():
+            instance.save(update_fields=update_fields)
+
+    def referenced(self, name):
+        for label, fields in MEDIA_REFERENCE_FIELDS.items():
+            references = Q()
+            for field in fields:
+                references |= Q(**{field: name})
+            if apps.get_model(label).objects.filter(references).exists():
+                return True
+        return False
@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from stories.models import MediaBlob
+from stories.storage import MEDIA_REFERENCE_FIELDS, media_storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Recount the references of deduplicated media blobs from the model fields '
+        'and delete blobs that nothing refers to. Files saved before the deduplicated storage have no blob, '
+        'migrate_media_blobs moves them into blobs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=int, default=settings.MEDIA_BLOB_GRACE_HOURS,
+                            help='Unreferenced blobs saved within this many hours may still be attached to a message.')
+
+    def handle(self, *args, **options):
+        references = Value(0)
+        for label, fields in MEDIA_REFERENCE_FIELDS.items():
+            model = apps.get_model(label)
+            for field in fields:
+                count = model.objects.filter(**{field: OuterRef('name')}).order_by().values(field)
+                references += Coalesce(Subquery(count.annotate(count=Count('pk')).values('count')), 0)
+
+        fixed = MediaBlob.objects.exclude(references=references).update(references=references)
+        self.stdout.write(f'Blobs recounted: {fixed}')
+
+        storage = media_storage()
+        saved_before = timezone.now() - timedelta(hours=options['grace_hours'])
+        orphans = MediaBlob.objects.filter(references=0, saved_at__lt=saved_before).values_list('name', flat=True)
+        deleted = 0
+        for name in orphans.iterator():
+            deleted += storage.delete_unreferenced(name, saved_before)
+        self.stdout.write(f'Unreferenced blobs deleted: {deleted}')
@@ -0,0 +1,148 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+BLOCK_SIZE = 64 * 1024
+
+
+def read_blocks(file, length):
+    try:
+        while length > 0:
+            data = file.read(min(BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+async def aread_blocks(file, length):
+    """
+    Like read_blocks, every read runs in a worker thread so the event loop of the ASGI server
+    keeps serving other requests while the file is sent.
+    """
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        while length > 0:
+            data = await read(min(BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        await sync_to_async(file.close, thread_sensitive=False)()
+
+
+def parse_range(header, size, chunk_size):
+    """
+    Returns the (start, end) bytes of a single range, None to send the whole file,
+    or False when the range cannot be satisfied. Several ranges are answered with the whole file.
+    Open ended ranges are answered with at most chunk_size bytes, the client asks for the rest.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else min(start + chunk_size, size) - 1
+    else:
+        # suffix range, the last n bytes of the file
+        start = max(size - int(last), 0)
+        end = size - 1
+
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def media_path(path):
+    # only regular, non hidden files inside MEDIA_ROOT, unfinished uploads live outside of it
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if any(part.startswith('.') for part in path.split('/')) or not os.path.isfile(full_path):
+        raise Http404
+    return full_path
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serves a file of MEDIA_ROOT after the checks in Django.
+
+    With MEDIA_SERVE_MODE 'x-accel-redirect' or 'x-sendfile' the transfer is handed to the web server,
+    which also answers range requests and should be used in production. The 'python' mode streams
+    the file itself and supports a single byte range, so audio and video seeking does not download
+    the file again.
+    """
+    full_path = media_path(path)
+    stat = os.stat(full_path)
+    etag = quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+    last_modified = http_date(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is not None:
+        return response
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    mode = settings.MEDIA_SERVE_MODE
+    if mode == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(path)
+    elif mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        response = serve_file(request, full_path, stat.st_size, content_type, etag, last_modified)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    return response
+
+
+def serve_file(request, full_path, size, content_type, etag, last_modified):
+    byte_range = None
+    if 'Range' in request.headers and request.headers.get('If-Range', etag) in (etag, last_modified):
+        byte_range = parse_range(request.headers['Range'], size, settings.MEDIA_RANGE_CHUNK_SIZE)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range or (0, size - 1)
+    file = open(full_path, 'rb')
+    file.seek(start)
+    # under ASGI a synchronous iterator would be read completely into memory before it is sent
+    if isinstance(request, ASGIRequest):
+        content = aread_blocks(file, end - start + 1)
+    else:
+        content = read_blocks(file, end - start + 1)
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    if byte_range is not None:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    return response
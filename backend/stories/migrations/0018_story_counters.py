@@ -0,0 +1,53 @@
+# Generated by Django 5.0.4 on 2026-10-18 19:54
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(queryset, field):
+    queryset = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field)
+    return Coalesce(Subquery(queryset.annotate(count=Count('pk')).values('count')), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Story = apps.get_model('stories', 'Story')
+    Comment = apps.get_model('stories', 'Comment')
+
+    Story.objects.update(
+        likes_count=count_subquery(Story.likes.through.objects.all(), 'story'),
+        views_count=count_subquery(Story.views.through.objects.all(), 'story'),
+        comments_count=count_subquery(Comment.objects.all(), 'story'),
+    )
+    Comment.objects.update(likes_count=count_subquery(Comment.likes.through.objects.all(), 'comment'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0017_userstorystatus'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='likes_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='views_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
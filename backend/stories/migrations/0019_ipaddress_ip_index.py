@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0018_story_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ipaddress',
+            name='ip',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.4 on 2026-10-18 19:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0019_ipaddress_ip_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoryViewSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(blank=True, null=True)),
+                ('registers', models.BinaryField()),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_sketches', to='stories.story')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='storyviewsketch',
+            constraint=models.UniqueConstraint(fields=('story', 'day'), name='unique_story_view_sketch_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='storyviewsketch',
+            constraint=models.UniqueConstraint(condition=models.Q(('day__isnull', True)), fields=('story',), name='unique_story_view_sketch_lifetime'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0020_storyviewsketch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['episode', 'order'], name='stories_mes_episode_cebf75_idx'),
+        ),
+    ]
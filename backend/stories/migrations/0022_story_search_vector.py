@@ -0,0 +1,50 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:06
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce({table}title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce({table}description, '')), 'B')"
+)
+
+CREATE_TRIGGER = f'''
+CREATE FUNCTION stories_story_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR.format(table='NEW.')};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER stories_story_search_vector_trigger
+BEFORE INSERT OR UPDATE OF title, description, search_vector ON stories_story
+FOR EACH ROW EXECUTE FUNCTION stories_story_search_vector_update();
+
+UPDATE stories_story SET search_vector = {SEARCH_VECTOR.format(table='')};
+'''
+
+DROP_TRIGGER = '''
+DROP TRIGGER stories_story_search_vector_trigger ON stories_story;
+DROP FUNCTION stories_story_search_vector_update();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0021_message_episode_order_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='stories_sto_search__18a3ad_gin'),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+    ]
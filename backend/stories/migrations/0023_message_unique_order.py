@@ -0,0 +1,36 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:10
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def renumber_duplicate_orders(apps, schema_editor):
+    Message = apps.get_model('stories', 'Message')
+    episode_ids = set(
+        Message.objects.values('episode', 'order').annotate(count=Count('id')).filter(count__gt=1)
+        .values_list('episode', flat=True)
+    )
+    for episode_id in episode_ids:
+        messages = list(Message.objects.filter(episode_id=episode_id).order_by('order', 'id'))
+        for index, message in enumerate(messages):
+            message.order = 1024 * (index + 1)
+        Message.objects.bulk_update(messages, ['order'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0022_story_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_duplicate_orders, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='stories_mes_episode_cebf75_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('episode', 'order'), name='unique_message_order_per_episode'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0023_message_unique_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EpisodeBundle',
+            fields=[
+                ('episode', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='bundle', serialize=False, to='stories.episode')),
+                ('payload', models.JSONField()),
+                ('built_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:43
+
+import django.core.validators
+import stories.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0026_mediaupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('size', models.PositiveBigIntegerField()),
+                ('references', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='mediaupload',
+            name='file',
+            field=models.FileField(blank=True, max_length=255, null=True, storage=stories.storage.media_storage, upload_to=''),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='audio_content',
+            field=models.FileField(blank=True, null=True, storage=stories.storage.media_storage, upload_to='message_audios', validators=[django.core.validators.FileExtensionValidator(['mp3', 'wav'])]),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='image_content',
+            field=models.ImageField(blank=True, null=True, storage=stories.storage.media_storage, upload_to='message_images', validators=[django.core.validators.FileExtensionValidator(['png', 'jpg'])]),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='video_content',
+            field=models.FileField(blank=True, null=True, storage=stories.storage.media_storage, upload_to='message_videos', validators=[django.core.validators.FileExtensionValidator(['mp4'])]),
+        ),
+        migrations.AlterField(
+            model_name='story',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=stories.storage.media_storage, upload_to='story_images'),
+        ),
+    ]
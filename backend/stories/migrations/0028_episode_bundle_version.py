@@ -0,0 +1,23 @@
+# Generated by Django 5.0.4 on 2026-10-18 21:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0027_media_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='episode',
+            name='bundle_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='episodebundle',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.4 on 2026-10-18 21:35
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ips(apps, schema_editor):
+    IpAddress = apps.get_model('stories', 'IpAddress')
+    View = apps.get_model('stories', 'Story').views.through
+    duplicates = IpAddress.objects.values('ip').annotate(count=Count('id'), keep=Min('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        others = IpAddress.objects.filter(ip=duplicate['ip']).exclude(pk=duplicate['keep'])
+        story_ids = set(View.objects.filter(ipaddress__in=others).values_list('story_id', flat=True))
+        View.objects.bulk_create(
+            [View(story_id=story_id, ipaddress_id=duplicate['keep']) for story_id in story_ids],
+            ignore_conflicts=True
+        )
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0028_episode_bundle_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ips, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='ipaddress',
+            name='ip',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
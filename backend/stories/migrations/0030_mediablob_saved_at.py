@@ -0,0 +1,20 @@
+# Generated by Django 5.0.4 on 2026-10-18 21:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0029_ipaddress_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediablob',
+            name='saved_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
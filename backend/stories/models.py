@@ -1,7 +1,23 @@
-from django.db import models
+import hashlib
+import os
+import random
+import uuid
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import Case, Count, Exists, F, Max, Min, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.utils import timezone
 
 from .validators import validate_hex_color, image_extension_validator, audio_extension_validator, video_extension_validator
+from .hyperloglog import HyperLogLog
+from .thumbnails import variant_name
+from .storage import media_storage
 
 User = get_user_model()
 
@@ -15,7 +31,7 @@ class Timestamp(models.Model):
 
 
 class IpAddress(models.Model):
-    ip = models.CharField(max_length=255)
+    ip = models.CharField(max_length=255, unique=True)
 
     def __str__(self):
         return self.ip
@@ -28,44 +44,156 @@ class Category(models.Model):
         return self.name
 
 
-class Story(Timestamp):
+def count_subquery(queryset, field):
+    queryset = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field)
+    return Coalesce(Subquery(queryset.annotate(count=Count('pk')).values('count')), 0)
+
+
+class CounterFieldsMixin:
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        # counters are only changed through F() updates, a plain save must not write back stale values
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # deferred fields are left out as well, like a plain save of a deferred instance does
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+    def change_counter(self, field, delta):
+        type(self).objects.filter(pk=self.pk).update(**{field: F(field) + delta})
+        setattr(self, field, getattr(self, field) + delta)
+
+
+class StoryQuerySet(models.QuerySet):
+    def with_stats(self, user=None):
+        # the search vector is only read by the database, e.g. by StorySearchFilter
+        queryset = self.select_related('author', 'category').defer('search_vector')
+
+        if user is not None and user.is_authenticated:
+            return queryset.annotate(
+                is_liked=Exists(Story.likes.through.objects.filter(story=OuterRef('pk'), useraccount=user)),
+                is_saved=Exists(SavedStory.objects.filter(story=OuterRef('pk'), user=user)),
+            )
+        return queryset.annotate(is_liked=Value(False), is_saved=Value(False))
+
+    def random(self, probes=20):
+        # probe random ids in the id range instead of sorting the whole table with ORDER BY RANDOM(),
+        # the range is that of the selection, so a filtered selection is not probed across the whole table
+        bounds = self.order_by().aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            return None
+
+        candidates = [random.randint(bounds['low'], bounds['high']) for _ in range(probes)]
+        hits = list(self.filter(id__in=candidates).order_by())
+        if hits:
+            return random.choice(hits)
+
+        # sparse selections rarely contain a probed id, the nearest story to one would favour stories
+        # after long gaps, an offset into the selection keeps every story equally likely
+        count = self.count()
+        if not count:
+            return None
+        return self.order_by('id')[random.randrange(count)]
+
+
+class Story(CounterFieldsMixin, Timestamp):
     title = models.CharField(max_length=255)
     description = models.TextField(max_length=5000)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stories')
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='stories')
-    image = models.ImageField(upload_to='story_images', blank=True, null=True)
+    image = models.ImageField(upload_to='story_images', storage=media_storage, blank=True, null=True)
+    # resized copies of the image, written by the thumbnail workers
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     likes = models.ManyToManyField(User, related_name='stories_liked', null=True, blank=True)
     views = models.ManyToManyField(IpAddress, blank=True, null=True)
     published = models.BooleanField(default=False)
     publish_date = models.DateTimeField(blank=True, null=True)
+    likes_count = models.PositiveIntegerField(default=0, db_index=True)
+    views_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+    # weighted title (A) and description (B) vector, kept up to date by a database trigger
+    search_vector = SearchVectorField(null=True, editable=False)
 
-    class Meta:
-        ordering = ['-created_at']
-
-    def get_count_views(self):
-        return self.views.count()
+    objects = StoryQuerySet.as_manager()
 
-    def get_count_likes(self):
-        return self.likes.count()
+    counter_fields = ('likes_count', 'views_count', 'comments_count')
 
-    def get_count_comments(self):
-        return self.comments.count()
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
+
+    def like(self, user):
+        with transaction.atomic():
+            _, created = Story.likes.through.objects.get_or_create(story=self, useraccount=user)
+            if created:
+                self.change_counter('likes_count', 1)
+        return created
+
+    def unlike(self, user):
+        with transaction.atomic():
+            deleted, _ = Story.likes.through.objects.filter(story=self, useraccount=user).delete()
+            if deleted:
+                self.change_counter('likes_count', -1)
+        return bool(deleted)
+
+    def add_view(self, ip_address):
+        with transaction.atomic():
+            _, created = Story.views.through.objects.get_or_create(story=self, ipaddress=ip_address)
+            if created:
+                self.change_counter('views_count', 1)
+        return created
+
+    def count_unique_views(self, start=None, end=None):
+        # estimated from the view sketches, without bounds the lifetime sketch answers directly
+        if start is None and end is None:
+            sketches = self.view_sketches.filter(day__isnull=True)
+        else:
+            sketches = self.view_sketches.filter(day__isnull=False)
+            if start:
+                sketches = sketches.filter(day__gte=start)
+            if end:
+                sketches = sketches.filter(day__lte=end)
+
+        sketch = HyperLogLog()
+        for registers in sketches.values_list('registers', flat=True):
+            sketch.merge(HyperLogLog(registers=registers))
+        return sketch.count()
 
     def __str__(self):
         return self.title
 
 
-class Comment(Timestamp):
+class Comment(CounterFieldsMixin, Timestamp):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     story = models.ForeignKey(Story, related_name='comments', on_delete=models.CASCADE)
     text = models.TextField(max_length=2000)
     likes = models.ManyToManyField(User, related_name='comment_like')
+    likes_count = models.PositiveIntegerField(default=0)
+
+    counter_fields = ('likes_count',)
 
     class Meta:
         ordering = ['-created_at']
 
-    def get_count_likes(self):
-        return self.likes.count()
+    def like(self, user):
+        with transaction.atomic():
+            _, created = Comment.likes.through.objects.get_or_create(comment=self, useraccount=user)
+            if created:
+                self.change_counter('likes_count', 1)
+        return created
+
+    def unlike(self, user):
+        with transaction.atomic():
+            deleted, _ = Comment.likes.through.objects.filter(comment=self, useraccount=user).delete()
+            if deleted:
+                self.change_counter('likes_count', -1)
+        return bool(deleted)
 
     def __str__(self):
         return f'{self.author.username} - {self.story}'
@@ -85,12 +213,69 @@ class SavedStory(models.Model):
 
 
 class Episode(Timestamp):
+    # messages are spaced by ORDER_STEP so a message can be inserted between two others at the midpoint,
+    # once neighbours get closer than MIN_ORDER_GAP the whole episode is renumbered
+    ORDER_STEP = 1024
+    MIN_ORDER_GAP = 1e-3
+
     title = models.CharField(max_length=255)
     story = models.ForeignKey(Story, related_name='episodes', on_delete=models.CASCADE)
+    # raised by every change that makes the stored bundle outdated
+    bundle_version = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ['created_at']
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # bundle_version is only raised by updates, a save must not write an older value back
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'bundle_version'
+            ]
+        super().save(*args, **kwargs)
+
+    def get_message_index(self, message):
+        # position of the message in the episode, answered by the (episode, order) index
+        return self.messages.filter(order__lt=message.order).count()
+
+    def lock(self):
+        # serializes renumbering, message writes wait for it too as they raise bundle_version
+        Episode.objects.select_for_update().get(pk=self.pk)
+
+    def rebalance_message_orders(self, message_ids=None):
+        with transaction.atomic(savepoint=False):
+            self.lock()
+            if message_ids is None:
+                message_ids = list(self.messages.order_by('order', 'id').values_list('id', flat=True))
+            messages = [Message(id=message_id) for message_id in message_ids]
+
+            # step through negative orders first, so that no row collides with the unique
+            # (episode, order) constraint while the final orders are written
+            for index, message in enumerate(messages):
+                message.order = -(index + 1)
+            Message.objects.bulk_update(messages, ['order'])
+
+            now = timezone.now()
+            for index, message in enumerate(messages):
+                message.order = self.ORDER_STEP * (index + 1)
+                message.updated_at = now
+            Message.objects.bulk_update(messages, ['order', 'updated_at'])
+            EpisodeBundle.invalidate(pk=self.pk)
+        return messages
+
+    def keep_order_gap(self, message):
+        with transaction.atomic(savepoint=False):
+            self.lock()
+            crowded = self.messages.filter(
+                order__gt=message.order - self.MIN_ORDER_GAP,
+                order__lt=message.order + self.MIN_ORDER_GAP
+            ).exclude(pk=message.pk).exists()
+            if crowded:
+                self.rebalance_message_orders()
+                message.refresh_from_db(fields=['order'])
+        return crowded
+
     def __str__(self):
         return f'Episode {self.story}: {self.title}'
 
@@ -127,18 +312,119 @@ class Message(Timestamp):
     message_type = models.CharField(max_length=20, choices=MESSAGE_TYPES, default='text')
 
     text_content = models.TextField(max_length=200, blank=True, default='')
-    image_content = models.ImageField(upload_to='message_images', validators=[image_extension_validator], blank=True, null=True)
-    video_content = models.FileField(upload_to='message_videos', validators=[video_extension_validator], blank=True, null=True)
-    audio_content = models.FileField(upload_to='message_audios', validators=[audio_extension_validator], blank=True, null=True)
+    image_content = models.ImageField(upload_to='message_images', storage=media_storage, validators=[image_extension_validator], blank=True, null=True)
+    video_content = models.FileField(upload_to='message_videos', storage=media_storage, validators=[video_extension_validator], blank=True, null=True)
+    audio_content = models.FileField(upload_to='message_audios', storage=media_storage, validators=[audio_extension_validator], blank=True, null=True)
     status_content = models.CharField(max_length=255, blank=True, default='')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         ordering = ['order']
+        constraints = [
+            models.UniqueConstraint(fields=['episode', 'order'], name='unique_message_order_per_episode'),
+        ]
 
     def __str__(self):
         return f'{self.character.name if self.character else "AUTHOR"} - {self.message_type}'
 
 
+class MediaUpload(Timestamp):
+    # a video or audio file sent in chunks, assembled in a local part file and moved to the
+    # storage of the message field once complete, messages attach it by id
+    KINDS = ('video', 'audio')
+    READ_BLOCK_SIZE = 64 * 1024
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='media_uploads')
+    kind = models.CharField(max_length=10, choices=[(kind, kind.title()) for kind in KINDS])
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    checksum = models.CharField(max_length=64, blank=True, default='')
+    file = models.FileField(max_length=255, storage=media_storage, blank=True, null=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.owner} - {self.filename}'
+
+    @property
+    def content_field(self):
+        return Message._meta.get_field(f'{self.kind}_content')
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.MEDIA_UPLOAD_TEMP_DIR, f'{self.pk}.part')
+
+    def write_chunk(self, stream, length, checksum):
+        """
+        Writes length bytes of the stream at the received offset, hashing them on the way.
+        A chunk that is short or does not match its sha256 checksum is cut off again, so the client
+        can resend it from the same offset.
+        """
+        if self.completed_at:
+            raise ValidationError('Upload is already complete.')
+        if self.received + length > self.size:
+            raise ValidationError('Chunk exceeds the size of the upload.')
+
+        os.makedirs(settings.MEDIA_UPLOAD_TEMP_DIR, exist_ok=True)
+        digest = hashlib.sha256()
+        with open(self.part_path, 'r+b' if os.path.exists(self.part_path) else 'wb') as part:
+            # drops the tail of an earlier attempt that failed after writing
+            part.truncate(self.received)
+            part.seek(self.received)
+            remaining = length
+            while remaining:
+                block = stream.read(min(self.READ_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                part.write(block)
+                remaining -= len(block)
+
+            if remaining or digest.hexdigest() != checksum.lower():
+                part.truncate(self.received)
+                raise ValidationError('Chunk is incomplete or does not match its checksum.')
+
+        self.received += length
+        self.save(update_fields=['received', 'updated_at'])
+
+    def complete(self):
+        if self.completed_at:
+            return
+        if self.received != self.size:
+            raise ValidationError(f'Upload is incomplete, {self.received} of {self.size} bytes received.')
+
+        with open(self.part_path, 'rb') as part:
+            if self.checksum:
+                digest = hashlib.sha256()
+                for block in iter(lambda: part.read(self.READ_BLOCK_SIZE), b''):
+                    digest.update(block)
+                if digest.hexdigest() != self.checksum.lower():
+                    raise ValidationError('File does not match its checksum.')
+                part.seek(0)
+
+            # the storage copies the part file in chunks, it is never read into memory as a whole
+            field = self.content_field
+            self.file = field.storage.save(field.generate_filename(None, self.filename), File(part, name=self.filename))
+
+        os.remove(self.part_path)
+        self.completed_at = timezone.now()
+        self.save(update_fields=['file', 'completed_at', 'updated_at'])
+
+    @classmethod
+    def claim(cls, pk, owner, kind):
+        """
+        Hands the stored file of a completed upload over to a message, returns its name or None.
+        """
+        try:
+            upload = cls.objects.select_for_update().get(pk=pk, owner=owner, kind=kind, completed_at__isnull=False)
+        except (cls.DoesNotExist, ValidationError, ValueError):
+            return None
+        name = upload.file.name
+        upload.delete()
+        return name
+
+
 class UserStoryStatus(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='story_statuses')
     story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='user_statuses')
@@ -151,3 +437,158 @@ class UserStoryStatus(models.Model):
 
     def __str__(self):
         return f'{self.user.username} - {self.story.title} - {self.episode.title if self.episode else "No Episode"} - {self.message.message_type if self.message else "No Message"}'
+
+
+class StoryViewSketch(models.Model):
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='view_sketches')
+    # one sketch per day, the sketch without a day covers the whole lifetime of the story
+    day = models.DateField(null=True, blank=True)
+    registers = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['story', 'day'], name='unique_story_view_sketch_day'),
+            models.UniqueConstraint(fields=['story'], condition=Q(day__isnull=True),
+                                    name='unique_story_view_sketch_lifetime'),
+        ]
+
+    def __str__(self):
+        return f'{self.story} - {self.day or "lifetime"}'
+
+    @classmethod
+    def merge_views(cls, sketches_by_story, day=None):
+        # merges new views into the lifetime sketch and the sketch of the day, then stores the new estimates
+        days = [None] if day is None else [None, day]
+        empty = HyperLogLog().to_bytes()
+
+        with transaction.atomic():
+            cls.objects.bulk_create([
+                cls(story_id=story_id, day=sketch_day, registers=empty)
+                for story_id in sketches_by_story for sketch_day in days
+            ], ignore_conflicts=True)
+
+            sketches = list(cls.objects.select_for_update().filter(story_id__in=sketches_by_story).filter(
+                Q(day__isnull=True) | Q(day=day)
+            ))
+            estimates = {}
+            for sketch in sketches:
+                hll = HyperLogLog(registers=sketch.registers)
+                hll.merge(sketches_by_story[sketch.story_id])
+                sketch.registers = hll.to_bytes()
+                if sketch.day is None:
+                    estimates[sketch.story_id] = hll.count()
+
+            cls.objects.bulk_update(sketches, ['registers'])
+            Story.objects.filter(pk__in=estimates).update(views_count=Case(
+                *[When(pk=story_id, then=Value(estimate)) for story_id, estimate in estimates.items()]
+            ))
+        return estimates
+
+
+class EpisodeBundle(models.Model):
+    # all messages of an episode in one payload, characters are sent once and referenced by id.
+    # changes to the episode raise its bundle_version, a read that finds an older bundle builds it again
+    episode = models.OneToOneField(Episode, on_delete=models.CASCADE, primary_key=True, related_name='bundle')
+    payload = models.JSONField()
+    version = models.PositiveIntegerField(default=0)
+    built_at = models.DateTimeField(auto_now=True)
+
+    MEDIA_FIELDS = ('image_content', 'video_content', 'audio_content')
+    CONTENT_FIELDS = ('text_content', *MEDIA_FIELDS, 'status_content')
+
+    def __str__(self):
+        return f'Bundle of {self.episode_id}'
+
+    @classmethod
+    def invalidate(cls, **filters):
+        # filters select episodes, the version also outdates a bundle that is being built right now
+        Episode.objects.filter(**filters).update(bundle_version=F('bundle_version') + 1)
+
+    @classmethod
+    def get_payload(cls, episode):
+        bundle = cls.objects.filter(episode=episode, version=F('episode__bundle_version')).first()
+        if bundle is not None:
+            return bundle.payload
+
+        # the version is read before the messages, a change committed meanwhile raises it past the stored one
+        version = Episode.objects.values_list('bundle_version', flat=True).get(pk=episode.pk)
+        payload = cls.build(episode)
+        bundle, created = cls.objects.get_or_create(episode=episode, defaults={'payload': payload, 'version': version})
+        if not created:
+            # never replace a bundle that a concurrent read built from newer rows
+            cls.objects.filter(episode=episode, version__lt=version).update(payload=payload, version=version)
+        return payload
+
+    @classmethod
+    def build(cls, episode):
+        messages = []
+        character_ids = set()
+        rows = episode.messages.order_by('order').values(
+            'id', 'message_type', 'order', 'character_id', 'image_variants', *cls.CONTENT_FIELDS
+        )
+        for row in rows.iterator():
+            message = {'id': row['id'], 'message_type': row['message_type'], 'order': row['order']}
+            if row['character_id']:
+                message['character'] = row['character_id']
+                character_ids.add(row['character_id'])
+            for field in cls.CONTENT_FIELDS:
+                if row[field] and field in cls.MEDIA_FIELDS:
+                    # media is stored as a site relative url, the view makes it absolute for the request
+                    name = row[field]
+                    if field == 'image_content':
+                        name = variant_name(name, row['image_variants'], 'preview')
+                    message[field] = Message._meta.get_field(field).storage.url(name)
+                elif row[field]:
+                    message[field] = row[field]
+            messages.append(message)
+
+        characters = Character.objects.filter(id__in=character_ids).values('id', 'name', 'color')
+        return {
+            'episode': {'id': episode.id, 'title': episode.title, 'story': episode.story_id},
+            'characters': {str(character.pop('id')): character for character in characters},
+            'messages': messages,
+        }
+
+
+class MediaBlob(models.Model):
+    # a file of the deduplicated media storage, references counts the model fields that point to it
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.PositiveBigIntegerField()
+    references = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # moved by every save of the same content, the blob is kept for a while even without references
+    saved_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.references})'
+
+    @classmethod
+    def acquire(cls, names):
+        cls.change_references(names, 1)
+
+    @classmethod
+    def release(cls, names):
+        names = cls.change_references(names, -1)
+        # the blob is deleted once the release is committed, unless it was referenced again meanwhile
+        if names:
+            transaction.on_commit(lambda: [
+                media_storage().delete(name)
+                for name in cls.objects.filter(name__in=names, references=0).values_list('name', flat=True)
+            ])
+
+    @classmethod
+    def change_references(cls, names, sign):
+        counts = {}
+        for name in names:
+            if name:
+                counts[name] = counts.get(name, 0) + 1
+
+        by_count = {}
+        for name, count in counts.items():
+            by_count.setdefault(count, []).append(name)
+        for count, group in by_count.items():
+            blobs = cls.objects.filter(name__in=group)
+            if sign < 0:
+                blobs = blobs.filter(references__gte=count)
+            blobs.update(references=F('references') + sign * count)
+        return list(counts)
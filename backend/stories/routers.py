@@ -3,7 +3,7 @@ from rest_framework.routers import DefaultRouter
 from .viewsets import (
     StoryViewSet, CharacterViewSet,
     CommentViewSet, SavedStoryViewSet,
-    EpisodeViewSet, MessageViewSet
+    EpisodeViewSet, MessageViewSet, MediaUploadViewSet
 )
 
 router = DefaultRouter()
@@ -13,3 +13,4 @@ router.register('comments', CommentViewSet, basename='comments')
 router.register('saved-stories', SavedStoryViewSet, basename='saved-stories')
 router.register('episodes', EpisodeViewSet, basename='episodes')
 router.register('messages', MessageViewSet, basename='messages')
+router.register('uploads', MediaUploadViewSet, basename='uploads')
@@ -1,4 +1,7 @@
 from rest_framework import serializers
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -6,8 +9,9 @@ User = get_user_model()
 from .models import (
     Category, Story, Character,
     Comment, SavedStory, Episode,
-    Message, UserStoryStatus
+    Message, UserStoryStatus, MediaUpload
 )
+from .thumbnails import variant_url
 from authentication.serializers import (
     UserAccountSerializer
 )
@@ -32,14 +36,17 @@ class StorySerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        representation['likes_count'] = instance.get_count_likes()
-        representation['comments_count'] = instance.get_count_comments()
-        representation['views'] = instance.get_count_views()
+        representation['likes_count'] = instance.likes_count
+        representation['comments_count'] = instance.comments_count
+        representation['views'] = instance.views_count
 
         if instance.image:
-            representation['image'] = self.context['request'].build_absolute_uri(instance.image.url)
+            build_absolute_uri = self.context['request'].build_absolute_uri
+            representation['image'] = build_absolute_uri(variant_url(instance.image, instance.image_variants, 'card'))
+            representation['image_original'] = build_absolute_uri(instance.image.url)
         else:
             representation['image'] = None
+            representation['image_original'] = None
 
         if 'request' in self.context:
             representation['author'] = UserAccountSerializer(instance.author).data
@@ -48,6 +55,9 @@ class StorySerializer(serializers.ModelSerializer):
         return representation
 
     def get_is_liked(self, obj):
+        if hasattr(obj, 'is_liked'):
+            return obj.is_liked
+
         request = self.context.get('request')
         if request:
             user = request.user
@@ -58,6 +68,9 @@ class StorySerializer(serializers.ModelSerializer):
         return False
 
     def get_is_saved(self, obj):
+        if hasattr(obj, 'is_saved'):
+            return obj.is_saved
+
         request = self.context.get('request')
         if request:
             user = request.user
@@ -99,7 +112,7 @@ class CommentSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        representation['likes_count'] = instance.get_count_likes()
+        representation['likes_count'] = instance.likes_count
         del representation['story']
 
         if 'request' in self.context:
@@ -151,7 +164,10 @@ class MessageSerializer(serializers.ModelSerializer):
 
         if request:
             if instance.image_content:
-                representation['image_content'] = request.build_absolute_uri(instance.image_content.url)
+                representation['image_content'] = request.build_absolute_uri(
+                    variant_url(instance.image_content, instance.image_variants, 'preview')
+                )
+                representation['image_content_original'] = request.build_absolute_uri(instance.image_content.url)
             if instance.video_content:
                 representation['video_content'] = request.build_absolute_uri(instance.video_content.url)
             if instance.audio_content:
@@ -164,3 +180,29 @@ class UserStoryStatusSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserStoryStatus
         fields = ['id', 'user', 'story', 'episode', 'message']
+
+
+class MediaUploadSerializer(serializers.ModelSerializer):
+    completed = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = MediaUpload
+        fields = ['id', 'kind', 'filename', 'size', 'checksum', 'received', 'completed']
+        read_only_fields = ['received']
+
+    def get_completed(self, obj):
+        return obj.completed_at is not None
+
+    def validate_size(self, size):
+        if size > settings.MEDIA_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f'Uploads are limited to {settings.MEDIA_UPLOAD_MAX_SIZE} bytes.')
+        return size
+
+    def validate(self, data):
+        field = Message._meta.get_field(f'{data["kind"]}_content')
+        try:
+            for validator in field.validators:
+                validator(File(None, name=data['filename']))
+        except ValidationError as err:
+            raise serializers.ValidationError({'filename': err.messages})
+        return data
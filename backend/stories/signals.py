@@ -0,0 +1,111 @@
+import os
+
+from django.db.models import F
+from django.utils import timezone
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Category, Story, Comment, Episode, Message, Character, EpisodeBundle, MediaUpload, MediaBlob
+from .cache import bump_version
+from .thumbnails import IMAGE_VARIANTS, schedule_variants, variants_ready
+from .storage import MEDIA_REFERENCE_FIELDS, media_references
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        Story.objects.filter(pk=instance.story_id).update(comments_count=F('comments_count') + 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    # a counter that drifted to 0 stays there, reconcile_counters recounts it
+    Story.objects.filter(pk=instance.story_id, comments_count__gt=0).update(comments_count=F('comments_count') - 1)
+
+
+@receiver([post_save, post_delete], sender=Story)
+def story_changed(sender, instance, **kwargs):
+    bump_version(('story', instance.pk))
+    bump_version('stories')
+
+
+@receiver([post_save, post_delete], sender=Episode)
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=Character)
+def story_content_changed(sender, instance, **kwargs):
+    bump_version(('story', instance.story_id))
+
+
+@receiver([post_save, post_delete], sender=Message)
+def message_changed(sender, instance, **kwargs):
+    EpisodeBundle.invalidate(pk=instance.episode_id)
+
+
+@receiver(post_save, sender=Episode)
+def episode_saved(sender, instance, created, **kwargs):
+    if not created:
+        EpisodeBundle.invalidate(pk=instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Character)
+def character_changed(sender, instance, **kwargs):
+    EpisodeBundle.invalidate(story_id=instance.story_id)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, instance, **kwargs):
+    bump_version('categories')
+
+
+def image_saved(sender, instance, **kwargs):
+    schedule_variants(instance)
+
+
+for label in IMAGE_VARIANTS:
+    post_save.connect(image_saved, sender=label, dispatch_uid=f'image_variants_{label}')
+
+
+@receiver(variants_ready, sender=Story)
+def story_variants_ready(sender, pk, **kwargs):
+    bump_version(('story', pk))
+    bump_version('stories')
+
+
+@receiver(variants_ready, sender=Message)
+def message_variants_ready(sender, pk, **kwargs):
+    # variants are recorded with a plain update, move updated_at so conditional reads see the new urls
+    Message.objects.filter(pk=pk).update(updated_at=timezone.now())
+    EpisodeBundle.invalidate(messages=pk)
+
+
+@receiver(post_delete, sender=MediaUpload)
+def media_upload_deleted(sender, instance, **kwargs):
+    if os.path.exists(instance.part_path):
+        os.remove(instance.part_path)
+
+
+def media_loaded(sender, instance, **kwargs):
+    instance._media_references = media_references(instance)
+
+
+def media_saved(sender, instance, created, **kwargs):
+    current = media_references(instance)
+    previous = {} if created else instance._media_references
+    if created:
+        changed = list(current)
+    else:
+        # fields deferred when the instance was loaded are not compared, reconcile_media_blobs recounts them
+        changed = [field for field, name in current.items() if field in previous and previous[field] != name]
+    MediaBlob.acquire([current[field] for field in changed])
+    MediaBlob.release([previous.get(field) for field in changed])
+    instance._media_references = current
+
+
+def media_deleted(sender, instance, **kwargs):
+    MediaBlob.release(instance._media_references.values())
+
+
+for label in MEDIA_REFERENCE_FIELDS:
+    post_init.connect(media_loaded, sender=label, dispatch_uid=f'media_loaded_{label}')
+    post_save.connect(media_saved, sender=label, dispatch_uid=f'media_saved_{label}')
+    post_delete.connect(media_deleted, sender=label, dispatch_uid=f'media_deleted_{label}')
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import uuid
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, storages
+from django.db import transaction
+from django.utils import timezone
+
+
+# model label: file fields stored in the media storage, their values are counted as blob references
+MEDIA_REFERENCE_FIELDS = {
+    'stories.Story': ('image',),
+    'stories.Message': ('image_content', 'video_content', 'audio_content'),
+    'authentication.UserAccount': ('photo',),
+}
+
+
+def media_storage():
+    return storages['media']
+
+
+class DeduplicatedFileSystemStorage(FileSystemStorage):
+    """
+    Stores every upload once under the sha256 digest of its content, whatever name it was saved with.
+
+    Seekable uploads are hashed before anything is written, so a file that is already stored
+    returns its name without writing a byte. Other streams are written to a temporary file while
+    they are hashed. References from model fields are counted by MediaBlob, a blob is only
+    deleted when nothing refers to it anymore and it was not saved within MEDIA_BLOB_GRACE_HOURS,
+    as the field that reuses a saved blob counts its reference only after the save.
+    """
+    BLOB_DIR = 'blobs'
+    # hidden, so the media view never serves half written files
+    TEMP_DIR = 'blobs/.tmp'
+
+    def blob_name(self, digest, name):
+        extension = os.path.splitext(name)[1].lower()
+        return f'{self.BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+    def _save(self, name, content):
+        try:
+            seekable = content.seekable()
+        except (AttributeError, ValueError):
+            seekable = False
+
+        if seekable:
+            digest = hashlib.sha256()
+            for chunk in content.chunks():
+                digest.update(chunk)
+            name, temp_name, size = self.blob_name(digest.hexdigest(), name), None, content.size
+        else:
+            name, temp_name = self.write_stream(name, content)
+            size = self.size(temp_name)
+
+        MediaBlob = apps.get_model('stories', 'MediaBlob')
+        with transaction.atomic():
+            # the row lock keeps a concurrent delete away until the blob is in place and marked as saved
+            blob, created = MediaBlob.objects.select_for_update().get_or_create(name=name, defaults={'size': size})
+            if not created:
+                blob.save(update_fields=['saved_at'])
+
+            if self.exists(name):
+                if temp_name is not None:
+                    os.remove(self.path(temp_name))
+            elif temp_name is not None:
+                self.move_into_place(temp_name, name)
+            else:
+                self.write_blob(name, content.chunks())
+        return name
+
+    def write_stream(self, name, content):
+        digest = hashlib.sha256()
+
+        def hashed_chunks():
+            for chunk in content.chunks():
+                digest.update(chunk)
+                yield chunk
+
+        temp_name = self.write_temp(hashed_chunks())
+        return self.blob_name(digest.hexdigest(), name), temp_name
+
+    def write_blob(self, name, chunks):
+        # written next to the blob and renamed, a reader never sees a partial blob under its final name
+        self.move_into_place(self.write_temp(chunks), name)
+
+    def write_temp(self, chunks):
+        temp_name = f'{self.TEMP_DIR}/{uuid.uuid4().hex}'
+        os.makedirs(os.path.dirname(self.path(temp_name)), exist_ok=True)
+        with open(self.path(temp_name), 'wb') as temp:
+            for chunk in chunks:
+                temp.write(chunk)
+        return temp_name
+
+    def move_into_place(self, temp_name, name):
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # a concurrent upload of the same content may win the race, both files hold the same bytes
+        file_move_safe(self.path(temp_name), full_path, allow_overwrite=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+
+    def delete(self, name):
+        self.delete_unreferenced(name, timezone.now() - timedelta(hours=settings.MEDIA_BLOB_GRACE_HOURS))
+
+    def delete_unreferenced(self, name, saved_before):
+        MediaBlob = apps.get_model('stories', 'MediaBlob')
+        with transaction.atomic():
+            # locked like in _save, a blob that is saved again meanwhile is either kept or written anew
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and (blob.references > 0 or blob.saved_at >= saved_before):
+                return False
+            if blob is not None:
+                blob.delete()
+            super().delete(name)
+        return True
+
+
+def media_references(instance):
+    # deferred fields are skipped, reading them would cost a query per instance
+    deferred = instance.get_deferred_fields()
+    return {
+        field: getattr(instance, field).name or None
+        for field in MEDIA_REFERENCE_FIELDS[instance._meta.label] if field not in deferred
+    }
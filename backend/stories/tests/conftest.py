@@ -0,0 +1,12 @@
+import pytest
+
+
+@pytest.fixture
+def media(settings, tmp_path):
+    # a media root of its own, upload parts are assembled next to it
+    settings.MEDIA_ROOT = tmp_path / 'media'
+    settings.MEDIA_UPLOAD_TEMP_DIR = tmp_path / 'parts'
+    # released blobs are deleted right away unless a test sets a grace period
+    settings.MEDIA_BLOB_GRACE_HOURS = 0
+    settings.MEDIA_ROOT.mkdir()
+    return settings.MEDIA_ROOT
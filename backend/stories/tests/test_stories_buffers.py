@@ -0,0 +1,137 @@
+import pytest
+
+from datetime import timedelta
+from django.utils import timezone
+
+from ..buffers import view_buffer, progress_buffer
+from ..models import Story, IpAddress, UserStoryStatus
+
+pytestmark = pytest.mark.django_db
+
+
+class TestStoryViewBuffer:
+    def test_flush_deduplicates(self, story_factory, ip_address_factory):
+        story = story_factory()
+        other_story = story_factory()
+        known_ip = ip_address_factory(ip='10.0.0.1')
+        story.add_view(known_ip)
+
+        for story_id, ip in [(story.pk, '10.0.0.1'), (story.pk, '10.0.0.2'), (story.pk, '10.0.0.2'),
+                             (other_story.pk, '10.0.0.2'), (0, '10.0.0.3')]:
+            view_buffer.record(story_id, ip)
+
+        assert view_buffer.flush() == 4
+        story.refresh_from_db()
+        other_story.refresh_from_db()
+        assert story.views_count == story.views.count() == 2
+        assert other_story.views_count == other_story.views.count() == 1
+        assert IpAddress.objects.filter(ip='10.0.0.2').count() == 1
+
+    def test_flush_counts_inserted_views(self, story_factory, ip_address_factory):
+        story = story_factory()
+        view_buffer.record(story.pk, '10.0.0.1')
+        pending = view_buffer.take()
+        # another process writes the same view between the reads and the insert
+        story.add_view(ip_address_factory(ip='10.0.0.1'))
+
+        view_buffer.write(list(pending))
+        story.refresh_from_db()
+        assert story.views_count == story.views.count() == 1
+
+    def test_flush_in_batches(self, story_factory, settings):
+        settings.STORY_VIEWS_BATCH_SIZE = 2
+        story = story_factory()
+        for i in range(5):
+            view_buffer.record(story.pk, f'10.0.1.{i}')
+
+        view_buffer.flush()
+        assert Story.objects.get(pk=story.pk).views_count == 5
+
+    def test_failed_write_is_retried(self, story_factory, settings, monkeypatch):
+        settings.STORY_VIEWS_BATCH_SIZE = 2
+        story = story_factory()
+        for i in range(3):
+            view_buffer.record(story.pk, f'10.0.3.{i}')
+
+        def fail(items):
+            raise ConnectionError('connection lost')
+
+        monkeypatch.setattr(view_buffer, 'write', fail)
+        with pytest.raises(ConnectionError):
+            view_buffer.flush()
+        monkeypatch.undo()
+        view_buffer.record(story.pk, '10.0.3.0')
+        view_buffer.record(story.pk, '10.0.3.3')
+
+        assert view_buffer.flush() == 4
+        assert Story.objects.get(pk=story.pk).views_count == 4
+
+    def test_rejected_batch_is_dropped(self, story_factory, settings, caplog):
+        settings.STORY_VIEWS_BATCH_SIZE = 1
+        story = story_factory()
+        # longer than IpAddress.ip, the database refuses it on every attempt
+        for ip in ('10.0.4.1', 'x' * 300, '10.0.4.2'):
+            view_buffer.record(story.pk, ip)
+
+        assert view_buffer.flush() == 3
+        assert not view_buffer.take()
+        assert Story.objects.get(pk=story.pk).views_count == 2
+        assert 'could not write' in caplog.text
+
+    def test_flush_into_sketches(self, story_factory, settings):
+        settings.STORY_VIEWS_MODE = 'sketch'
+        story = story_factory()
+        for i in range(100):
+            view_buffer.record(story.pk, f'10.0.2.{i}')
+        view_buffer.flush()
+        view_buffer.record(story.pk, '10.0.2.0')
+        view_buffer.flush()
+
+        story.refresh_from_db()
+        today = timezone.localdate()
+        assert story.views.count() == 0
+        assert story.view_sketches.count() == 2
+        assert story.views_count == story.count_unique_views() == 100
+        assert story.count_unique_views(start=today) == 100
+        assert story.count_unique_views(end=today - timedelta(days=1)) == 0
+
+
+class TestProgressBuffer:
+    def test_flush_keeps_latest_position(self, user_factory, message_factory):
+        user = user_factory()
+        first, second = message_factory.create_batch(2)
+        other = message_factory(episode=second.episode)
+        UserStoryStatus.objects.create(user=user, story=first.episode.story, episode=first.episode, message=first)
+
+        progress_buffer.record(user.pk, first.episode.story_id, first.episode_id, first.pk)
+        progress_buffer.record(user.pk, second.episode.story_id, second.episode_id, second.pk)
+        progress_buffer.record(user.pk, second.episode.story_id, second.episode_id, other.pk)
+        # the message does not belong to the story
+        progress_buffer.record(user.pk, first.episode.story_id, second.episode_id, other.pk)
+        assert progress_buffer.position(user.pk, second.episode.story_id) == (second.episode_id, other.pk)
+
+        assert progress_buffer.flush() == 2
+        assert progress_buffer.position(user.pk, second.episode.story_id) is None
+        statuses = dict(UserStoryStatus.objects.filter(user=user).values_list('story_id', 'message_id'))
+        assert statuses == {first.episode.story_id: first.pk, second.episode.story_id: other.pk}
+
+    def test_failed_write_keeps_newer_position(self, user_factory, message_factory, monkeypatch):
+        user = user_factory()
+        first, second = message_factory.create_batch(2)
+        other = message_factory(episode=second.episode)
+        progress_buffer.record(user.pk, first.episode.story_id, first.episode_id, first.pk)
+        progress_buffer.record(user.pk, second.episode.story_id, second.episode_id, second.pk)
+
+        def fail(items):
+            raise ConnectionError('connection lost')
+
+        monkeypatch.setattr(progress_buffer, 'write', fail)
+        with pytest.raises(ConnectionError):
+            progress_buffer.flush()
+        monkeypatch.undo()
+        # recorded after the failed flush, it replaces the position put back for the story
+        progress_buffer.record(user.pk, second.episode.story_id, second.episode_id, other.pk)
+
+        assert progress_buffer.flush() == 2
+        statuses = dict(UserStoryStatus.objects.filter(user=user).values_list('story_id', 'message_id'))
+        assert statuses == {first.episode.story_id: first.pk, second.episode.story_id: other.pk}
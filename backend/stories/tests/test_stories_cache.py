@@ -0,0 +1,79 @@
+import pytest
+
+from django.urls import reverse
+
+pytestmark = pytest.mark.django_db
+
+
+class TestResponseCache:
+    def test_story_detail(self, story_factory, api_client, django_assert_num_queries):
+        story = story_factory(title='Original')
+        url = reverse('stories-detail', args=[story.pk])
+        api_client.get(url)
+
+        with django_assert_num_queries(0):
+            response = api_client.get(url)
+        assert response.data['title'] == 'Original'
+
+        story.title = 'Changed'
+        story.save()
+        assert api_client.get(url).data['title'] == 'Changed'
+
+    def test_not_modified_from_cache(self, story_factory, api_client, django_assert_num_queries):
+        story = story_factory()
+        url = reverse('stories-detail', args=[story.pk])
+        etag = api_client.get(url)['ETag']
+
+        with django_assert_num_queries(0):
+            response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+
+    def test_story_list(self, story_factory, category_factory, api_client, django_assert_num_queries):
+        story_factory()
+        url = reverse('stories-list')
+        api_client.get(url)
+
+        with django_assert_num_queries(0):
+            assert len(api_client.get(url).data['results']) == 1
+
+        story_factory()
+        assert len(api_client.get(url).data['results']) == 2
+        assert len(api_client.get(url, {'page_size': 1}).data['results']) == 1
+
+    def test_episodes(self, story_factory, episode_factory, api_client, django_assert_num_queries):
+        story = story_factory()
+        episode_factory(story=story)
+        url = reverse('stories-episodes', args=[story.pk])
+        api_client.get(url)
+
+        with django_assert_num_queries(0):
+            assert len(api_client.get(url).data) == 1
+
+        episode_factory(story=story)
+        assert len(api_client.get(url).data) == 2
+
+    def test_categories(self, category_factory, api_client, django_assert_num_queries):
+        category = category_factory()
+        url = reverse('categories')
+        api_client.get(url)
+
+        with django_assert_num_queries(0):
+            assert len(api_client.get(url).data) == 1
+
+        category.delete()
+        assert len(api_client.get(url).data) == 0
+
+    def test_authenticated_bypass(self, story_factory, user_factory, get_jwt_token, api_client):
+        user = user_factory()
+        story = story_factory()
+        url = reverse('stories-detail', args=[story.pk])
+        api_client.get(url)
+        story.like(user)
+
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+        assert api_client.get(url).data['is_liked'] is True
+
+    def test_missing_story_not_cached(self, api_client):
+        assert api_client.get(reverse('stories-detail', args=[0])).status_code == 404
+        assert api_client.get(reverse('stories-detail', args=['abc'])).status_code == 404
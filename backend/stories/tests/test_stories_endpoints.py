@@ -1,12 +1,30 @@
+import io
 import pytest
 import json
+import tarfile
 
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from ..models import SavedStory, Story
+from ..archive import ARCHIVE_DATA_NAME, export_story
+from ..buffers import view_buffer, progress_buffer
+from ..models import SavedStory, Story, Episode, Message, UserStoryStatus
 
 pytestmark = pytest.mark.django_db
 
+ARCHIVE_STORY = {
+    'type': 'story', 'version': 1, 'title': 'Imported', 'description': 'Story', 'category': None,
+    'image': None, 'published': False, 'publish_date': None
+}
+ARCHIVE_MESSAGE = {
+    'type': 'message', 'episode_id': 1, 'character_id': None, 'order': 1024, 'message_type': 'status',
+    'text_content': '', 'status_content': 'The end', 'image_content': None, 'video_content': None,
+    'audio_content': None
+}
+
 
 class TestCategoryEndpoints:
     url = reverse('categories')
@@ -18,6 +36,14 @@ class TestCategoryEndpoints:
         assert response.status_code == 200
         assert len(json.loads(response.content)) == 4
 
+    def test_categories_not_modified(self, category_factory, api_client):
+        category_factory()
+        etag = api_client.get(self.url)['ETag']
+
+        assert api_client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+        category_factory()
+        assert api_client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
 
 class TestCommentEndpoints:
     def test_create(self, story_factory, user_factory, get_jwt_token, api_client):
@@ -90,7 +116,7 @@ class TestStoryEndpoints:
         response = api_client.get(url)
 
         assert response.status_code == 200
-        assert int(json.loads(response.content).get('total', 0)) == 4
+        assert len(json.loads(response.content).get('results')) == 4
 
     def test_get_random(self, story_factory, api_client):
         url = reverse('stories-random')
@@ -100,6 +126,29 @@ class TestStoryEndpoints:
         assert response.status_code == 200
         assert Story.objects.filter(id=response.data.get('id')).exists()
 
+    def test_get_random_filters(self, story_factory, category_factory, api_client):
+        category = category_factory()
+        published = story_factory(published=True, category=category)
+        story_factory.create_batch(30, published=False, category=category)
+        story_factory.create_batch(30, published=True)
+        url = f"{reverse('stories-random')}?published=true&category={category.pk}"
+
+        for _ in range(5):
+            response = api_client.get(url)
+            assert response.status_code == 200
+            assert response.data['id'] == published.pk
+
+    def test_get_random_spread(self, story_factory, api_client):
+        stories = story_factory.create_batch(5)
+        seen = {api_client.get(reverse('stories-random')).data['id'] for _ in range(40)}
+
+        assert seen <= {story.pk for story in stories}
+        assert len(seen) > 1
+
+    def test_get_random_empty(self, api_client):
+        response = api_client.get(f"{reverse('stories-random')}?published=true")
+        assert response.status_code == 404
+
     def test_order_by_likes_count(self, story_factory, user_factory, api_client):
         url = reverse('stories-list')
         url = f'{url}?ordering=-likes_count'
@@ -116,14 +165,109 @@ class TestStoryEndpoints:
         assert response.data.get('results')[0].get('likes_count') == 2
         assert response.data.get('results')[1].get('likes_count') == 1
 
+    def test_list_constant_queries(self, story_factory, user_factory, comment_factory,
+                                   saved_story_factory, get_jwt_token, api_client,
+                                   django_assert_max_num_queries):
+        user = user_factory()
+        token = get_jwt_token(current_user=user)
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {token}')
+        for story in story_factory.create_batch(10, likes=[user]):
+            comment_factory(story=story)
+            saved_story_factory(user=user, story=story)
+
+        # authentication and the page with its like and save flags, keyset pagination reads one extra row
+        # instead of counting
+        with django_assert_max_num_queries(3):
+            response = api_client.get(reverse('stories-list'))
+        assert response.status_code == 200
+        assert all(story['is_liked'] and story['is_saved'] for story in response.data['results'])
+        assert all(story['comments_count'] == 1 for story in response.data['results'])
+
+        with django_assert_max_num_queries(4):
+            response = api_client.get(reverse('saved-stories-list'))
+        assert response.status_code == 200
+        assert all(story['likes_count'] == 1 for story in response.data['results'])
+
+    def test_search(self, story_factory, category_factory, api_client):
+        category = category_factory()
+        in_description = story_factory(title='Midnight', description='The dragons were running late', category=category)
+        in_title = story_factory(title='Dragon run', description='Nothing here', category=category)
+        story_factory(title='Dragon', description='Other category')
+        story_factory(title='Unrelated', description='Nothing here', category=category)
+        url = reverse('stories-list')
+
+        response = api_client.get(url, {'search': 'dragons run', 'category': category.pk})
+        assert response.status_code == 200
+        assert [story['id'] for story in response.data['results']] == [in_title.pk, in_description.pk]
+
+        response = api_client.get(url, {'search': 'dragons run', 'category': category.pk, 'page_size': 1})
+        response = api_client.get(response.data['links']['next'])
+        assert [story['id'] for story in response.data['results']] == [in_description.pk]
+        assert response.data['links']['next'] is None
+
+    def test_search_follows_updates(self, story_factory, api_client):
+        story = story_factory(title='Before')
+        story.title = 'Sunrise'
+        story.save()
+
+        response = api_client.get(reverse('stories-list'), {'search': 'sunrise'})
+        assert [item['id'] for item in response.data['results']] == [story.pk]
+
+    def test_list_skips_search_vector(self, story_factory, api_client):
+        story_factory.create_batch(2)
+
+        with CaptureQueriesContext(connection) as queries:
+            assert api_client.get(reverse('stories-list')).status_code == 200
+        assert not any('search_vector' in query['sql'] for query in queries)
+
+        # a story loaded without the vector still saves and is found by its new title
+        story = Story.objects.with_stats().get(pk=story_factory().pk)
+        story.title = 'Moonrise'
+        story.save()
+        response = api_client.get(reverse('stories-list'), {'search': 'moonrise'})
+        assert [item['id'] for item in response.data['results']] == [story.pk]
+
     def test_retrieve(self, story_factory, api_client):
         story = story_factory()
         url = reverse('stories-detail', args=[story.pk])
 
+        with CaptureQueriesContext(connection) as context:
+            response = api_client.get(url)
+        assert response.status_code == 200
+        assert all(query['sql'].startswith('SELECT') for query in context.captured_queries)
+
+        api_client.get(url)
+        view_buffer.flush()
+        story.refresh_from_db()
+        assert story.views_count == 1
+
+    def test_retrieve_forwarded_ip(self, story_factory, api_client):
+        story = story_factory()
+        url = reverse('stories-detail', args=[story.pk])
+
+        api_client.get(url, HTTP_X_FORWARDED_FOR='10.0.0.9, 10.0.0.1')
+        api_client.get(url, HTTP_X_FORWARDED_FOR='x' * 300)
+        assert sorted(view_buffer.take()) == [(story.pk, '10.0.0.9'), (story.pk, '127.0.0.1')]
+
+    def test_retrieve_not_modified(self, story_factory, user_factory, get_jwt_token, api_client):
+        story = story_factory()
+        url = reverse('stories-detail', args=[story.pk])
+        user = user_factory()
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+
         response = api_client.get(url)
-        data = json.loads(response.content)
+        etag = response['ETag']
+        assert response['Last-Modified']
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert not response.content
+
+        # a like does not touch updated_at but changes the representation
+        story.like(user)
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
         assert response.status_code == 200
-        assert int(data.get('views', 0)) == 1
+        assert response['ETag'] != etag
 
     def test_create(self, get_jwt_token, category_factory, api_client):
         url = reverse('stories-list')
@@ -210,6 +354,107 @@ class TestStoryEndpoints:
         assert response.status_code == 200
         assert len(json.loads(response.content)) == 1
 
+    def test_export(self, character_factory, message_factory, user_factory, get_jwt_token, api_client):
+        author = user_factory()
+        character = character_factory(story__author=author)
+        message = message_factory(episode__story=character.story, character=character)
+        url = reverse('stories-export', args=[message.episode.story.pk])
+
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token()}')
+        assert api_client.get(url).status_code == 403
+
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=author)}')
+        response = api_client.get(url)
+        assert response.status_code == 200
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        assert [record['type'] for record in records] == ['story', 'character', 'episode', 'message']
+        assert records[3]['text_content'] == message.text_content
+
+    def test_export_async(self, message_factory, get_jwt_token, async_client):
+        message = message_factory()
+        token = get_jwt_token(current_user=message.episode.story.author)
+        url = reverse('stories-export', args=[message.episode.story.pk])
+
+        async def fetch():
+            response = await async_client.get(url, headers={'Authorization': f'JWT {token}'})
+            return response, b''.join([part async for part in response.streaming_content])
+
+        response, content = async_to_sync(fetch)()
+
+        assert response.is_async
+        assert len(content.splitlines()) == 3
+
+    def test_import(self, message_factory, user_factory, get_jwt_token, api_client):
+        message = message_factory()
+        archive = SimpleUploadedFile('story.ndjson', ''.join(export_story(message.episode.story)).encode())
+        user = user_factory()
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+
+        response = api_client.post(reverse('stories-import'), {'archive': archive}, format='multipart')
+
+        assert response.status_code == 201
+        assert response.data['counts'] == {'characters': 0, 'episodes': 1, 'messages': 1}
+        story = Story.objects.get(pk=response.data['id'])
+        assert story.author == user
+        assert story.episodes.get().messages.get().text_content == message.text_content
+
+    def test_import_invalid(self, get_jwt_token, api_client):
+        archive = SimpleUploadedFile('story.ndjson', b'{"type": "message"}\n')
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token()}')
+
+        response = api_client.post(reverse('stories-import'), {'archive': archive}, format='multipart')
+
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize('records', [
+        [{'type': 'character', 'id': 1, 'name': 'Ann', 'color': 5}],
+        [{'type': 'character', 'id': [1], 'name': 'Ann', 'color': '#fff'}],
+        [{'type': 'episode', 'id': 1, 'title': None}],
+        [{'type': 'episode', 'id': 1, 'title': 'One'}, ARCHIVE_MESSAGE, ARCHIVE_MESSAGE],
+        [{'type': 'episode', 'id': 1, 'title': 'One'}, {**ARCHIVE_MESSAGE, 'order': [1]}],
+        [{'type': 'episode', 'id': 1, 'title': 'One'}, {**ARCHIVE_MESSAGE, 'order': 0}],
+        [{'type': 'episode', 'id': 1, 'title': 'One'}, {**ARCHIVE_MESSAGE, 'order': -1024}],
+        [{'type': 'episode', 'id': 1, 'title': 'One'}, {**ARCHIVE_MESSAGE, 'episode_id': [1]}],
+        [{'type': 'episode', 'id': 1, 'title': 'One'}, {**ARCHIVE_MESSAGE, 'image_content': ['a.png']}],
+        [['not', 'an', 'object']],
+    ])
+    def test_import_malformed_records(self, records, get_jwt_token, api_client):
+        lines = [ARCHIVE_STORY, *records]
+        archive = SimpleUploadedFile('story.ndjson', ''.join(json.dumps(line) + '\n' for line in lines).encode())
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token()}')
+
+        response = api_client.post(reverse('stories-import'), {'archive': archive}, format='multipart')
+
+        assert response.status_code == 400
+        assert not Story.objects.exists()
+
+    def test_import_story_without_title(self, get_jwt_token, api_client):
+        archive = SimpleUploadedFile('story.ndjson', json.dumps({**ARCHIVE_STORY, 'title': None}).encode())
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token()}')
+
+        response = api_client.post(reverse('stories-import'), {'archive': archive}, format='multipart')
+
+        assert response.status_code == 400
+        assert not Story.objects.exists()
+
+    def test_import_uncompressed_tarball(self, get_jwt_token, api_client):
+        data = json.dumps(ARCHIVE_STORY).encode()
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w') as tar:
+            info = tarfile.TarInfo(ARCHIVE_DATA_NAME)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token()}')
+
+        archive = SimpleUploadedFile('story.tar', buffer.getvalue())
+        response = api_client.post(reverse('stories-import'), {'archive': archive}, format='multipart')
+        assert response.status_code == 201
+
+        # a tarball cut off in the middle of its data member
+        archive = SimpleUploadedFile('story.tar', buffer.getvalue()[:600])
+        response = api_client.post(reverse('stories-import'), {'archive': archive}, format='multipart')
+        assert response.status_code == 400
+
     def test_toggle_like_story(self, user_factory, story_factory, get_jwt_token, api_client):
         user = user_factory()
         story = story_factory()
@@ -393,6 +638,143 @@ class TestEpisodeViewSet:
 
         assert response.status_code == 204
 
+    def test_reorder_messages(self, user_factory, episode_factory, message_factory, get_jwt_token, api_client,
+                              django_assert_max_num_queries):
+        user = user_factory()
+        episode = episode_factory(story__author=user)
+        messages = message_factory.create_batch(4, episode=episode)
+        new_order = [messages[2].pk, messages[0].pk, messages[3].pk, messages[1].pk]
+        url = reverse('episodes-reorder', args=[episode.pk])
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+
+        # includes the row locks on the episode
+        with django_assert_max_num_queries(12):
+            response = api_client.post(url, data={'messages': new_order}, format='json')
+
+        assert response.status_code == 200
+        assert list(episode.messages.values_list('id', flat=True)) == new_order
+        assert list(episode.messages.values_list('order', flat=True)) == [1024, 2048, 3072, 4096]
+
+    def test_reorder_messages_incomplete(self, user_factory, episode_factory, message_factory, get_jwt_token,
+                                         api_client):
+        user = user_factory()
+        episode = episode_factory(story__author=user)
+        messages = message_factory.create_batch(3, episode=episode)
+        url = reverse('episodes-reorder', args=[episode.pk])
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+
+        response = api_client.post(url, data={'messages': [messages[0].pk, messages[1].pk]}, format='json')
+        assert response.status_code == 400
+        response = api_client.post(url, data={'messages': [messages[0].pk] * 3}, format='json')
+        assert response.status_code == 400
+        response = api_client.post(url, data={'messages': [[messages[0].pk], {}, None]}, format='json')
+        assert response.status_code == 400
+
+    def test_reorder_messages_not_author(self, user_factory, episode_factory, message_factory, get_jwt_token,
+                                         api_client):
+        episode = episode_factory()
+        message = message_factory(episode=episode)
+        url = reverse('episodes-reorder', args=[episode.pk])
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token()}')
+
+        response = api_client.post(url, data={'messages': [message.pk]}, format='json')
+        assert response.status_code == 403
+
+    @pytest.mark.parametrize('size', [30, 3000])
+    def test_get_messages_resume_position(self, size, user_factory, episode_factory, get_jwt_token, api_client,
+                                          django_assert_max_num_queries):
+        user = user_factory()
+        episode = episode_factory()
+        messages = Message.objects.bulk_create(
+            [Message(episode=episode, order=1024 * (i + 1), text_content=f'{i}') for i in range(size)]
+        )
+        bookmark = messages[size - 5]
+        UserStoryStatus.objects.create(user=user, story=episode.story, episode=episode, message=bookmark)
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+
+        with django_assert_max_num_queries(7):
+            response = api_client.get(reverse('episodes-messages', args=[episode.pk]))
+
+        assert response.status_code == 200
+        assert response.data['page'] == (size - 5) // 10 + 1
+        assert bookmark.pk in [message['id'] for message in response.data['results']]
+
+    def test_update_status_is_read_before_flush(self, user_factory, message_factory, get_jwt_token, api_client,
+                                                django_assert_num_queries):
+        user = user_factory()
+        messages = message_factory.create_batch(15, episode=message_factory().episode)
+        episode = messages[0].episode
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+        data = {'story_id': episode.story_id, 'episode_id': episode.pk, 'message_id': messages[-1].pk}
+
+        # the authentication lookup and the check of the ids, the position is written later
+        with django_assert_num_queries(2):
+            response = api_client.post(reverse('update-story-status'), data, format='json')
+        assert response.status_code == 200
+        assert not UserStoryStatus.objects.exists()
+
+        response = api_client.get(reverse('update-story-status'), {'story_id': episode.story_id})
+        assert response.data['message'] == messages[-1].pk
+        assert api_client.get(reverse('episodes-messages', args=[episode.pk])).data['page'] == 2
+
+        progress_buffer.flush()
+        assert UserStoryStatus.objects.get(user=user).message == messages[-1]
+
+    def test_update_status_checks_ids(self, message_factory, episode_factory, get_jwt_token, api_client):
+        message = message_factory()
+        other_episode = episode_factory()
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token()}')
+
+        # the message is not in the episode, the episode is not in the story
+        for story_id, episode_id in [(message.episode.story_id, other_episode.pk),
+                                     (other_episode.story_id, message.episode_id)]:
+            data = {'story_id': story_id, 'episode_id': episode_id, 'message_id': message.pk}
+            response = api_client.post(reverse('update-story-status'), data, format='json')
+            assert response.status_code == 404
+        assert not progress_buffer.take()
+
+    def test_get_messages_not_modified(self, episode_factory, message_factory, get_jwt_token, api_client):
+        episode = episode_factory()
+        messages = message_factory.create_batch(3, episode=episode)
+        url = reverse('episodes-messages', args=[episode.pk])
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token()}')
+
+        etag = api_client.get(url)['ETag']
+        assert api_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+        episode.rebalance_message_orders([message.pk for message in reversed(messages)])
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert [message['id'] for message in response.data['results']] == [message.pk for message in reversed(messages)]
+
+    def test_get_bundle(self, user_factory, episode_factory, character_factory, message_factory, get_jwt_token,
+                        api_client, django_assert_num_queries):
+        episode = episode_factory()
+        next_episode = episode_factory(story=episode.story)
+        character = character_factory(story=episode.story)
+        message_factory.create_batch(3, episode=episode, character=character)
+        message_factory(episode=episode, character=None, message_type='status')
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token()}')
+        url = reverse('episodes-bundle', args=[episode.pk])
+
+        response = api_client.get(url)
+        assert response.status_code == 200
+        assert response.data['next_episode'] == next_episode.pk
+        assert response.data['characters'] == {str(character.pk): {'name': character.name, 'color': character.color}}
+        assert [message.get('character') for message in response.data['messages']] == [character.pk] * 3 + [None]
+        assert response.data['messages'][0]['image_content'].startswith('http://testserver/')
+
+        # the stored bundle is served without touching the messages
+        with django_assert_num_queries(4):
+            api_client.get(url)
+
+        character.name = 'Renamed'
+        character.save()
+        message_factory(episode=episode, character=character, text_content='Latest')
+        response = api_client.get(url)
+        assert response.data['characters'][str(character.pk)]['name'] == 'Renamed'
+        assert response.data['messages'][-1]['text_content'] == 'Latest'
+
     @pytest.mark.skip
     def test_get_messages(self, episode_factory, message_factory, api_client):
         episode = episode_factory()
@@ -451,6 +833,45 @@ class TestMessageEndpoints:
 
         assert response.status_code == 204
 
+    def test_create_duplicate_order(self, user_factory, message_factory, character_factory, get_jwt_token,
+                                    api_client):
+        user = user_factory()
+        message = message_factory(episode__story__author=user, order=1024)
+        data = {
+            'episode': message.episode.pk,
+            'order': 1024,
+            'character': character_factory().pk,
+            'message_type': 'text',
+            'text_content': 'Duplicate'
+        }
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+
+        response = api_client.post(reverse('messages-list'), data=data, format='json')
+        assert response.status_code == 400
+        assert Message.objects.count() == 1
+
+    def test_repeated_midpoint_inserts(self, user_factory, episode_factory, message_factory, get_jwt_token,
+                                       api_client):
+        user = user_factory()
+        episode = episode_factory(story__author=user)
+        first = message_factory(episode=episode, order=1024)
+        last = message_factory(episode=episode, order=2048)
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+
+        # keep moving the last message between the first one and its current position
+        expected = [first.pk]
+        for _ in range(60):
+            moved = message_factory(episode=episode, order=episode.messages.last().order + 1024)
+            orders = list(episode.messages.values_list('order', flat=True))
+            response = api_client.patch(reverse('messages-order', args=[moved.pk]),
+                                        data={'order': (orders[0] + orders[1]) / 2}, format='json')
+            assert response.status_code == 200
+            expected.insert(1, moved.pk)
+
+        assert list(episode.messages.values_list('id', flat=True)) == expected + [last.pk]
+        orders = list(episode.messages.values_list('order', flat=True))
+        assert min(b - a for a, b in zip(orders, orders[1:])) >= Episode.MIN_ORDER_GAP
+
     def test_update_order(self, user_factory, message_factory, get_jwt_token, api_client):
         user = user_factory()
         token = get_jwt_token(current_user=user)
@@ -465,3 +886,83 @@ class TestMessageEndpoints:
         assert response.status_code == 200
         message.refresh_from_db()
         assert message.order == new_order
+
+    def test_bulk_create(self, user_factory, episode_factory, character_factory, message_factory, get_jwt_token,
+                         api_client):
+        user = user_factory()
+        episode = episode_factory(story__author=user)
+        character = character_factory(story=episode.story)
+        message_factory(episode=episode, order=1024)
+        data = {
+            'episode': episode.pk,
+            'messages': [
+                {'message_type': 'text', 'character': character.pk, 'text_content': f'Line {i}'}
+                for i in range(50)
+            ] + [{'message_type': 'status', 'status_content': 'The end', 'order': 500}]
+        }
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = api_client.post(reverse('messages-bulk'), data=data, format='json')
+
+        assert response.status_code == 201
+        assert len(response.data) == 51
+        assert len(queries) < 15
+        contents = list(episode.messages.values_list('text_content', flat=True))
+        assert contents[2:] == [f'Line {i}' for i in range(50)]
+        assert episode.messages.first().status_content == 'The end'
+
+    def test_bulk_create_errors(self, user_factory, episode_factory, character_factory, message_factory,
+                                get_jwt_token, api_client):
+        user = user_factory()
+        episode = episode_factory(story__author=user)
+        character = character_factory(story=episode.story)
+        message_factory(episode=episode, order=1024)
+        data = {
+            'episode': episode.pk,
+            'messages': [
+                {'message_type': 'text', 'character': character.pk, 'text_content': 'Valid'},
+                {'message_type': 'text', 'character': character_factory().pk, 'text_content': 'Foreign'},
+                {'message_type': 'text', 'character': character.pk, 'text_content': 'Taken', 'order': 1024},
+                {'message_type': 'image', 'character': character.pk, 'image_content': 'missing'},
+                {'message_type': 'status', 'status_content': 'x' * 256},
+                {'message_type': 'text', 'character': character.pk, 'text_content': ['not', 'text']},
+                {'message_type': 'status', 'status_content': 'Bad order', 'order': -1},
+            ]
+        }
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+
+        response = api_client.post(reverse('messages-bulk'), data=data, format='json')
+
+        assert response.status_code == 400
+        assert [error['index'] for error in response.data['errors']] == [1, 2, 3, 4, 5, 6]
+        assert episode.messages.count() == 1
+
+    @pytest.mark.parametrize('item, error', [
+        ({'message_type': 'status', 'status_content': 'x', 'order': [1]}, 'Order must be a valid float.'),
+        ({'message_type': 'status', 'status_content': 'x', 'order': {'value': 1}}, 'Order must be a valid float.'),
+        ({'message_type': ['text'], 'text_content': 'x'}, 'message_type must be a string.'),
+        ({'message_type': {}, 'text_content': 'x'}, 'message_type must be a string.'),
+        ({'message_type': 'text', 'character': [1], 'text_content': 'x'}, 'character must be an integer id.'),
+        ({'message_type': 'text', 'character': {'id': 1}, 'text_content': 'x'}, 'character must be an integer id.'),
+        ({'message_type': 'image', 'image_content': ['photo']}, 'image_content must name a file part.'),
+        ({'message_type': 'video', 'video_content': {'name': 'clip'}}, 'video_content must name a file part.'),
+        ({'message_type': 'audio', 'audio_content': ['clip']}, 'audio_content must name a file part.'),
+    ])
+    def test_bulk_create_malformed_values(self, item, error, user_factory, episode_factory, character_factory,
+                                          get_jwt_token, api_client):
+        user = user_factory()
+        episode = episode_factory(story__author=user)
+        character = character_factory(story=episode.story)
+        item = {'character': character.pk, **item}
+        data = {
+            'episode': episode.pk,
+            'messages': [{'message_type': 'text', 'character': character.pk, 'text_content': 'Valid'}, item]
+        }
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+
+        response = api_client.post(reverse('messages-bulk'), data=data, format='json')
+
+        assert response.status_code == 400
+        assert response.data['errors'] == [{'index': 1, 'message': error}]
+        assert not episode.messages.exists()
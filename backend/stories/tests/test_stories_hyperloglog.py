@@ -0,0 +1,36 @@
+import pytest
+
+from ..hyperloglog import HyperLogLog
+
+
+class TestHyperLogLog:
+    @pytest.mark.parametrize('distinct', [10, 1000, 50000])
+    def test_count_within_error_bound(self, distinct):
+        sketch = HyperLogLog()
+        for i in range(distinct):
+            sketch.add(f'10.{i}')
+            sketch.add(f'10.{i}')
+
+        assert abs(sketch.count() - distinct) <= 3 * sketch.error * distinct + 1
+
+    def test_merge_counts_union(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(3000):
+            first.add(i)
+        for i in range(2000, 5000):
+            second.add(i)
+
+        first.merge(second)
+        assert abs(first.count() - 5000) <= 3 * first.error * 5000
+
+    def test_fixed_size(self):
+        sketch = HyperLogLog(precision=10)
+        for i in range(10000):
+            sketch.add(i)
+
+        assert len(sketch.to_bytes()) == 1024
+        assert HyperLogLog(precision=10, registers=sketch.to_bytes()).count() == sketch.count()
+
+    def test_merge_different_precision(self):
+        with pytest.raises(ValueError):
+            HyperLogLog(precision=10).merge(HyperLogLog(precision=12))
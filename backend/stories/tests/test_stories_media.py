@@ -0,0 +1,102 @@
+import pytest
+
+from asgiref.sync import async_to_sync
+
+from django.urls import reverse
+
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def media(media):
+    (media / 'message_audios').mkdir()
+    (media / 'message_audios' / 'clip.mp3').write_bytes(CONTENT)
+    (media.parent / 'secret.txt').write_bytes(b'secret')
+    return media
+
+
+def read(response):
+    return b''.join(response.streaming_content)
+
+
+class TestServeMedia:
+    url = reverse('media', args=['message_audios/clip.mp3'])
+
+    def test_full_file(self, media, client):
+        response = client.get(self.url)
+
+        assert response.status_code == 200
+        assert response['Accept-Ranges'] == 'bytes'
+        assert response['Content-Type'] == 'audio/mpeg'
+        assert read(response) == CONTENT
+
+    @pytest.mark.parametrize('header, start, end', [
+        ('bytes=0-99', 0, 99),
+        ('bytes=1000-', 1000, 1023),
+        ('bytes=-24', 1000, 1023),
+        ('bytes=1000-5000', 1000, 1023),
+    ])
+    def test_partial_content(self, media, client, header, start, end):
+        response = client.get(self.url, HTTP_RANGE=header)
+
+        assert response.status_code == 206
+        assert response['Content-Range'] == f'bytes {start}-{end}/{len(CONTENT)}'
+        assert int(response['Content-Length']) == end - start + 1
+        assert read(response) == CONTENT[start:end + 1]
+
+    def test_open_range_is_capped(self, media, client, settings):
+        settings.MEDIA_RANGE_CHUNK_SIZE = 100
+
+        response = client.get(self.url, HTTP_RANGE='bytes=0-')
+
+        assert response.status_code == 206
+        assert response['Content-Range'] == f'bytes 0-99/{len(CONTENT)}'
+        assert read(response) == CONTENT[:100]
+
+    def test_async_streaming(self, media, async_client):
+        async def fetch():
+            response = await async_client.get(self.url, headers={'Range': 'bytes=10-19'})
+            return response, b''.join([part async for part in response.streaming_content])
+
+        response, content = async_to_sync(fetch)()
+
+        assert response.status_code == 206
+        assert response.is_async
+        assert content == CONTENT[10:20]
+
+    def test_unsatisfiable_range(self, media, client):
+        response = client.get(self.url, HTTP_RANGE='bytes=2000-')
+
+        assert response.status_code == 416
+        assert response['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+    def test_stale_if_range_sends_whole_file(self, media, client):
+        response = client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"outdated"')
+
+        assert response.status_code == 200
+        assert read(response) == CONTENT
+
+    def test_not_modified(self, media, client):
+        etag = client.get(self.url)['ETag']
+
+        assert client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    @pytest.mark.parametrize('path', ['../secret.txt', 'message_audios/missing.mp3', 'message_audios', '.env'])
+    def test_outside_or_missing(self, media, client, path):
+        assert client.get(f'/media/{path}').status_code == 404
+
+    def test_x_accel_redirect(self, media, client, settings):
+        settings.MEDIA_SERVE_MODE = 'x-accel-redirect'
+
+        response = client.get(self.url, HTTP_RANGE='bytes=0-99')
+
+        assert response.status_code == 200
+        assert response['X-Accel-Redirect'] == '/protected-media/message_audios/clip.mp3'
+        assert not response.content
+
+    def test_x_sendfile(self, media, client, settings):
+        settings.MEDIA_SERVE_MODE = 'x-sendfile'
+
+        response = client.get(self.url)
+
+        assert response['X-Sendfile'] == str(media / 'message_audios' / 'clip.mp3')
@@ -3,7 +3,7 @@ import pytest
 from ..models import (
     Category, Story, IpAddress,
     Comment, SavedStory, Character,
-    Episode, Message
+    Episode, EpisodeBundle, Message
 )
 
 pytestmark = pytest.mark.django_db
@@ -71,6 +71,65 @@ class TestStoryModel:
     def test_user_can_only_like_once(self, story_factory, user_factory):
         user_can_only_like_once_test(story_factory, user_factory)
 
+    def test_like_counters(self, story_factory, user_factory):
+        user = user_factory()
+        story = story_factory()
+
+        assert story.like(user)
+        assert not story.like(user)
+        story.refresh_from_db()
+        assert story.likes_count == 1
+
+        assert story.unlike(user)
+        assert not story.unlike(user)
+        story.refresh_from_db()
+        assert story.likes_count == 0
+
+    def test_save_keeps_counters(self, story_factory, user_factory):
+        story = story_factory()
+        stale = Story.objects.get(pk=story.pk)
+        story.like(user_factory())
+
+        stale.title = 'New title'
+        stale.save()
+        story.refresh_from_db()
+        assert story.title == 'New title'
+        assert story.likes_count == 1
+
+    def test_comments_count(self, story_factory, comment_factory):
+        story = story_factory()
+        comment = comment_factory(story=story)
+        comment_factory(story=story)
+        story.refresh_from_db()
+        assert story.comments_count == 2
+
+        comment.delete()
+        story.refresh_from_db()
+        assert story.comments_count == 1
+
+        Story.objects.filter(pk=story.pk).update(comments_count=0)
+        Comment.objects.filter(story=story).delete()
+        story.refresh_from_db()
+        assert story.comments_count == 0
+
+    def test_random_sparse_selection(self, story_factory):
+        stories = story_factory.create_batch(4)
+        selection = Story.objects.filter(pk__in=[stories[0].pk, stories[3].pk])
+
+        # without probes every pick comes from the fallback
+        seen = {selection.random(probes=0).pk for _ in range(30)}
+        assert seen == {stories[0].pk, stories[3].pk}
+        assert Story.objects.filter(published=True).random() is None
+
+    def test_random_probes_filtered_range(self, story_factory, django_assert_num_queries):
+        story_factory.create_batch(100)
+        published = {story.pk for story in story_factory.create_batch(3, published=True)}
+
+        # probes fall into the ids of the selection, one finds a story and the fallback is never reached
+        for _ in range(10):
+            with django_assert_num_queries(2):
+                assert Story.objects.filter(published=True).random().pk in published
+
 
 class TestComment:
     def test_create(self, comment_factory, user_factory, story_factory):
@@ -118,6 +177,31 @@ class TestEpisode:
         assert Episode.objects.count() == 1
         assert episode.title.startswith('Episode')
 
+    def test_bundle_changed_while_built(self, episode_factory, message_factory, monkeypatch):
+        episode = episode_factory()
+        build = EpisodeBundle.build
+
+        def build_then_change(episode):
+            payload = build(episode)
+            # a message is written after the rows were read, before the bundle is stored
+            message_factory(episode=episode, text_content='Latest')
+            return payload
+
+        monkeypatch.setattr(EpisodeBundle, 'build', build_then_change)
+        assert EpisodeBundle.get_payload(episode)['messages'] == []
+        monkeypatch.setattr(EpisodeBundle, 'build', build)
+
+        assert EpisodeBundle.get_payload(episode)['messages'][0]['text_content'] == 'Latest'
+
+    def test_save_keeps_bundle_version(self, episode_factory):
+        episode = episode_factory()
+        EpisodeBundle.invalidate(pk=episode.pk)
+
+        episode.title = 'Renamed'
+        episode.save()
+        episode.refresh_from_db()
+        assert episode.bundle_version == 2
+
 
 class TestMessage:
     def test_create(self, episode_factory, character_factory, message_factory):
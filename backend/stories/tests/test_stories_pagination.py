@@ -0,0 +1,83 @@
+import base64
+import json
+
+import pytest
+
+from django.urls import reverse
+
+pytestmark = pytest.mark.django_db
+
+
+def collect_pages(api_client, url, link='next'):
+    pages = []
+    while url:
+        response = api_client.get(url)
+        assert response.status_code == 200
+        pages.append([item['id'] for item in response.data['results']])
+        url = response.data['links'][link]
+    return pages
+
+
+class TestKeysetPagination:
+    def test_walk_forward_and_back(self, story_factory, api_client):
+        stories = story_factory.create_batch(7)
+        expected = [story.pk for story in reversed(stories)]
+
+        pages = collect_pages(api_client, f"{reverse('stories-list')}?page=1&page_size=3")
+        assert pages == [expected[:3], expected[3:6], expected[6:]]
+
+        response = api_client.get(f"{reverse('stories-list')}?page_size=3")
+        last_page = collect_pages(api_client, response.data['links']['next'])[-1]
+        assert last_page == expected[6:]
+
+        response = api_client.get(f"{reverse('stories-list')}?page_size=3")
+        response = api_client.get(response.data['links']['next'])
+        assert response.data['links']['previous'] is not None
+        assert collect_pages(api_client, response.data['links']['previous'], link='previous') == [expected[:3]]
+
+    def test_stable_under_inserts(self, story_factory, api_client):
+        stories = story_factory.create_batch(4)
+        response = api_client.get(f"{reverse('stories-list')}?page_size=2")
+        first_page = [item['id'] for item in response.data['results']]
+
+        story_factory.create_batch(3)
+        response = api_client.get(response.data['links']['next'])
+        second_page = [item['id'] for item in response.data['results']]
+
+        assert first_page + second_page == [story.pk for story in reversed(stories)]
+        assert response.data['links']['next'] is None
+
+    def test_same_timestamp_ties(self, story_factory, api_client):
+        stories = story_factory.create_batch(5)
+        type(stories[0]).objects.update(created_at=stories[0].created_at)
+
+        pages = collect_pages(api_client, f"{reverse('stories-list')}?page_size=2")
+        assert sum(pages, []) == sorted((story.pk for story in stories), reverse=True)
+
+    def test_ordering_by_likes_count(self, story_factory, user_factory, api_client):
+        users = user_factory.create_batch(3)
+        stories = [story_factory(likes=users[:count]) for count in (1, 3, 0, 2)]
+
+        pages = collect_pages(api_client, f"{reverse('stories-list')}?ordering=-likes_count&page_size=1")
+        assert sum(pages, []) == [stories[index].pk for index in (1, 3, 0, 2)]
+
+    def test_invalid_cursor(self, api_client):
+        response = api_client.get(f"{reverse('stories-list')}?cursor=garbage")
+        assert response.status_code == 404
+
+    @pytest.mark.parametrize('position', [
+        ['yesterday', 1], ['2024-01-01T00:00:00+00:00', 'one'], [None, 1], [[], {}], ['2024-01-01T00:00:00+00:00'],
+    ])
+    def test_malformed_cursor_position(self, api_client, position):
+        cursor = base64.urlsafe_b64encode(json.dumps({'p': position, 'r': False}).encode()).decode()
+
+        response = api_client.get(reverse('stories-list'), {'cursor': cursor})
+        assert response.status_code == 404
+
+    def test_saved_stories(self, user_factory, saved_story_factory, get_jwt_token, api_client):
+        user = user_factory()
+        saved = saved_story_factory.create_batch(3, user=user)
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+
+        pages = collect_pages(api_client, f"{reverse('saved-stories-list')}?page_size=2")
+        assert sum(pages, []) == [saved_story.story.pk for saved_story in reversed(saved)]
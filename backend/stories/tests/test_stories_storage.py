@@ -0,0 +1,118 @@
+import io
+import os
+
+import pytest
+
+from django.core.files.base import ContentFile, File
+from django.core.management import call_command
+
+from ..models import MediaBlob, Message
+from ..storage import media_storage
+
+pytestmark = pytest.mark.django_db
+
+
+class Stream(io.BytesIO):
+    # a request body or tar member, it can only be read once
+    def seekable(self):
+        return False
+
+
+def blob(name):
+    return MediaBlob.objects.get(name=name)
+
+
+class TestDeduplicatedStorage:
+    def test_same_content_is_stored_once(self, media):
+        first = media_storage().save('a/clip.mp4', ContentFile(b'video', name='clip.mp4'))
+        second = media_storage().save('b/other.MP4', ContentFile(b'video', name='other.MP4'))
+
+        assert first == second
+        assert first.startswith('blobs/') and first.endswith('.mp4')
+        assert sum(len(files) for _, _, files in os.walk(media / 'blobs')) == 1
+        assert blob(first).size == 5
+
+    def test_stream_is_hashed_while_written(self, media):
+        stored = media_storage().save('clip.mp4', ContentFile(b'video'))
+        streamed = media_storage().save('clip.mp4', File(Stream(b'video'), name='clip.mp4'))
+        other = media_storage().save('clip.mp4', File(Stream(b'other'), name='clip.mp4'))
+
+        assert streamed == stored
+        assert other != stored
+        assert media_storage().open(other).read() == b'other'
+        assert not os.listdir(media / 'blobs' / '.tmp')
+
+    def test_references_follow_fields(self, media, message_factory, django_capture_on_commit_callbacks):
+        first = message_factory(audio_content=ContentFile(b'audio', name='a.mp3'))
+        second = message_factory(audio_content=ContentFile(b'audio', name='b.mp3'))
+        name = first.audio_content.name
+        assert second.audio_content.name == name
+        assert blob(name).references == 2
+
+        with django_capture_on_commit_callbacks(execute=True):
+            first.audio_content = ContentFile(b'replaced', name='c.mp3')
+            first.save()
+        assert blob(name).references == 1
+        assert blob(first.audio_content.name).references == 1
+        assert media_storage().exists(name)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            Message.objects.get(pk=second.pk).delete()
+        assert not MediaBlob.objects.filter(name=name).exists()
+        assert not media_storage().exists(name)
+
+    def test_delete_keeps_referenced_blob(self, media, message_factory):
+        message = message_factory(video_content=ContentFile(b'video', name='clip.mp4'))
+        media_storage().delete(message.video_content.name)
+        assert media_storage().exists(message.video_content.name)
+
+
+    def test_recently_saved_blob_is_kept(self, media, settings):
+        name = media_storage().save('clip.mp4', ContentFile(b'video'))
+        settings.MEDIA_BLOB_GRACE_HOURS = 1
+
+        # saved again by an upload that has not counted its reference yet
+        media_storage().delete(name)
+        assert media_storage().exists(name)
+
+        settings.MEDIA_BLOB_GRACE_HOURS = 0
+        media_storage().delete(name)
+        assert not media_storage().exists(name)
+        assert media_storage().save('clip.mp4', ContentFile(b'video')) == name
+        assert media_storage().exists(name) and blob(name)
+
+
+class TestReconcileMediaBlobs:
+    def test_recounts_and_deletes_orphans(self, media, message_factory):
+        message = message_factory(image_content=None, video_content=None, audio_content=ContentFile(b'audio', name='a.mp3'))
+        orphan = media_storage().save('orphan.mp3', ContentFile(b'orphan'))
+        MediaBlob.objects.filter(name=message.audio_content.name).update(references=5)
+
+        call_command('reconcile_media_blobs', grace_hours=0, stdout=io.StringIO())
+
+        assert blob(message.audio_content.name).references == 1
+        assert not MediaBlob.objects.filter(name=orphan).exists()
+        assert not media_storage().exists(orphan)
+
+
+class TestMigrateMediaBlobs:
+    def test_moves_old_files_into_blobs(self, media, message_factory):
+        (media / 'message_audios').mkdir()
+        for name in ('a.mp3', 'b.mp3'):
+            (media / 'message_audios' / name).write_bytes(b'audio')
+        first, second = message_factory.create_batch(2, image_content=None, video_content=None, audio_content=None)
+        Message.objects.filter(pk=first.pk).update(audio_content='message_audios/a.mp3')
+        Message.objects.filter(pk=second.pk).update(audio_content='message_audios/b.mp3')
+
+        # the story images of the factory are urls, missing files are left as they are
+        call_command('migrate_media_blobs', chunk_size=1, stdout=io.StringIO(), stderr=io.StringIO())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        name = first.audio_content.name
+        assert name.startswith('blobs/') and name == second.audio_content.name
+        assert blob(name).references == 2
+        assert media_storage().open(name).read() == b'audio'
+        assert not os.listdir(media / 'message_audios')
+        assert first.episode.story.image.name.startswith('http')
+
@@ -0,0 +1,102 @@
+import io
+import json
+
+import pytest
+from PIL import Image
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+
+from authentication.serializers import UserAccountSerializer
+from ..models import Message, Story
+
+pytestmark = pytest.mark.django_db
+
+
+def make_image(name='photo.jpg', size=(1200, 900)):
+    output = io.BytesIO()
+    Image.new('RGB', size, 'orange').save(output, 'JPEG')
+    return SimpleUploadedFile(name, output.getvalue(), content_type='image/jpeg')
+
+
+@pytest.fixture
+def media(media, settings):
+    # variants are generated in the on_commit callback instead of a worker thread
+    settings.THUMBNAIL_WORKERS = 0
+    return media
+
+
+class TestImageVariants:
+    def test_story_card_variant(self, media, story_factory, api_client, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            story = story_factory(image=make_image(), author__photo=None)
+
+        story.refresh_from_db()
+        assert story.image_variants['source'] == story.image.name
+        with story.image.storage.open(story.image_variants['card']) as card:
+            assert Image.open(card).size == (600, 400)
+
+        response = api_client.get(reverse('stories-detail', args=[story.pk]))
+        assert response.data['image'].endswith(story.image_variants['card'])
+        assert response.data['image_original'].endswith(story.image.name)
+
+    def test_replaced_and_cleared_image(self, media, story_factory, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            story = story_factory(image=make_image(), author__photo=None)
+        story.refresh_from_db()
+        old_card = story.image_variants['card']
+
+        with django_capture_on_commit_callbacks(execute=True):
+            story.image = make_image('other.jpg', size=(300, 300))
+            story.save()
+        story.refresh_from_db()
+        assert story.image_variants['source'] == story.image.name
+        assert story.image_variants['card'] != old_card
+
+        card = story.image_variants['card']
+        story.image = None
+        story.save()
+        assert Story.objects.get(pk=story.pk).image_variants == {}
+        assert not story.image.storage.exists(card)
+
+    def test_pending_variants_fall_back_to_original(self, media, user_factory):
+        user = user_factory(photo=make_image())
+
+        assert UserAccountSerializer(user).data['photo'] == user.photo.url
+
+    def test_missing_image_is_logged(self, media, user_factory, django_capture_on_commit_callbacks, caplog):
+        # the factory photo is a url, there is no file to render the avatar from
+        with django_capture_on_commit_callbacks(execute=True):
+            user = user_factory()
+
+        user.refresh_from_db()
+        assert user.photo_variants == {}
+        assert 'Could not generate image variants' in caplog.text
+
+    def test_user_avatar_variant(self, media, user_factory, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            user = user_factory(photo=make_image())
+        user.refresh_from_db()
+
+        data = UserAccountSerializer(user).data
+        assert data['photo'] == user.photo.storage.url(user.photo_variants['avatar'])
+        assert data['photo_original'] == user.photo.url
+
+    def test_bulk_created_message_variants(self, media, episode_factory, character_factory, get_jwt_token,
+                                           api_client, django_capture_on_commit_callbacks):
+        episode = episode_factory()
+        character = character_factory(story=episode.story)
+        data = {
+            'episode': episode.pk,
+            'messages': json.dumps([{'message_type': 'image', 'character': character.pk, 'image_content': 'photo'}]),
+            'photo': make_image(),
+        }
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=episode.story.author)}')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(reverse('messages-bulk'), data=data, format='multipart')
+
+        assert response.status_code == 201
+        message = Message.objects.get()
+        assert message.image_variants['source'] == message.image_content.name
+        assert 'preview' in message.image_variants
@@ -0,0 +1,130 @@
+import hashlib
+
+import pytest
+
+from django.urls import reverse
+
+from ..models import MediaBlob, MediaUpload, Message
+
+pytestmark = pytest.mark.django_db
+
+CONTENT = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def media(media, settings):
+    settings.MEDIA_UPLOAD_CHUNK_SIZE = 4096
+    return media
+
+
+@pytest.fixture
+def author(user_factory, get_jwt_token, api_client):
+    user = user_factory()
+    api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user)}')
+    return user
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def put_chunk(api_client, upload_id, offset, data, checksum=None):
+    return api_client.put(
+        reverse('uploads-chunk', args=[upload_id]), data=data, content_type='application/octet-stream',
+        HTTP_UPLOAD_OFFSET=str(offset), HTTP_UPLOAD_CHECKSUM=checksum or sha256(data)
+    )
+
+
+def start_upload(api_client, **data):
+    data = {'kind': 'audio', 'filename': 'clip.mp3', 'size': len(CONTENT), 'checksum': sha256(CONTENT), **data}
+    return api_client.post(reverse('uploads-list'), data=data, format='json')
+
+
+def finish_upload(api_client):
+    upload_id = start_upload(api_client).data['id']
+    for offset in range(0, len(CONTENT), 4096):
+        put_chunk(api_client, upload_id, offset, CONTENT[offset:offset + 4096])
+    api_client.post(reverse('uploads-complete', args=[upload_id]))
+    return upload_id
+
+
+class TestMediaUploads:
+    def test_chunked_upload_and_attach(self, media, author, episode_factory, character_factory, api_client):
+        upload_id = start_upload(api_client).data['id']
+
+        for offset in range(0, len(CONTENT), 4096):
+            response = put_chunk(api_client, upload_id, offset, CONTENT[offset:offset + 4096])
+            assert response.status_code == 200
+        assert api_client.get(reverse('uploads-detail', args=[upload_id])).data['received'] == len(CONTENT)
+
+        response = api_client.post(reverse('uploads-complete', args=[upload_id]))
+        assert response.status_code == 200
+        assert response.data['completed'] is True
+        assert not list((media.parent / 'parts').iterdir())
+
+        episode = episode_factory(story__author=author)
+        response = api_client.post(reverse('messages-list'), data={
+            'episode': episode.pk, 'order': 1024, 'message_type': 'audio',
+            'character': character_factory(story=episode.story).pk, 'upload': upload_id
+        }, format='json')
+        assert response.status_code == 201
+        message = Message.objects.get()
+        assert message.audio_content.name.startswith('blobs/')
+        assert MediaBlob.objects.get(name=message.audio_content.name).references == 1
+        assert message.audio_content.read() == CONTENT
+        assert not MediaUpload.objects.exists()
+
+    @pytest.mark.django_db(transaction=True)
+    def test_attach_on_update(self, media, author, message_factory, api_client):
+        # runs outside a test transaction, claiming the upload has to open its own
+        message = message_factory(episode__story__author=author, message_type='audio')
+        upload_id = finish_upload(api_client)
+
+        response = api_client.patch(reverse('messages-detail', args=[message.pk]),
+                                    data={'upload': upload_id}, format='json')
+        assert response.status_code == 200
+        message.refresh_from_db()
+        assert message.audio_content.read() == CONTENT
+        assert not MediaUpload.objects.exists()
+
+    @pytest.mark.django_db(transaction=True)
+    def test_failed_update_keeps_upload(self, media, author, message_factory, api_client):
+        message = message_factory(episode__story__author=author, message_type='audio')
+        upload_id = finish_upload(api_client)
+
+        response = api_client.patch(reverse('messages-detail', args=[message.pk]),
+                                    data={'upload': upload_id, 'character': 10 ** 9}, format='json')
+        assert response.status_code == 404
+        assert MediaUpload.objects.filter(pk=upload_id, completed_at__isnull=False).exists()
+
+    def test_resume_after_failed_chunk(self, media, author, api_client):
+        upload_id = start_upload(api_client).data['id']
+        assert put_chunk(api_client, upload_id, 0, CONTENT[:4096]).status_code == 200
+
+        response = put_chunk(api_client, upload_id, 4096, CONTENT[4096:8192], checksum=sha256(b'other'))
+        assert response.status_code == 400
+        assert response.data['offset'] == 4096
+
+        response = put_chunk(api_client, upload_id, 0, CONTENT[:4096])
+        assert response.status_code == 409
+        assert response.data['offset'] == 4096
+
+        assert put_chunk(api_client, upload_id, 4096, CONTENT[4096:8192]).status_code == 200
+        assert put_chunk(api_client, upload_id, 8192, CONTENT[8192:]).status_code == 200
+        assert api_client.post(reverse('uploads-complete', args=[upload_id])).status_code == 200
+
+    def test_incomplete_upload(self, media, author, api_client):
+        upload_id = start_upload(api_client).data['id']
+        put_chunk(api_client, upload_id, 0, CONTENT[:4096])
+
+        assert api_client.post(reverse('uploads-complete', args=[upload_id])).status_code == 400
+
+    def test_invalid_upload(self, media, author, api_client):
+        assert start_upload(api_client, filename='clip.exe').status_code == 400
+        assert start_upload(api_client, kind='image').status_code == 400
+
+    def test_other_owner(self, media, author, user_factory, get_jwt_token, api_client):
+        upload_id = start_upload(api_client).data['id']
+
+        api_client.credentials(HTTP_AUTHORIZATION=f'JWT {get_jwt_token(current_user=user_factory())}')
+        assert put_chunk(api_client, upload_id, 0, CONTENT[:4096]).status_code == 404
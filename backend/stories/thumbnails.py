@@ -0,0 +1,163 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.dispatch import Signal
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# name: (width, height, crop), cropped variants are filled to the exact size,
+# the others are scaled down to fit the box and keep their aspect ratio
+VARIANT_SIZES = {
+    'card': (600, 400, True),
+    'avatar': (160, 160, True),
+    'preview': (960, 960, False),
+}
+
+# model label: (image field, field that records the variants, variant names)
+IMAGE_VARIANTS = {
+    'stories.Story': ('image', 'image_variants', ('card',)),
+    'stories.Message': ('image_content', 'image_variants', ('preview',)),
+    'authentication.UserAccount': ('photo', 'photo_variants', ('avatar',)),
+}
+
+# sent with the model and primary key once the variants of an image are stored
+variants_ready = Signal()
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS, thread_name_prefix='thumbnails')
+    return _executor
+
+
+def variant_name(source, variants, name):
+    """
+    Name of the variant when it was generated from the current file, the original name otherwise.
+    """
+    if variants and variants.get('source') == source and name in variants:
+        return variants[name]
+    return source
+
+
+def variant_url(file, variants, name):
+    return default_storage.url(variant_name(file.name, variants, name))
+
+
+def delete_variants(model, pk, variants, keep=()):
+    # rows with the same deduplicated source share its variant files
+    field_name = IMAGE_VARIANTS[model._meta.label][0]
+    if model.objects.filter(**{field_name: variants.get('source')}).exclude(pk=pk).exists():
+        return
+    for key, name in variants.items():
+        if key != 'source' and name not in keep:
+            default_storage.delete(name)
+
+
+def schedule_variants(instance):
+    """
+    Queues variant generation for a changed image once the transaction commits.
+
+    The variants record keeps the name of the source file, which tells whether it is up to date.
+    A save from an instance loaded before the variants were recorded writes the old record back,
+    the mismatch schedules the variants again and they overwrite the same files.
+    """
+    field_name, variants_field, _ = IMAGE_VARIANTS[instance._meta.label]
+    file = getattr(instance, field_name)
+    variants = getattr(instance, variants_field) or {}
+    if variants.get('source', '') == (file.name or ''):
+        return
+
+    model = type(instance)
+    if not file:
+        model.objects.filter(pk=instance.pk).update(**{variants_field: {}})
+        delete_variants(model, instance.pk, variants)
+        return
+
+    def submit():
+        if settings.THUMBNAIL_WORKERS:
+            get_executor().submit(run_in_worker, model, instance.pk)
+        else:
+            # runs after the save committed, a missing or broken image must not fail the request
+            generate_logged(model, instance.pk)
+
+    transaction.on_commit(submit)
+
+
+def generate_logged(*args):
+    try:
+        generate_variants(*args)
+    except Exception:
+        logger.exception('Could not generate image variants')
+
+
+def run_in_worker(*args):
+    close_old_connections()
+    try:
+        generate_logged(*args)
+    finally:
+        close_old_connections()
+
+
+def render_variant(image, name):
+    width, height, crop = VARIANT_SIZES[name]
+    if crop:
+        image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+    else:
+        image = image.copy()
+        image.thumbnail((width, height), Image.LANCZOS)
+
+    output = io.BytesIO()
+    # WebP is a fraction of the JPEG size, Pillow builds without libwebp fall back to JPEG
+    if features.check('webp'):
+        image.save(output, 'WEBP', quality=80, method=4)
+        extension = 'webp'
+    else:
+        image.save(output, 'JPEG', quality=80, optimize=True, progressive=True)
+        extension = 'jpg'
+    return output.getvalue(), extension
+
+
+def generate_variants(model, pk):
+    field_name, variants_field, names = IMAGE_VARIANTS[model._meta.label]
+    instance = model.objects.filter(pk=pk).only(field_name, variants_field).first()
+    if instance is None:
+        return None
+
+    file = getattr(instance, field_name)
+    if not file:
+        return None
+
+    with file.open('rb') as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+    # variants go to the plain storage next to the source, the media storage would rename them by digest
+    base = os.path.splitext(file.name)[0]
+    variants = {'source': file.name}
+    for name in names:
+        content, extension = render_variant(image, name)
+        path = f'{base}.{name}.{extension}'
+        default_storage.delete(path)
+        variants[name] = default_storage.save(path, ContentFile(content))
+
+    # only record the variants when the image was not replaced in the meantime
+    updated = model.objects.filter(pk=pk, **{field_name: file.name}).update(**{variants_field: variants})
+    if not updated:
+        # the newer upload schedules its own variants
+        delete_variants(model, pk, variants)
+        return None
+
+    delete_variants(model, pk, getattr(instance, variants_field) or {}, keep=variants.values())
+
+    variants_ready.send(sender=model, pk=pk)
+    return variants
@@ -1,22 +1,30 @@
 from rest_framework.generics import ListAPIView
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from rest_framework.response import Response
 from rest_framework import status
 
 from .models import (
-    Category, Story, Message, Episode, UserStoryStatus
+    Category, Story, Message, UserStoryStatus
 )
 from .serializers import (
     CategorySerializer, UserStoryStatusSerializer
 )
+from .cache import cached_response, conditional_response, get_versions
+from .buffers import progress_buffer
 
 
 class CategoryListView(ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
+    def list(self, request, *args, **kwargs):
+        return cached_response(request, ['categories'], lambda: conditional_response(
+            request, get_versions(['categories']), lambda: super(CategoryListView, self).list(request, *args, **kwargs)
+        ))
+
 
 class UpdateUserStoryStatusView(APIView):
     permission_classes = [IsAuthenticated]
@@ -29,9 +37,17 @@ class UpdateUserStoryStatusView(APIView):
             return Response({'error': 'story_id is required'}, status=status.HTTP_400_BAD_REQUEST)
 
         story = get_object_or_404(Story, id=story_id)
-        user_story_status = get_object_or_404(UserStoryStatus, user=user, story=story)
+        user_story_status = UserStoryStatus.objects.filter(user=user, story=story).first()
+
+        # a position that is not written yet is newer than the stored one
+        position = progress_buffer.position(user.pk, story.pk)
+        if position:
+            user_story_status = user_story_status or UserStoryStatus(user=user, story=story)
+            user_story_status.episode_id, user_story_status.message_id = position
+        if user_story_status is None:
+            raise Http404
 
-        if user_story_status.episode and user_story_status.message:
+        if user_story_status.episode_id and user_story_status.message_id:
             return Response(UserStoryStatusSerializer(user_story_status).data)
 
         return Response({'error': 'No status found'}, status=status.HTTP_404_NOT_FOUND)
@@ -46,14 +62,18 @@ class UpdateUserStoryStatusView(APIView):
             return Response({'error': 'story_id, episode_id, and message_id are required'},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        story = get_object_or_404(Story, id=story_id)
-        episode = get_object_or_404(Episode, id=episode_id)
-        message = get_object_or_404(Message, id=message_id)
-
-        user_status, created = UserStoryStatus.objects.update_or_create(
-            user=user,
-            story=story,
-            defaults={'episode': episode, 'message': message}
-        )
+        try:
+            ids = [int(story_id), int(episode_id), int(message_id)]
+        except (TypeError, ValueError):
+            return Response({'error': 'story_id, episode_id, and message_id must be integers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        story_id, episode_id, message_id = ids
+        if not Message.objects.filter(pk=message_id, episode_id=episode_id, episode__story_id=story_id).exists():
+            raise Http404
+
+        # only the latest position per story is kept and written in the next batch,
+        # positions of rows deleted meanwhile are dropped then
+        progress_buffer.record(user.pk, story_id, episode_id, message_id)
 
         return Response({'status': 'status updated'}, status=status.HTTP_200_OK)
@@ -1,26 +1,39 @@
-from rest_framework.viewsets import ModelViewSet
+import ipaddress
+import json
+import tarfile
+
+from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework.response import Response
 from rest_framework import status, filters
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
 from rest_framework.decorators import action
 from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
-from django.db.models import Count
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Prefetch, Q
 from django.core.exceptions import PermissionDenied
 from datetime import datetime
 
 from .models import (
     Category, Story, Character,
-    Comment, IpAddress, SavedStory,
-    Episode, Message, UserStoryStatus
+    Comment, SavedStory,
+    Episode, Message, UserStoryStatus, EpisodeBundle, MediaUpload, MediaBlob
 )
 from .serializers import (
     StorySerializer, CommentSerializer,
     CharacterSerializer, SavedStorySerializer, EpisodeSerializer,
-    MessageSerializer
+    MessageSerializer, MediaUploadSerializer
 )
-from .pagination import MyPagePagination, FixedPagePagination
+from .pagination import MyPagePagination, FixedPagePagination, KeysetPagination, SavedStoryKeysetPagination
+from .buffers import view_buffer, progress_buffer
+from .thumbnails import schedule_variants
+from .archive import ArchiveError, StoryImporter, aexport_story, export_story, import_archive
+from .filters import StorySearchFilter
+from .cache import cached_response, conditional_response, get_versions
 from authentication.serializers import (
     UserAccountSerializer, Notification
 )
@@ -35,12 +48,14 @@ def check_story_authorship(story, user):
 
 
 def get_client_ip(request):
+    # the header comes from the client unless a proxy replaces it, anything but an address is ignored
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
     if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+        try:
+            return str(ipaddress.ip_address(x_forwarded_for.split(',')[0].strip()))
+        except ValueError:
+            pass
+    return request.META.get('REMOTE_ADDR')
 
 
 def destroy_by_story_pk(pk, user, queryset):
@@ -54,58 +69,196 @@ def destroy_by_story_pk(pk, user, queryset):
     return False
 
 
-def validate_unique_order(order, episode, queryset):
+DUPLICATE_ORDER_MESSAGE = 'Instance with this order already exists.'
+MAX_BULK_MESSAGES = 1000
+MESSAGE_CONTENT_FIELDS = {
+    'text': 'text_content',
+    'image': 'image_content',
+    'video': 'video_content',
+    'audio': 'audio_content'
+}
+
+
+def validate_order(order):
+    # uniqueness within the episode is enforced by the database constraint on write
     if order:
         try:
             order = float(order)
             if order > 0:
-                if queryset.filter(order=order, episode=episode).exists():
-                    raise ValidationError("Instance with this order already exists.")
-                else:
-                    return order
+                return order
             else:
                 raise ValidationError('Order must be greater than zero.')
-        except ValueError:
+        except (TypeError, ValueError):
             raise ValidationError('Order must be a valid float.')
     else:
         raise ValidationError('Order must be a valid float greater than zero.')
 
 
+def validate_text(field_name, value):
+    # the database would reject what does not fit into the column with an error instead of a 400
+    if not isinstance(value, str):
+        raise ValidationError(f'{field_name} must be a string.')
+    max_length = Message._meta.get_field(field_name).max_length
+    if len(value) > max_length:
+        raise ValidationError(f'{field_name} must be at most {max_length} characters.')
+    return value
+
+
+def build_messages(episode, items, files):
+    """
+    Validates a batch of message payloads against the episode and builds unsaved Message instances.
+
+    Characters of the story are loaded once, media fields name a file part of the request
+    and items without an order are appended after the last message of the episode.
+    Returns the messages and a list of per-item errors, messages are only usable without errors.
+    """
+    characters = {character.id: character for character in episode.story.characters.all()}
+    explicit_orders = {}
+    errors = []
+
+    for index, item in enumerate(items):
+        if isinstance(item, dict) and item.get('order') is not None:
+            try:
+                explicit_orders[index] = validate_order(item.get('order'))
+            except ValidationError as err:
+                errors.append({'index': index, 'message': str(err.messages[0])})
+
+    taken = set(episode.messages.filter(order__in=explicit_orders.values()).values_list('order', flat=True))
+    last_order = episode.messages.order_by('-order').values_list('order', flat=True).first() or 0
+    last_order = max([last_order, *explicit_orders.values()])
+
+    messages = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'message': 'Message must be an object.'})
+            continue
+
+        order = explicit_orders.get(index)
+        if order is None and item.get('order') is not None:
+            continue
+        if order is None:
+            last_order += Episode.ORDER_STEP
+            order = last_order
+        elif order in taken:
+            errors.append({'index': index, 'message': DUPLICATE_ORDER_MESSAGE})
+            continue
+        taken.add(order)
+
+        message_type = item.get('message_type')
+        if not isinstance(message_type, str):
+            errors.append({'index': index, 'message': 'message_type must be a string.'})
+            continue
+        message = Message(episode=episode, order=order, message_type=message_type)
+
+        if message_type == 'status':
+            if not item.get('status_content'):
+                errors.append({'index': index, 'message': 'status_content is required.'})
+                continue
+            try:
+                message.status_content = validate_text('status_content', item['status_content'])
+            except ValidationError as err:
+                errors.append({'index': index, 'message': str(err.messages[0])})
+                continue
+        elif message_type in MESSAGE_CONTENT_FIELDS:
+            character = item.get('character')
+            if not isinstance(character, int) or isinstance(character, bool):
+                errors.append({'index': index, 'message': 'character must be an integer id.'})
+                continue
+            character = characters.get(character)
+            if character is None:
+                errors.append({'index': index, 'message': 'Character does not belong to the story.'})
+                continue
+            message.character = character
+
+            content_field = MESSAGE_CONTENT_FIELDS[message_type]
+            content = item.get(content_field)
+            if not content:
+                errors.append({'index': index, 'message': f'{content_field} is required.'})
+                continue
+
+            if message_type != 'text':
+                # media items name the request file part that holds the upload
+                if not isinstance(content, str):
+                    errors.append({'index': index, 'message': f'{content_field} must name a file part.'})
+                    continue
+                content = files.get(content)
+                if content is None:
+                    errors.append({'index': index, 'message': f'File for {content_field} was not uploaded.'})
+                    continue
+            try:
+                if message_type == 'text':
+                    content = validate_text(content_field, content)
+                for validator in Message._meta.get_field(content_field).validators:
+                    validator(content)
+            except ValidationError as err:
+                errors.append({'index': index, 'message': str(err.messages[0])})
+                continue
+            setattr(message, content_field, content)
+        else:
+            errors.append({'index': index, 'message': 'Invalid message type.'})
+            continue
+
+        messages.append(message)
+
+    errors.sort(key=lambda error: error['index'])
+    return messages, errors
+
+
 class StoryViewSet(ModelViewSet):
     serializer_class = StorySerializer
     queryset = Story.objects.all()
     permission_classes = [IsAuthenticatedOrReadOnly]
-    pagination_class = MyPagePagination
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetPagination
+    filter_backends = [StorySearchFilter, filters.OrderingFilter]
 
-    search_fields = ['title']
     ordering_fields = ['created_at', 'likes_count']
 
+    def get_queryset(self):
+        return Story.objects.with_stats(self.request.user)
+
     def list(self, request, *args, **kwargs):
-        queryset = self.queryset.annotate(likes_count=Count('likes'))
+        return cached_response(request, ['stories', 'categories'], lambda: self.get_list_response(request))
+
+    def get_list_response(self, request):
+        queryset = self.get_queryset()
         category_id = request.query_params.get('category')
 
         if category_id:
             category = get_object_or_404(Category, pk=category_id)
             queryset = queryset.filter(category=category)
 
-        queryset = queryset.select_related('author', 'category')
         queryset = self.filter_queryset(queryset)
         queryset = self.paginate_queryset(queryset)
         serializer = self.get_serializer(queryset, many=True)
         return self.get_paginated_response(serializer.data)
 
     def retrieve(self, request, pk=None, *args, **kwargs):
-        story = self.get_object()
+        def build():
+            def serialize():
+                return Response(self.get_serializer(self.get_object(), context={'request': request}).data)
 
-        # Handle views
+            # one row with every value the representation depends on, counters do not move updated_at
+            try:
+                state = self.get_queryset().filter(pk=pk).values(
+                    'updated_at', 'likes_count', 'views_count', 'comments_count', 'is_liked', 'is_saved',
+                    'author__username', 'author__email', 'author__first_name', 'author__last_name', 'author__photo',
+                    'author__photo_variants'
+                ).first()
+            except (TypeError, ValueError):
+                state = None
+            if state is None:
+                return serialize()
+
+            versions = get_versions([('story', pk), 'categories'])
+            return conditional_response(request, [state, versions], serialize, last_modified=state['updated_at'])
+
+        response = cached_response(request, [('story', pk), 'categories'], build)
+
+        # views are written in batches by the buffer's background thread
         ip = get_client_ip(request)
-        if not story.views.filter(ip=ip).exists():
-            ip_address, created = IpAddress.objects.get_or_create(ip=ip)
-            story.views.add(ip_address.id)
-
-        serializer = self.get_serializer(story, context={'request': request})
-        return Response(serializer.data)
+        if ip:
+            view_buffer.record(int(pk), ip)
+        return response
 
     def create(self, request, *args, **kwargs):
         user = request.user
@@ -152,8 +305,7 @@ class StoryViewSet(ModelViewSet):
 
     @action(detail=False, methods=['GET'], permission_classes=[IsAuthenticated], url_path='my', url_name='my')
     def get_my_stories(self, request, pk=None):
-        queryset = self.queryset.filter(author=request.user)
-        queryset = queryset.select_related('author', 'category')
+        queryset = self.get_queryset().filter(author=request.user)
         queryset = self.paginate_queryset(queryset)
         serializer = self.get_serializer(queryset, many=True, context={'request': request})
         return self.get_paginated_response(serializer.data)
@@ -172,27 +324,70 @@ class StoryViewSet(ModelViewSet):
         story = self.get_object()
         user = request.user
 
-        if user in story.likes.all():
-            story.likes.remove(user)
+        if story.unlike(user):
             return Response({'liked': False}, status=status.HTTP_200_OK)
         else:
-            story.likes.add(user)
+            story.like(user)
             return Response({'liked': True}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['GET'], url_path='characters', url_name='characters')
     def get_characters(self, request, pk=None):
         story = self.get_object()
         if check_story_authorship(story, request.user):
-            queryset = story.characters.all()
-            serializer = CharacterSerializer(queryset, many=True)
-            return Response(serializer.data)
+            def build():
+                queryset = story.characters.all()
+                serializer = CharacterSerializer(queryset, many=True)
+                return Response(serializer.data)
+
+            # characters have no timestamps, their changes bump the version of the story
+            characters = story.characters.aggregate(count=Count('id'), last_id=Max('id'))
+            return conditional_response(request, [characters, get_versions([('story', story.pk)])], build)
+
+    @action(detail=True, methods=['GET'], permission_classes=[IsAuthenticated], url_path='export',
+            url_name='export')
+    def export(self, request, pk=None):
+        story = self.get_object()
+        if check_story_authorship(story, request.user):
+            # under ASGI a synchronous iterator would be read completely before it is sent
+            lines = aexport_story(story) if isinstance(request._request, ASGIRequest) else export_story(story)
+            response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+            response['Content-Disposition'] = f'attachment; filename="story-{story.pk}.ndjson"'
+            return response
+
+    @action(detail=False, methods=['POST'], permission_classes=[IsAuthenticated], url_path='import',
+            url_name='import')
+    def import_story(self, request):
+        archive = request.FILES.get('archive')
+        if archive is None:
+            return Response({'archive': ['No archive was uploaded.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            if tarfile.is_tarfile(archive):
+                archive.seek(0)
+                importer = import_archive(archive, request.user)
+            else:
+                archive.seek(0)
+                importer = StoryImporter(request.user)
+                importer.run(archive)
+        except (ArchiveError, ValueError, KeyError) as err:
+            return Response({'archive': [f'Invalid archive: {err}']}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = {**self.get_serializer(importer.story).data, 'counts': importer.counts}
+        return Response(data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['GET'], url_path='episodes', url_name='episodes')
     def get_episodes(self, request, pk=None):
-        story = self.get_object()
-        queryset = story.episodes.all()
-        serializer = EpisodeSerializer(queryset, many=True)
-        return Response(serializer.data)
+        def build():
+            story = self.get_object()
+            queryset = story.episodes.all()
+            serializer = EpisodeSerializer(queryset, many=True)
+            return Response(serializer.data)
+
+        def build_conditional():
+            episodes = Episode.objects.filter(story_id=pk).aggregate(last_modified=Max('updated_at'), count=Count('id'))
+            return conditional_response(request, [episodes], build, last_modified=episodes['last_modified'])
+
+        return cached_response(request, [('story', pk)], build_conditional)
 
     @action(detail=True, methods=['GET'], url_path='comments', url_name='comments')
     def get_comments(self, request, pk=None):
@@ -206,14 +401,26 @@ class StoryViewSet(ModelViewSet):
     @action(detail=False, methods=['GET'], permission_classes=[IsAuthenticated], url_path='liked', url_name='liked')
     def get_liked(self, request):
         user = request.user
-        queryset = user.stories_liked.all().select_related('author', 'category')
+        queryset = self.get_queryset().filter(likes=user)
         queryset = self.paginate_queryset(queryset)
         serializer = self.get_serializer(queryset, many=True)
         return self.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=['GET'], url_path='random', url_name='random')
     def get_random(self, request, *args, **kwargs):
-        random_story = self.queryset.order_by('?').first()
+        queryset = self.get_queryset()
+
+        if request.query_params.get('published') in ('true', '1'):
+            queryset = queryset.filter(published=True)
+
+        category_id = request.query_params.get('category')
+        if category_id:
+            category = get_object_or_404(Category, pk=category_id)
+            queryset = queryset.filter(category=category)
+
+        random_story = queryset.random()
+        if random_story is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
         return Response(self.get_serializer(random_story).data)
 
 
@@ -277,7 +484,10 @@ class CommentViewSet(ModelViewSet):
             # create notification
             if request.user != story.author:
                 message = f'Commented story "{story.title}": {comment_text}'
-                Notification.objects.create(recipient=story.author, sender=user, message=message)
+                Notification.coalesce(
+                    recipient=story.author, sender=user, group_key=f'comment:story:{story.pk}', message=message,
+                    group_message=lambda count: f'{count} new comments on story "{story.title}"'
+                )
 
             return Response(self.get_serializer(comment).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -307,17 +517,16 @@ class CommentViewSet(ModelViewSet):
         comment = self.get_object()
         user = request.user
 
-        if user in comment.likes.all():
-            comment.likes.remove(user)
+        if comment.unlike(user):
             return Response({'liked': False}, status=status.HTTP_200_OK)
         else:
-            comment.likes.add(user)
+            comment.like(user)
             return Response({'liked': True}, status=status.HTTP_200_OK)
 
 
 class SavedStoryViewSet(ModelViewSet):
     queryset = SavedStory.objects.all()
-    pagination_class = MyPagePagination
+    pagination_class = SavedStoryKeysetPagination
     serializer_class = SavedStorySerializer
     permission_classes = [IsAuthenticated]
 
@@ -336,6 +545,7 @@ class SavedStoryViewSet(ModelViewSet):
     def list(self, request, *args, **kwargs):
         user = request.user
         queryset = self.get_queryset().filter(user=user)
+        queryset = queryset.prefetch_related(Prefetch('story', queryset=Story.objects.with_stats(user)))
         queryset = self.paginate_queryset(queryset)
         serializer = self.get_serializer(queryset, many=True)
         return self.get_paginated_response(serializer.data)
@@ -388,6 +598,43 @@ class EpisodeViewSet(ModelViewSet):
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_403_FORBIDDEN)
 
+    @action(detail=True, methods=['POST'], url_path='reorder', url_name='reorder')
+    def reorder_messages(self, request, pk=None):
+        episode = self.get_object()
+        if check_story_authorship(episode.story, request.user):
+            message_ids = request.data.get('messages')
+            if (not isinstance(message_ids, list) or not all(type(message_id) is int for message_id in message_ids)
+                    or len(set(message_ids)) != len(message_ids)):
+                return Response({'message': 'messages must be a list of unique message ids.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            with transaction.atomic():
+                # no message can be added or removed between the check and the renumbering
+                episode.lock()
+                if set(message_ids) != set(episode.messages.values_list('id', flat=True)):
+                    return Response({'message': 'messages must contain every message of the episode.'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+                messages = episode.rebalance_message_orders(message_ids)
+            return Response({'messages': [{'id': message.id, 'order': message.order} for message in messages]},
+                            status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['GET'], url_path='bundle', url_name='bundle')
+    def get_bundle(self, request, pk=None):
+        episode = get_object_or_404(Episode, pk=pk)
+        bundle = EpisodeBundle.get_payload(episode)
+
+        for message in bundle['messages']:
+            for field in EpisodeBundle.MEDIA_FIELDS:
+                if field in message:
+                    message[field] = request.build_absolute_uri(message[field])
+
+        # not part of the stored bundle, a new episode of the story must not invalidate its predecessor
+        bundle['next_episode'] = Episode.objects.filter(story_id=episode.story_id).filter(
+            Q(created_at__gt=episode.created_at) | Q(created_at=episode.created_at, id__gt=episode.id)
+        ).order_by('created_at', 'id').values_list('id', flat=True).first()
+        return Response(bundle)
+
     @action(detail=True, methods=['GET'], url_path='messages', url_name='messages')
     def get_messages(self, request, pk=None):
         episode = get_object_or_404(Episode, pk=pk)
@@ -395,16 +642,25 @@ class EpisodeViewSet(ModelViewSet):
         queryset = queryset.select_related('character')
         paginator = FixedPagePagination()
 
-        user_status = UserStoryStatus.objects.filter(user=request.user, story=episode.story).first()
         page_number = request.GET.get('page', None)
+        last_read_message = None
+        if not page_number:
+            # a position that is not written yet is newer than the stored one
+            position = progress_buffer.position(request.user.pk, episode.story_id)
+            if position:
+                last_read_message = Message.objects.filter(pk=position[1]).first()
+            else:
+                user_status = UserStoryStatus.objects.filter(
+                    user=request.user, story_id=episode.story_id
+                ).select_related('message').first()
+                last_read_message = user_status and user_status.message
 
         # If the user has a status entry for the current episode, fetch messages starting from the last read message
-        if not page_number and user_status and user_status.message:
-            last_read_message = user_status.message
-            try:
-                message_index = list(queryset).index(last_read_message)
+        if not page_number and last_read_message:
+            if last_read_message.episode_id == episode.id:
+                message_index = episode.get_message_index(last_read_message)
                 page_number = (message_index // paginator.page_size) + 1
-            except ValueError:
+            else:
                 page_number = 1
         else:
             page_number = 1 if page_number is None else int(page_number)
@@ -413,9 +669,17 @@ class EpisodeViewSet(ModelViewSet):
         request.GET['page'] = page_number
         request.GET._mutable = False
 
-        queryset = paginator.paginate_queryset(queryset, request, view=self)
-        serializer = MessageSerializer(queryset, many=True, context={'request': request})
-        return paginator.get_paginated_response(serializer.data)
+        def build():
+            page = paginator.paginate_queryset(queryset, request, view=self)
+            serializer = MessageSerializer(page, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data)
+
+        # the resolved page is part of the tag, the resume position can move it without changing the url
+        messages = episode.messages.aggregate(last_modified=Max('updated_at'), count=Count('id'))
+        return conditional_response(
+            request, [page_number, messages, get_versions([('story', episode.story_id)])], build,
+            last_modified=messages['last_modified']
+        )
 
 
 class MessageViewSet(ModelViewSet):
@@ -431,18 +695,61 @@ class MessageViewSet(ModelViewSet):
             return Response(status=status.HTTP_403_FORBIDDEN)
 
         try:
-            order = validate_unique_order(data.get('order'), episode, Message.objects.filter(episode=episode))
+            order = validate_order(data.get('order'))
         except ValidationError as err:
             return Response({'message': str(err.messages[0])}, status=status.HTTP_400_BAD_REQUEST)
 
         message_type = data.get('message_type')
-        message = self.create_message(episode, order, message_type, data)
+        try:
+            with transaction.atomic():
+                message = self.create_message(episode, order, message_type, data)
+        except IntegrityError:
+            return Response({'message': DUPLICATE_ORDER_MESSAGE}, status=status.HTTP_400_BAD_REQUEST)
 
         if not message:
             return Response({'message': 'Invalid message type.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        episode.keep_order_gap(message)
         return Response(self.get_serializer(message).data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['POST'], url_path='bulk', url_name='bulk')
+    def bulk_create(self, request):
+        data = request.data
+        episode = get_object_or_404(Episode.objects.select_related('story'), pk=data.get('episode'))
+
+        if request.user != episode.story.author:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        items = data.get('messages')
+        if isinstance(items, str):
+            # multipart requests send the message list as a JSON field next to the files
+            try:
+                items = json.loads(items)
+            except ValueError:
+                items = None
+        if not isinstance(items, list) or not 0 < len(items) <= MAX_BULK_MESSAGES:
+            return Response({'message': f'messages must be a list of 1 to {MAX_BULK_MESSAGES} messages.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        messages, errors = build_messages(episode, items, request.FILES)
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with transaction.atomic():
+                messages = Message.objects.bulk_create(messages, batch_size=500)
+                # bulk inserts skip the signals that count media references and create image variants
+                MediaBlob.acquire(getattr(message, field).name for message in messages
+                                  for field in EpisodeBundle.MEDIA_FIELDS)
+                for message in messages:
+                    if message.image_content:
+                        schedule_variants(message)
+                EpisodeBundle.invalidate(pk=episode.pk)
+        except IntegrityError:
+            return Response({'message': DUPLICATE_ORDER_MESSAGE}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(self.get_serializer(messages, many=True).data, status=status.HTTP_201_CREATED)
+
     def create_message(self, episode, order, message_type, data):
         if message_type == 'status':
             return Message.objects.create(
@@ -452,19 +759,17 @@ class MessageViewSet(ModelViewSet):
         else:
             character = get_object_or_404(Character, pk=data.get('character'))
 
-            message_content = {
-                'text': 'text_content',
-                'image': 'image_content',
-                'video': 'video_content',
-                'audio': 'audio_content'
-            }.get(message_type)
+            message_content = MESSAGE_CONTENT_FIELDS.get(message_type)
+            content = data.get(message_content) if message_content else None
+            if message_type in MediaUpload.KINDS and data.get('upload'):
+                content = MediaUpload.claim(data.get('upload'), self.request.user, message_type)
 
-            if not message_content or not data.get(message_content):
+            if not message_content or not content:
                 return None
 
             return Message.objects.create(
                 episode=episode, order=order, character=character,
-                message_type=message_type, **{message_content: data.get(message_content)}
+                message_type=message_type, **{message_content: content}
             )
 
     def update(self, request, *args, **kwargs):
@@ -474,37 +779,43 @@ class MessageViewSet(ModelViewSet):
         if request.user != instance.episode.story.author:
             return Response(status=status.HTTP_403_FORBIDDEN)
 
-        message_type = instance.message_type
-        if message_type == 'status':
-            serializer = self.get_serializer(
-                instance,
-                data={'status_content': data.get('status_content')},
-                partial=True
-            )
-        else:
-            message_content = {
-                'text': 'text_content',
-                'image': 'image_content',
-                'video': 'video_content',
-                'audio': 'audio_content'
-            }.get(message_type)
-
-            update_data = {
-                message_content: data.get(message_content)
-            }
-
-            character = data.get('character')
-            if character:
-                character = get_object_or_404(Character, pk=character)
-                update_data['character'] = character.pk
-
-            serializer = self.get_serializer(instance, data=update_data, partial=True)
+        # claiming an upload locks it, the claim and the save commit or roll back together
+        with transaction.atomic():
+            message_type = instance.message_type
+            if message_type == 'status':
+                serializer = self.get_serializer(
+                    instance,
+                    data={'status_content': data.get('status_content')},
+                    partial=True
+                )
+            else:
+                message_content = MESSAGE_CONTENT_FIELDS.get(message_type)
+
+                update_data = {
+                    message_content: data.get(message_content)
+                }
+                if message_type in MediaUpload.KINDS and data.get('upload'):
+                    name = MediaUpload.claim(data.get('upload'), request.user, message_type)
+                    if not name:
+                        return Response({'message': 'Upload is not complete or does not exist.'},
+                                        status=status.HTTP_400_BAD_REQUEST)
+                    setattr(instance, message_content, name)
+                    update_data = {}
+
+                character = data.get('character')
+                if character:
+                    character = get_object_or_404(Character, pk=character)
+                    update_data['character'] = character.pk
+
+                serializer = self.get_serializer(instance, data=update_data, partial=True)
 
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data)
-        else:
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            if serializer.is_valid():
+                serializer.save()
+                return Response(serializer.data)
+            else:
+                # hands a claimed upload back instead of dropping it with the rejected change
+                transaction.set_rollback(True)
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -520,11 +831,72 @@ class MessageViewSet(ModelViewSet):
             return Response(status=status.HTTP_403_FORBIDDEN)
 
         try:
-            order = validate_unique_order(request.data.get('order'), message.episode,
-                                          Message.objects.filter(episode=message.episode))
+            order = validate_order(request.data.get('order'))
         except ValidationError as err:
             return Response({'message': str(err.messages[0])}, status=status.HTTP_400_BAD_REQUEST)
 
         message.order = order
-        message.save()
+        try:
+            with transaction.atomic():
+                message.save(update_fields=['order', 'updated_at'])
+        except IntegrityError:
+            return Response({'message': DUPLICATE_ORDER_MESSAGE}, status=status.HTTP_400_BAD_REQUEST)
+
+        message.episode.keep_order_gap(message)
         return Response(status=status.HTTP_200_OK)
+
+
+class MediaUploadViewSet(GenericViewSet):
+    permission_classes = [IsAuthenticated]
+    serializer_class = MediaUploadSerializer
+    lookup_value_regex = '[0-9a-f-]{36}'
+
+    def get_queryset(self):
+        return MediaUpload.objects.filter(owner=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save(owner=request.user)
+            return Response({**serializer.data, 'chunk_size': settings.MEDIA_UPLOAD_CHUNK_SIZE},
+                            status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def retrieve(self, request, pk=None, *args, **kwargs):
+        return Response(self.get_serializer(self.get_object()).data)
+
+    @action(detail=True, methods=['PUT'], url_path='chunk', url_name='chunk')
+    def upload_chunk(self, request, pk=None):
+        # the body is read straight from the request stream, request.data would parse it into memory
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers['Content-Length'])
+            checksum = request.headers['Upload-Checksum']
+        except (KeyError, ValueError):
+            return Response({'message': 'Upload-Offset, Upload-Checksum and Content-Length headers are required.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < length <= settings.MEDIA_UPLOAD_CHUNK_SIZE:
+            return Response({'message': f'Chunks must be 1 to {settings.MEDIA_UPLOAD_CHUNK_SIZE} bytes.'},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        with transaction.atomic():
+            upload = get_object_or_404(self.get_queryset().select_for_update(), pk=pk)
+            if offset != upload.received:
+                return Response({'message': 'Offset does not match the received size.', 'offset': upload.received},
+                                status=status.HTTP_409_CONFLICT)
+            try:
+                upload.write_chunk(request.stream, length, checksum)
+            except ValidationError as err:
+                return Response({'message': str(err.messages[0]), 'offset': upload.received},
+                                status=status.HTTP_400_BAD_REQUEST)
+        return Response({'offset': upload.received}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['POST'], url_path='complete', url_name='complete')
+    def complete(self, request, pk=None):
+        with transaction.atomic():
+            upload = get_object_or_404(self.get_queryset().select_for_update(), pk=pk)
+            try:
+                upload.complete()
+            except ValidationError as err:
+                return Response({'message': str(err.messages[0])}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(upload).data, status=status.HTTP_200_OK)
@@ -3,7 +3,6 @@ import {Link, useNavigate} from "react-router-dom";
 import {useAppDispatch, useAppSelector} from "../app/hooks";
 import {logout} from "../features/authentication/authenticationSlice";
 import {Notifications} from "../features/notification/Notifications";
-import {countUnreadNotifications} from "../features/notification/notificationThunk";
 import {resetNotificationsCount} from "../features/notification/notificationSlice";
 import {randomStory} from "../features/story/storyThunks";
 
@@ -40,10 +39,6 @@ export const Navbar: React.FC = () => {
         }
     }, [setMenuVisible, menuVisible])
 
-    useEffect(() => {
-        dispatch(countUnreadNotifications({}))
-    }, [])
-
     const handleLogout = () => {
         dispatch(logout())
     }
@@ -1,7 +1,7 @@
 import React from "react";
 import useWebSocket from "react-use-websocket";
 import {useAppDispatch, useAppSelector} from "../app/hooks";
-import {addNewNotification} from "../features/notification/notificationSlice";
+import {addNewNotification, setNotificationsCount} from "../features/notification/notificationSlice";
 import {listNotifications} from "../features/notification/notificationThunk";
 
 export const WebSocketComponent: React.FC = () => {
@@ -10,8 +10,10 @@ export const WebSocketComponent: React.FC = () => {
     const {access, isAuthenticated} = useAppSelector(state => state.authentication)
     const {notifications} = useAppSelector(state => state.notification)
 
-    const handleNewNotification = (event: MessageEvent<any>) => {
-        const notification = JSON.parse(event.data)
+    const handleNewNotification = (notification: any) => {
+        if (notifications.length === 0) {
+            dispatch(listNotifications({}))
+        }
         dispatch(addNewNotification(notification))
     }
 
@@ -20,10 +22,13 @@ export const WebSocketComponent: React.FC = () => {
         onOpen: () => console.log('WebSocket connection opened.'),
         onClose: () => console.log('WebSocket connection closed.'),
         onMessage: (event) => {
-            if (notifications.length === 0) {
-                dispatch(listNotifications({}))
+            const data = JSON.parse(event.data)
+            // the server sends the unread count on connect and whenever it changes
+            if (data.type === 'unread_count') {
+                dispatch(setNotificationsCount(data.count))
+            } else {
+                handleNewNotification(data)
             }
-            handleNewNotification(event)
         },
         shouldReconnect: (closeEvent) => {
             return !!isAuthenticated;
@@ -10,6 +10,7 @@ type Notification = {
     recipient: number
     sender: User | null
     message: string
+    count: number
     is_read: boolean
     created_at: string
 }
@@ -48,7 +49,9 @@ const notificationSlice = createSlice({
         addNewNotification(state, action: PayloadAction<Notification>) {
             state.notifications = []
             // state.notifications = [action.payload, ...state.notifications]
-            state.notificationsCount++
+        },
+        setNotificationsCount(state, action: PayloadAction<number>) {
+            state.notificationsCount = action.payload
         },
         resetNotificationsCount(state) {
             state.notificationsCount = 0
@@ -77,4 +80,4 @@ const notificationSlice = createSlice({
 })
 
 export default notificationSlice.reducer
-export const {addNewNotification, resetNotificationsCount} = notificationSlice.actions
\ No newline at end of file
+export const {addNewNotification, setNotificationsCount, resetNotificationsCount} = notificationSlice.actions
\ No newline at end of file